@@ -0,0 +1,159 @@
+import os
+import numpy as np
+import pandas as pd
+
+from analysis.stats import proportions_ztest_batch
+from data_process.ingest import parse_file_name
+from gemini.response_parser import ANSWER_CODES, MISSING, NO, YES
+
+# 1度に読み込む行数
+DEFAULT_CHUNKSIZE = 100_000
+
+# read_csv が既定で欠損値とみなす文字列（コンバーターを指定した列には適用されないため、has_text で判定する）
+NA_STRINGS = frozenset([
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN", "<NA>", "N/A", "NA",
+    "NULL", "NaN", "None", "n/a", "nan", "null",
+])
+
+
+class RuleCounts:
+    """
+    指標ごとの yes / no / 回答なし の件数と行数（十分統計量）。
+    行を保持せずに件数だけを加算するため、データ量に関わらず使用メモリは一定です。
+    """
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self.yes = np.zeros(len(self.rules), dtype=np.int64)
+        self.no = np.zeros(len(self.rules), dtype=np.int64)
+        self.missing = np.zeros(len(self.rules), dtype=np.int64)
+        self.rows = 0
+
+    def update(self, matrix):
+        """
+        int8 のルール行列（行: アブストラクト、列: 指標）の件数を加算します。
+        """
+        self.yes += (matrix == YES).sum(axis=0)
+        self.no += (matrix == NO).sum(axis=0)
+        self.missing += (matrix == MISSING).sum(axis=0)
+        self.rows += len(matrix)
+
+    def __iadd__(self, other):
+        self.yes += other.yes
+        self.no += other.no
+        self.missing += other.missing
+        self.rows += other.rows
+        return self
+
+    def to_frame(self):
+        return pd.DataFrame({"Rule": self.rules, "yes": self.yes, "no": self.no, "missing": self.missing})
+
+
+def chunk_to_rules_matrix(chunk, rules):
+    """
+    category 型のルール列をカテゴリのコードから int8 のルール行列に変換します。
+    """
+    matrix = np.empty((len(chunk), len(rules)), dtype=np.int8)
+    for j, rule in enumerate(rules):
+        column = chunk[rule]
+        # コード -1（欠損値）は末尾の MISSING に対応する
+        lookup = np.array([ANSWER_CODES.get(value, MISSING) for value in column.cat.categories] + [MISSING],
+                          dtype=np.int8)
+        matrix[:, j] = lookup[column.cat.codes.to_numpy()]
+    return matrix
+
+
+def has_text(value):
+    """
+    Abstract 列のコンバーター。本文の文字列はデータフレームに残さず、空（欠損値）でないかどうかだけを返します。
+    """
+    return value not in NA_STRINGS
+
+
+def read_rule_chunks(file_path, rules, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    結果のCSVファイルからルール列だけをチャンク単位で読み込み、アブストラクトが空でない行のチャンクを返します。
+    アブストラクトは本文を保持せず、has_text で有無だけを読み込みます。
+    """
+    wanted = set(rules) | {"Abstract"}
+    reader = pd.read_csv(file_path, usecols=lambda column: column in wanted, chunksize=chunksize,
+                         dtype={rule: "category" for rule in rules}, converters={"Abstract": has_text})
+    for chunk in reader:
+        yield chunk[chunk["Abstract"].astype(bool)]
+
+
+def count_file(file_path, rules, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    結果のCSVファイルからルール列（とアブストラクトの有無）だけをチャンク単位で読み込み、件数を数えます。
+    preprocess_data と同様に、アブストラクトが空の行は数えません。
+    """
+    counts = RuleCounts(rules)
+    for chunk in read_rule_chunks(file_path, rules, chunksize):
+        counts.update(chunk_to_rules_matrix(chunk, rules))
+    return counts
+
+
+def aggregate_counts(data_dir, rules, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    結合済みの結果のCSVファイルを1度だけ走査し、分野 × high/low × 指標ごとの件数を集計します。
+    Args:
+        data_dir (str): 結合済みの結果のCSVファイルが格納されたディレクトリ。
+        rules (list): 指標のリスト。
+        chunksize (int): 1度に読み込む行数。
+    Returns:
+        dict: {(分野名, "high" or "low"): RuleCounts}。
+    """
+    counts = {}
+    for filename in sorted(os.listdir(data_dir)):
+        if not filename.endswith(".csv"):
+            continue
+        field, citation = parse_file_name(os.path.splitext(filename)[0])
+        if citation is None:
+            continue
+        file_counts = count_file(os.path.join(data_dir, filename), rules, chunksize)
+        if (field, citation) in counts:
+            counts[(field, citation)] += file_counts
+        else:
+            counts[(field, citation)] = file_counts
+    return counts
+
+
+def yes_ratios_from_counts(counts):
+    """
+    件数から calculate_yes_ratios と同じ形式の yes 比率のデータフレームを作成します。
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratios = counts.yes / counts.rows
+    return pd.DataFrame({"Rule": counts.rules, "Yes Ratio": ratios})
+
+
+def ztest_from_counts(high_counts, low_counts):
+    """
+    件数から calculate_ztest と同じ形式のz検定の結果を作成します。
+    """
+    stat, p_value = proportions_ztest_batch(high_counts.yes, high_counts.rows, low_counts.yes, low_counts.rows)
+    return pd.DataFrame({"Rule": high_counts.rules, "Z-statistic": stat, "P-value": p_value})
+
+
+def calculate_group_results_streaming(data_dir, rules, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    calculate_group_results と同じ結果を、データフレームを保持せずに件数の集計から計算します。
+    Returns:
+        dict: {名前: ((Highのyes比率, Lowのyes比率), z検定の結果)}。名前は "Overall" と分野名。
+    """
+    counts = aggregate_counts(data_dir, rules, chunksize)
+    fields = [field for field, citation in counts if citation == "high" and (field, "low") in counts]
+    overall_high, overall_low = RuleCounts(rules), RuleCounts(rules)
+    for (field, citation), group_counts in counts.items():
+        if citation == "high":
+            overall_high += group_counts
+        else:
+            overall_low += group_counts
+    groups = {"Overall": (overall_high, overall_low)}
+    groups.update((field, (counts[(field, "high")], counts[(field, "low")])) for field in fields)
+
+    results = {}
+    for name, (high_counts, low_counts) in groups.items():
+        ratios = (yes_ratios_from_counts(high_counts), yes_ratios_from_counts(low_counts))
+        results[name] = (ratios, ztest_from_counts(high_counts, low_counts))
+    return results
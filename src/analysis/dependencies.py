@@ -0,0 +1,121 @@
+import os
+import json
+import numpy as np
+
+from gemini.response_parser import ANSWER_CODES
+
+DEFAULT_SPEC_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "prompt", "rule_dependencies.json")
+
+
+def rule_index(rule):
+    """
+    "rule7" のような指標名から行列の列番号（0始まり）を返します。
+    """
+    return int(rule.replace("rule", "")) - 1
+
+
+def load_dependency_spec(path=DEFAULT_SPEC_PATH):
+    """
+    指標の依存関係の定義ファイル（JSON）を読み込みます。
+    Args:
+        path (str): 定義ファイルのパス。
+    Returns:
+        dict: 依存関係の定義。
+    """
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+class CompiledDependencies:
+    """
+    依存関係の定義をDAGとしてコンパイルしたもの。
+    依存先の指標が確定してから依存元を書き換えるよう、トポロジカル順のレベルごとに制約をまとめます。
+    同じ指標に複数の制約が該当する場合は precedence の先頭の値を優先します。
+    """
+
+    def __init__(self, levels):
+        # levels: [(親の列番号, 親の値, 子の列番号, 設定する値), ...] の配列のリスト
+        self.levels = levels
+
+    def apply(self, matrix, inplace=False):
+        """
+        int8 のルール行列（yes=1, no=0, 欠損=-1）に依存関係を適用します。
+        Args:
+            matrix (ndarray): ルール行列。
+            inplace (bool): Trueの場合は入力の行列を直接書き換えます。
+        Returns:
+            ndarray: 依存関係を適用したルール行列。
+        """
+        if not inplace:
+            matrix = matrix.copy()
+        width = matrix.shape[1]
+        for parents, parent_codes, children, set_codes in self.levels:
+            valid = (parents < width) & (children < width)
+            parents, parent_codes, children, set_codes = parents[valid], parent_codes[valid], children[valid], set_codes[valid]
+            # 同じレベルの条件は確定済みの親の値だけを参照するため、マスクを一度に計算できる
+            fired = matrix[:, parents] == parent_codes
+            # 優先度の低い制約から順に書き込み、優先度の高い制約で上書きする
+            for j in range(len(children)):
+                matrix[fired[:, j], children[j]] = set_codes[j]
+        return matrix
+
+
+def compile_dependencies(spec):
+    """
+    依存関係の定義をDAGとしてコンパイルします。循環がある場合は ValueError を送出します。
+    Args:
+        spec (dict): load_dependency_spec で読み込んだ定義。
+    Returns:
+        CompiledDependencies: コンパイル済みの依存関係。
+    """
+    precedence = spec.get("precedence", ["no", "yes"])
+    constraints = []
+    for dependency in spec["dependencies"]:
+        for child in dependency["then"]:
+            constraints.append((dependency["when"], dependency["is"], child, dependency["set"]))
+
+    # 各指標のレベル（依存の深さ）を求める
+    parents_of = {}
+    for parent, _, child, _ in constraints:
+        parents_of.setdefault(child, set()).add(parent)
+        parents_of.setdefault(parent, set())
+
+    levels_of = {}
+    visiting = set()
+
+    def level(rule):
+        if rule in levels_of:
+            return levels_of[rule]
+        if rule in visiting:
+            raise ValueError(f"依存関係が循環しています: {rule}")
+        visiting.add(rule)
+        levels_of[rule] = max((level(parent) + 1 for parent in parents_of[rule]), default=0)
+        visiting.discard(rule)
+        return levels_of[rule]
+
+    for rule in parents_of:
+        level(rule)
+
+    # レベルごとに、優先度の低い順（precedence の末尾から）に並べる
+    priority = {value: len(precedence) - i for i, value in enumerate(precedence)}
+    grouped = {}
+    for constraint in constraints:
+        grouped.setdefault(levels_of[constraint[2]], []).append(constraint)
+
+    levels = []
+    for depth in sorted(grouped):
+        ordered = sorted(grouped[depth], key=lambda constraint: priority.get(constraint[3], 0))
+        levels.append((
+            np.array([rule_index(parent) for parent, _, _, _ in ordered], dtype=np.intp),
+            np.array([ANSWER_CODES[value] for _, value, _, _ in ordered], dtype=np.int8),
+            np.array([rule_index(child) for _, _, child, _ in ordered], dtype=np.intp),
+            np.array([ANSWER_CODES[value] for _, _, _, value in ordered], dtype=np.int8),
+        ))
+    return CompiledDependencies(levels)
+
+
+def load_dependencies(path=DEFAULT_SPEC_PATH):
+    """
+    定義ファイルを読み込み、コンパイル済みの依存関係を返します。
+    """
+    return compile_dependencies(load_dependency_spec(path))
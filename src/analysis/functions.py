@@ -1,50 +1,60 @@
 import os
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-from statsmodels.stats.proportion import proportions_ztest
 
-# 日本語フォント設定（例: Hiragino Sans）
-import matplotlib.font_manager as fm
-plt.rcParams['font.family'] = 'Hiragino Sans'
+from analysis.stats import count_yes, proportions_ztest_batch
+from analysis.dependencies import DEFAULT_SPEC_PATH, load_dependencies
+from gemini.response_parser import ANSWER_LABELS, frame_to_rules_matrix
 
-def process_csv_with_dependencies(input_path, output_path):
+# 日本語フォントの候補（先頭から順に、インストールされているものを使用する）
+JAPANESE_FONTS = ['Hiragino Sans', 'Noto Sans CJK JP', 'Noto Sans JP', 'IPAexGothic', 'IPAGothic',
+                  'Yu Gothic', 'Meiryo', 'TakaoGothic', 'VL Gothic']
+
+def find_japanese_font():
+    """
+    インストールされている日本語フォントを候補から探します。見つからない場合は None を返します。
+    """
+    from matplotlib import font_manager
+
+    available = {font.name for font in font_manager.fontManager.ttflist}
+    for font in JAPANESE_FONTS:
+        if font in available:
+            return font
+    return None
+
+def load_pyplot():
+    """
+    matplotlib.pyplot を読み込み、日本語フォントを設定して返します。
+    グラフを描画する関数の中でのみ読み込むため、集計だけを行う場合は matplotlib を読み込みません。
+    """
+    import matplotlib.pyplot as plt
+
+    # 日本語フォント設定（Hiragino Sans がない環境では他の日本語フォント、なければ既定のフォント）
+    font = find_japanese_font()
+    if font is not None:
+        plt.rcParams['font.family'] = font
+    return plt
+
+def process_csv_with_dependencies(input_path, output_path, spec_path=DEFAULT_SPEC_PATH):
     """
     指定されたCSVファイルを読み込み、依存関係に基づいて値を変更し、結果を保存します。
+    依存関係は定義ファイル（src/prompt/rule_dependencies.json）から読み込み、DAGとして一括で適用します。
     Args:
         input_path (str): 入力CSVファイルのパス。
         output_path (str): 更新されたCSVファイルを保存するパス。
+        spec_path (str): 依存関係の定義ファイルのパス。
     """
-    
-    # noのときに依存するルール
-    no_dependencies = {
-        'rule1': ['rule2', 'rule3', 'rule4'],
-        'rule5': ['rule6', 'rule7', 'rule8', 'rule9', 'rule10'],
-        'rule11': ['rule12'],
-        'rule13': ['rule15'],
-        'rule17': ['rule18', 'rule19', 'rule20', 'rule21', 'rule22', 'rule23', 'rule24', 'rule27'],
-        'rule25': ['rule26', 'rule28'],
-    }
-    
-    # yesのときに依存するルール
-    yes_dependencies = {
-        'rule6': ['rule7'],  # 特別: rule6がyesの場合、rule7もyesにする
-    }
-    
     # CSVファイルの読み込み
     df = pd.read_csv(input_path)
-    
-    # noの依存関係に基づいて値を変更
-    for key_rule, dependent_rules in no_dependencies.items():
-        for dependent_rule in dependent_rules:
-            # key_ruleが"no"の場合、dependent_rulesをすべて"no"に変更
-            df.loc[df[key_rule] == 'no', dependent_rule] = 'no'
-    
-    # yesの依存関係に基づいて値を変更
-    for key_rule, dependent_rules in yes_dependencies.items():
-        for dependent_rule in dependent_rules:
-            # key_ruleが"yes"の場合、dependent_rulesをすべて"yes"に変更
-            df.loc[df[key_rule] == 'yes', dependent_rule] = 'yes'
+    rules = [column for column in df.columns if column.startswith('rule') and column[4:].isdigit()]
+
+    # ルール行列に変換して依存関係を適用
+    original = frame_to_rules_matrix(df, rules)
+    matrix = load_dependencies(spec_path).apply(original)
+    # 依存関係で値が変わったセルだけを書き換える（"yes"/"no" 以外の値や依存関係のない列はそのまま残す）
+    changed = matrix != original
+    for j in np.flatnonzero(changed.any(axis=0)):
+        df.loc[changed[:, j], rules[j]] = ANSWER_LABELS[matrix[changed[:, j], j]]
     
     # 書き換えた結果を保存
     df.to_csv(output_path, index=False)
@@ -66,18 +76,33 @@ def load_data(data_dir):
 def preprocess_data(df):
     return df.dropna(subset=['Abstract'])
 
+def calculate_group_results(data_dir, rules):
+    """
+    結合済みの結果を読み込み、全体（Overall）と分野ごとのyes比率とz検定の結果を計算します。
+    Args:
+        data_dir (str): 結合済みの結果のCSVファイルが格納されたディレクトリ。
+        rules (list): 指標のリスト。
+    Returns:
+        dict: {名前: ((Highのyes比率, Lowのyes比率), z検定の結果)}。
+    """
+    high_group, low_group = load_data(data_dir)
+    groups = {"Overall": (pd.concat(high_group.values()), pd.concat(low_group.values()))}
+    groups.update((field, (high_group[field], low_group[field])) for field in high_group if field in low_group)
+
+    results = {}
+    for name, (high_df, low_df) in groups.items():
+        high_df = preprocess_data(high_df)
+        low_df = preprocess_data(low_df)
+        ratios = (calculate_yes_ratios(high_df, rules), calculate_yes_ratios(low_df, rules))
+        results[name] = (ratios, calculate_ztest(high_df, low_df, rules))
+    return results
+
 def calculate_ztest(high_df, low_df, rules):
-    results = []
-    for rule in rules:
-        high_yes = (high_df[rule] == 'yes').sum()
-        low_yes = (low_df[rule] == 'yes').sum()
-        high_total = len(high_df)
-        low_total = len(low_df)
-        count = [high_yes, low_yes]
-        nobs = [high_total, low_total]
-        stat, p_value = proportions_ztest(count, nobs, alternative='two-sided')
-        results.append({'Rule': rule, 'Z-statistic': stat, 'P-value': p_value})
-    return pd.DataFrame(results)
+    # 全指標の件数を一括で数え、z検定もまとめて計算する
+    high_yes, high_total = count_yes(high_df, rules)
+    low_yes, low_total = count_yes(low_df, rules)
+    stat, p_value = proportions_ztest_batch(high_yes, high_total, low_yes, low_total)
+    return pd.DataFrame({'Rule': rules, 'Z-statistic': stat, 'P-value': p_value})
 
 def save_results(data, output_dir, filename):
     """
@@ -92,7 +117,27 @@ def save_results(data, output_dir, filename):
     data.to_csv(file_path, index=False, encoding='utf-8-sig')
     print(f'データを保存しました: {file_path}')
 
-def visualize_results(results_df, graph_dir, data_dir, field, y_axis_limit):
+def draw_ztest(ax, results_df, field, y_axis_limit):
+    """
+    Z値の棒グラフを指定した Axes に描画します。
+    """
+    x_positions = range(len(results_df))
+    ax.bar(x_positions, results_df['Z-statistic'], color='skyblue', edgecolor='black')
+    ax.axhline(y=0, color='black', linestyle='-', linewidth=1)
+    ax.axhline(y=3.29, color='red', linestyle='--', label='0.001 有意水準 (+3.29)')
+    ax.axhline(y=-3.29, color='red', linestyle='--', label='0.001 有意水準 (-3.29)')
+
+    # 縦軸の範囲を固定
+    ax.set_ylim(-y_axis_limit, y_axis_limit)
+
+    ax.set_title(f'{field}のZ値分布', fontsize=16)
+    ax.set_xlabel('評価指標', fontsize=14)
+    ax.set_ylabel('Z値', fontsize=14)
+    ax.set_xticks(list(x_positions))
+    ax.set_xticklabels(results_df['Rule'], fontsize=16)
+    ax.legend(fontsize=12)
+
+def visualize_results(results_df, graph_dir, data_dir, field, y_axis_limit, show=True):
     """
     グラフと数値データを保存します。
     Args:
@@ -100,33 +145,25 @@ def visualize_results(results_df, graph_dir, data_dir, field, y_axis_limit):
         graph_dir (str): グラフ保存先ディレクトリ。
         data_dir (str): データ保存先ディレクトリ。
         field (str): 分野名。
+        show (bool): Trueの場合はグラフを表示します。Falseの場合は保存後に閉じます（画面のない環境向け）。
     """
     # データを保存
     save_results(results_df, data_dir, f"{field}_results.csv")
 
     # グラフを保存
+    plt = load_pyplot()
     os.makedirs(graph_dir, exist_ok=True)
-    x_positions = range(len(results_df))
-    plt.figure(figsize=(12, 6))
-    plt.bar(x_positions, results_df['Z-statistic'], color='skyblue', edgecolor='black')
-    plt.axhline(y=0, color='black', linestyle='-', linewidth=1)
-    plt.axhline(y=3.29, color='red', linestyle='--', label='0.001 有意水準 (+3.29)')
-    plt.axhline(y=-3.29, color='red', linestyle='--', label='0.001 有意水準 (-3.29)')
-    
-    # 縦軸の範囲を固定
-    plt.ylim(-y_axis_limit, y_axis_limit)
-    
-    plt.title(f'{field}のZ値分布', fontsize=16)
-    plt.xlabel('評価指標', fontsize=14)
-    plt.ylabel('Z値', fontsize=14)
-    plt.xticks(ticks=x_positions, labels=results_df['Rule'], fontsize=16)
-    plt.legend(fontsize=12)
-    plt.tight_layout()
+    fig, ax = plt.subplots(figsize=(12, 6))
+    draw_ztest(ax, results_df, field, y_axis_limit)
+    fig.tight_layout()
 
     output_file = os.path.join(graph_dir, f'{field}_ztest_visualization.png')
-    plt.savefig(output_file)
+    fig.savefig(output_file)
     print(f'グラフを保存しました: {output_file}')
-    plt.show()
+    if show:
+        plt.show()
+    else:
+        plt.close(fig)
 
 def calculate_yes_ratios(df, rules):
     """
@@ -161,19 +198,27 @@ def save_yes_ratio_graph(high_ratios, low_ratios, output_dir, title):
         low_ratios['Rule'] = low_ratios['Rule'].str.replace('rule', '').astype(int)
     
     # グラフの作成
-    plt.figure(figsize=(12, 6))
-    x = high_ratios['Rule']  # 数値型に変換済みのRule列
-    plt.bar(x - 0.2, high_ratios['Yes Ratio'], width=0.4, label='Highグループ', color='skyblue', align='center')
-    plt.bar(x + 0.2, low_ratios['Yes Ratio'], width=0.4, label='Lowグループ', color='salmon', align='center')
-    plt.xlabel('指標', fontsize=14)
-    plt.ylabel('Yesの比率', fontsize=14)
-    plt.title(title, fontsize=16)
-    plt.legend(fontsize=12)
-    plt.xticks(rotation=90)
-    plt.tight_layout()
+    plt = load_pyplot()
+    fig, ax = plt.subplots(figsize=(12, 6))
+    draw_yes_ratios(ax, high_ratios, low_ratios, title)
+    fig.tight_layout()
     
     # グラフの保存
     graph_path = os.path.join(output_dir, f"{title}_yes_ratio.png")
-    plt.savefig(graph_path)
+    fig.savefig(graph_path)
     print(f"Yes比率のグラフを保存しました: {graph_path}")
-    plt.close()
+    plt.close(fig)
+
+def draw_yes_ratios(ax, high_ratios, low_ratios, title):
+    """
+    High/LowグループのYes比率の棒グラフを指定した Axes に描画します。
+    Rule列は数値（指標の番号）である必要があります。
+    """
+    x = high_ratios['Rule']
+    ax.bar(x - 0.2, high_ratios['Yes Ratio'], width=0.4, label='Highグループ', color='skyblue', align='center')
+    ax.bar(x + 0.2, low_ratios['Yes Ratio'], width=0.4, label='Lowグループ', color='salmon', align='center')
+    ax.set_xlabel('指標', fontsize=14)
+    ax.set_ylabel('Yesの比率', fontsize=14)
+    ax.set_title(title, fontsize=16)
+    ax.legend(fontsize=12)
+    ax.tick_params(axis='x', labelrotation=90)
@@ -0,0 +1,185 @@
+import os
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from analysis.functions import draw_ztest, draw_yes_ratios, load_pyplot
+from analysis.aggregate import calculate_group_results_streaming
+
+# 描画済みのグラフと入力データのハッシュの対応を保存するファイル（グラフの保存先ディレクトリに置く）
+HASH_FILE_NAME = ".plot_hashes.json"
+
+# 描画内容を変更した場合はこの値を変え、既存のグラフを描き直す
+RENDER_VERSION = 1
+
+FIGURE_SIZE = (12, 6)
+
+
+def build_plot_tasks(results, graph_dir, y_axis_limit=25, field_y_axis_limit=13):
+    """
+    calculate_group_results（または calculate_group_results_streaming）の結果から、z値とyes比率のグラフの描画タスクを作成します。
+    Args:
+        results (dict): {名前: ((Highのyes比率, Lowのyes比率), z検定の結果)}。
+        graph_dir (str): グラフの保存先ディレクトリ。
+        y_axis_limit (float): Overall のz値のグラフの縦軸の範囲。
+        field_y_axis_limit (float): 分野ごとのz値のグラフの縦軸の範囲。
+    Returns:
+        list: 描画タスクのリスト。
+    """
+    tasks = []
+    for name, ((high_ratios, low_ratios), ztest_df) in results.items():
+        tasks.append({
+            "kind": "ztest",
+            "output_file": os.path.join(graph_dir, f"{name}_ztest_visualization.png"),
+            "params": {"field": name, "y_axis_limit": y_axis_limit if name == "Overall" else field_y_axis_limit},
+            "data": {"results_df": ztest_df},
+        })
+        tasks.append({
+            "kind": "yes_ratio",
+            "output_file": os.path.join(graph_dir, f"{name}_yes_ratio.png"),
+            "params": {"title": name},
+            "data": {"high_ratios": rule_numbers(high_ratios), "low_ratios": rule_numbers(low_ratios)},
+        })
+    return tasks
+
+
+def rule_numbers(ratios):
+    """
+    Rule列を指標の番号（数値）に変換したコピーを返します。
+    """
+    from pandas.api.types import is_numeric_dtype
+
+    ratios = ratios.copy()
+    # pandas 3 では文字列の列が object ではなく str 型になるため、数値以外の場合はすべて変換する
+    if not is_numeric_dtype(ratios['Rule']):
+        ratios['Rule'] = ratios['Rule'].astype(str).str.replace('rule', '').astype(int)
+    return ratios
+
+
+def task_hash(task):
+    """
+    描画タスクの入力（種類・パラメーター・データ）のハッシュを計算します。
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps([RENDER_VERSION, task["kind"], task["params"]], sort_keys=True).encode("utf-8"))
+    for key in sorted(task["data"]):
+        digest.update(key.encode("utf-8"))
+        digest.update(task["data"][key].to_csv(index=False).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def load_hashes(graph_dir):
+    path = os.path.join(graph_dir, HASH_FILE_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def save_hashes(graph_dir, hashes):
+    path = os.path.join(graph_dir, HASH_FILE_NAME)
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(hashes, file, ensure_ascii=False, indent=2, sort_keys=True)
+
+
+# ワーカープロセスごとの状態（図のテンプレートは種類ごとに1度だけ作成し、描画のたびに再利用する）
+_worker = {}
+
+
+def _init_worker():
+    # 画面のない環境でも描画できるように Agg バックエンドを使用する
+    import matplotlib
+
+    matplotlib.use("Agg")
+    _worker["plt"] = load_pyplot()
+    _worker["figures"] = {}
+
+
+def _figure(kind):
+    figures = _worker["figures"]
+    if kind not in figures:
+        figures[kind] = _worker["plt"].subplots(figsize=FIGURE_SIZE)
+    fig, ax = figures[kind]
+    ax.clear()
+    return fig, ax
+
+
+def _render_task(task):
+    fig, ax = _figure(task["kind"])
+    if task["kind"] == "ztest":
+        draw_ztest(ax, task["data"]["results_df"], **task["params"])
+    else:
+        draw_yes_ratios(ax, task["data"]["high_ratios"], task["data"]["low_ratios"], **task["params"])
+    fig.tight_layout()
+    fig.savefig(task["output_file"])
+    return task["output_file"]
+
+
+def render_plots(tasks, graph_dir, workers=None, force=False):
+    """
+    描画タスクを Agg バックエンドのプロセスプールで並列に描画し、PNGとして保存します。
+    入力データのハッシュが前回の描画時から変わっていないグラフはスキップします。
+    Args:
+        tasks (list): build_plot_tasks で作成した描画タスク。
+        graph_dir (str): グラフの保存先ディレクトリ。
+        workers (int, optional): ワーカープロセス数。Noneの場合はCPU数。
+        force (bool): Trueの場合、変更のないグラフも描き直します。
+    Returns:
+        list: 描画したグラフのパスのリスト。
+    Raises:
+        RuntimeError: 描画に失敗したグラフがある場合（描画できたグラフのハッシュは保存した後に送出します）。
+    """
+    os.makedirs(graph_dir, exist_ok=True)
+    hashes = load_hashes(graph_dir)
+    pending = []
+    for task in tasks:
+        key = os.path.basename(task["output_file"])
+        task["hash"] = task_hash(task)
+        if force or hashes.get(key) != task["hash"] or not os.path.exists(task["output_file"]):
+            pending.append(task)
+
+    print(f"{len(tasks)} 件のグラフのうち {len(tasks) - len(pending)} 件は変更がないためスキップします。")
+    if not pending:
+        return []
+
+    workers = min(workers or os.cpu_count() or 1, len(pending))
+    rendered = []
+    failed = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        futures = {executor.submit(_render_task, task): task for task in pending}
+        for future in as_completed(futures):
+            task = futures[future]
+            try:
+                output_file = future.result()
+            except Exception as e:
+                print(f"グラフの描画に失敗しました: {task['output_file']}: {e}")
+                failed.append(task["output_file"])
+                continue
+            hashes[os.path.basename(output_file)] = task["hash"]
+            rendered.append(output_file)
+            print(f"グラフを保存しました: {output_file}")
+
+    save_hashes(graph_dir, hashes)
+    if failed:
+        raise RuntimeError(f"{len(failed)} 件のグラフの描画に失敗しました: {', '.join(sorted(failed))}")
+    return rendered
+
+
+def render_all(data_dir, graph_dir, rules, y_axis_limit=25, field_y_axis_limit=13, workers=None, force=False):
+    """
+    結合済みの結果から、全分野とOverallのz値・yes比率のグラフをまとめて描画します。
+    集計はルール列の件数だけをチャンク単位で数える calculate_group_results_streaming で行います。
+    Args:
+        data_dir (str): 結合済みの結果のCSVファイルが格納されたディレクトリ。
+        graph_dir (str): グラフの保存先ディレクトリ。
+        rules (list): 指標のリスト。
+        y_axis_limit (float): Overall のz値のグラフの縦軸の範囲。
+        field_y_axis_limit (float): 分野ごとのz値のグラフの縦軸の範囲。
+        workers (int, optional): ワーカープロセス数。
+        force (bool): Trueの場合、変更のないグラフも描き直します。
+    Returns:
+        tuple: (calculate_group_results_streaming の結果, 描画したグラフのパスのリスト)。
+    """
+    results = calculate_group_results_streaming(data_dir, rules)
+    tasks = build_plot_tasks(results, graph_dir, y_axis_limit, field_y_axis_limit)
+    return results, render_plots(tasks, graph_dir, workers=workers, force=force)
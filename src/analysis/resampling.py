@@ -0,0 +1,228 @@
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+from analysis.aggregate import DEFAULT_CHUNKSIZE, chunk_to_rules_matrix, read_rule_chunks
+from analysis.stats import bh_correction, holm_correction
+from data_process.ingest import parse_file_name
+from gemini.response_parser import MISSING, YES
+
+# 1ブロックの再標本化で使用するメモリの目安（バイト）
+DEFAULT_BLOCK_BYTES = 64 * 2 ** 20
+
+
+def read_rules_matrix(file_path, rules, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    結果のCSVファイルからルール列だけをチャンク単位で読み込み、int8 のルール行列を返します。
+    count_file と同様に、アブストラクトが空の行は含めません。
+    """
+    matrices = [chunk_to_rules_matrix(chunk, rules) for chunk in read_rule_chunks(file_path, rules, chunksize)]
+    return np.concatenate(matrices) if matrices else np.empty((0, len(rules)), dtype=np.int8)
+
+
+def load_group_matrices(data_dir, rules, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    結合済みの結果のCSVファイルから、分野 × high/low ごとのルール行列を読み込みます。
+
+    Returns:
+        dict: {(分野名, "high" or "low"): int8 のルール行列}。
+    """
+    groups = {}
+    for filename in sorted(os.listdir(data_dir)):
+        if not filename.endswith(".csv"):
+            continue
+        field, citation = parse_file_name(os.path.splitext(filename)[0])
+        if citation is None:
+            continue
+        matrix = read_rules_matrix(os.path.join(data_dir, filename), rules, chunksize)
+        if (field, citation) in groups:
+            matrix = np.concatenate([groups[(field, citation)], matrix])
+        groups[(field, citation)] = matrix
+    return groups
+
+
+def load_store_matrices(store_path):
+    """
+    結果ストアから、分野 × high/low ごとのルール行列を読み込みます。
+    結果ストアには本文がないため、全指標が回答なしの行を除きます（アブストラクトが空の行に加えて、レスポンスを
+    得られなかった行も除くため、結合済みのCSVから読み込んだ場合より yes 比率の分母が小さくなることがあります）。
+
+    Returns:
+        tuple: ({(分野名, "high" or "low"): int8 のルール行列}, 指標のリスト)。
+    """
+    from data_process.results_store import ResultsStore
+
+    stored = ResultsStore(store_path).load()
+    groups = {}
+    for field, citation in stored.groups():
+        if not field or citation not in ("high", "low"):
+            continue
+        matrix = np.asarray(stored.view(field, citation)[0])
+        groups[(field, citation)] = matrix[(matrix != MISSING).any(axis=1)]
+    return groups, stored.rules
+
+
+def block_size_for(n_rows, max_bytes=DEFAULT_BLOCK_BYTES):
+    # 1回の再標本化につき、インデックスまたはキー（8バイト）・重み（int64 と float32）で1行あたり約20バイトを使用する
+    return max(1, int(max_bytes // (max(n_rows, 1) * 20)))
+
+
+def bootstrap_counts(yes, n_boot, rng, max_bytes=DEFAULT_BLOCK_BYTES):
+    """
+    行を復元抽出したブートストラップで、指標ごとの yes の件数を計算します。
+    各反復の行のインデックスをブロック単位の行列として生成し、行ごとの重み（抽出された回数）に変換して
+    行列積で全指標の件数を一度に求めます。全指標で同じ行を抽出するため、指標間の相関は保たれます。
+
+    Args:
+        yes (np.ndarray): 形状 (行数, 指標数) の yes かどうかの float32 の行列。
+        n_boot (int): 反復回数。
+        rng (np.random.Generator): 乱数生成器。
+        max_bytes (int): 1ブロックで使用するメモリの目安。
+
+    Returns:
+        np.ndarray: 形状 (n_boot, 指標数) の yes の件数。
+    """
+    n_rows = len(yes)
+    counts = np.empty((n_boot, yes.shape[1]), dtype=np.float32)
+    if n_rows == 0:
+        counts[:] = np.nan
+        return counts
+    block_size = block_size_for(n_rows, max_bytes)
+    for start in range(0, n_boot, block_size):
+        size = min(block_size, n_boot - start)
+        rows = rng.integers(0, n_rows, size=(size, n_rows))
+        # 反復ごとに行の区間を割り当て、1回の bincount で抽出回数を数える
+        offsets = (np.arange(size)[:, None] * n_rows + rows).ravel()
+        weights = np.bincount(offsets, minlength=size * n_rows).reshape(size, n_rows).astype(np.float32)
+        counts[start:start + size] = weights @ yes
+    return counts
+
+
+def permutation_counts(pooled, n_high, n_perm, rng, max_bytes=DEFAULT_BLOCK_BYTES):
+    """
+    High/Low のラベルを並べ替えた場合の、High 側の指標ごとの yes の件数を計算します。
+    反復ごとに行へ一様乱数のキーを割り当て、キーが小さい方から n_high 行を High とするマスクの行列をブロック単位で生成し、
+    行列積で全指標の件数を一度に求めます（行ごとの並べ替えより高速で、同じ分布になります）。
+
+    Args:
+        pooled (np.ndarray): High と Low の行を連結した、形状 (行数, 指標数) の float32 の行列。
+        n_high (int): High の行数。
+        n_perm (int): 反復回数。
+        rng (np.random.Generator): 乱数生成器。
+        max_bytes (int): 1ブロックで使用するメモリの目安。
+
+    Returns:
+        np.ndarray: 形状 (n_perm, 指標数) の High 側の yes の件数。
+    """
+    n_rows = len(pooled)
+    counts = np.empty((n_perm, pooled.shape[1]), dtype=np.float32)
+    block_size = block_size_for(n_rows, max_bytes)
+    for start in range(0, n_perm, block_size):
+        size = min(block_size, n_perm - start)
+        keys = rng.random((size, n_rows))
+        threshold = np.partition(keys, n_high - 1, axis=1)[:, n_high - 1:n_high]
+        counts[start:start + size] = (keys <= threshold).astype(np.float32) @ pooled
+    return counts
+
+
+def resample_group(name, high, low, rules, n_boot=10_000, n_perm=10_000, alpha=0.05, seed=None,
+                   max_bytes=DEFAULT_BLOCK_BYTES):
+    """
+    1つの分野（または全体）について、yes比率のブートストラップ信頼区間と、High/Low の差の並べ替え検定を行います。
+
+    Args:
+        name (str): 分野名（または "Overall"）。
+        high, low (np.ndarray): High / Low の int8 のルール行列。
+        rules (list): 指標のリスト。
+        n_boot (int): ブートストラップの反復回数。
+        n_perm (int): 並べ替え検定の反復回数。
+        alpha (float): 信頼区間の有意水準。
+        seed (int or np.random.SeedSequence, optional): 乱数のシード。
+        max_bytes (int): 1ブロックで使用するメモリの目安。
+
+    Returns:
+        pd.DataFrame: 指標ごとの yes 比率・信頼区間・差・並べ替え検定のp値のデータフレーム。
+    """
+    rng = np.random.default_rng(seed)
+    # calculate_yes_ratios と同様に、回答なしは yes ではないものとして全行数で割る
+    high_yes = (high == YES).astype(np.float32)
+    low_yes = (low == YES).astype(np.float32)
+    n_high, n_low = len(high_yes), len(low_yes)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        high_ratio = high_yes.sum(axis=0, dtype=np.float64) / n_high
+        low_ratio = low_yes.sum(axis=0, dtype=np.float64) / n_low
+        high_boot = bootstrap_counts(high_yes, n_boot, rng, max_bytes).astype(np.float64) / n_high
+        low_boot = bootstrap_counts(low_yes, n_boot, rng, max_bytes).astype(np.float64) / n_low
+    quantiles = [alpha / 2, 1 - alpha / 2]
+    high_lower, high_upper = np.quantile(high_boot, quantiles, axis=0)
+    low_lower, low_upper = np.quantile(low_boot, quantiles, axis=0)
+    diff_lower, diff_upper = np.quantile(high_boot - low_boot, quantiles, axis=0)
+
+    # 両側の並べ替え検定（観測値以上の差の割合。p値が0にならないよう観測値を1回分として含める）
+    difference = high_ratio - low_ratio
+    if n_high and n_low:
+        pooled = np.concatenate([high_yes, low_yes])
+        perm_high = permutation_counts(pooled, n_high, n_perm, rng, max_bytes).astype(np.float64)
+        perm_diff = perm_high / n_high - (pooled.sum(axis=0, dtype=np.float64) - perm_high) / n_low
+        extreme = (np.abs(perm_diff) >= np.abs(difference) - 1e-9).sum(axis=0)
+        p_value = (extreme + 1) / (n_perm + 1)
+    else:
+        p_value = np.full(len(rules), np.nan)
+
+    return pd.DataFrame({
+        "Field": name, "Rule": rules,
+        "High Yes Ratio": high_ratio, "High CI Lower": high_lower, "High CI Upper": high_upper,
+        "Low Yes Ratio": low_ratio, "Low CI Lower": low_lower, "Low CI Upper": low_upper,
+        "Difference": difference, "Difference CI Lower": diff_lower, "Difference CI Upper": diff_upper,
+        "P-value (Permutation)": p_value,
+    })
+
+
+def _resample_task(task):
+    return resample_group(**task)
+
+
+def resample_groups(groups, rules, n_boot=10_000, n_perm=10_000, alpha=0.05, seed=0, workers=None,
+                    max_bytes=DEFAULT_BLOCK_BYTES):
+    """
+    全体（Overall）と全分野について resample_group を実行します。分野はプロセスプールで並列に処理します。
+    分野ごとの乱数は seed から派生させるため、ワーカー数や処理順に関わらず同じ結果になります。
+    多重比較補正は ztest_from_counts と同様に全分野・全指標をひとつの検定族として行います（全体は別の検定族）。
+
+    Args:
+        groups (dict): {(分野名, "high" or "low"): int8 のルール行列}（load_group_matrices の戻り値）。
+        rules (list): 指標のリスト。
+        workers (int, optional): プロセス数。Noneの場合はCPU数、1の場合はプロセスプールを使用しない。
+
+    Returns:
+        pd.DataFrame: resample_group の結果を連結し、P-value (Holm), P-value (BH) 列を加えたデータフレーム。
+    """
+    fields = [field for field, citation in groups if citation == "high" and (field, "low") in groups]
+    if not {citation for _, citation in groups} >= {"high", "low"}:
+        raise ValueError("High と Low の両方の結果が必要です。")
+    overall = (
+        np.concatenate([matrix for (_, citation), matrix in groups.items() if citation == "high"]),
+        np.concatenate([matrix for (_, citation), matrix in groups.items() if citation == "low"]),
+    )
+    names = ["Overall"] + fields
+    pairs = [overall] + [(groups[(field, "high")], groups[(field, "low")]) for field in fields]
+    seeds = np.random.SeedSequence(seed).spawn(len(names))
+    tasks = [
+        {"name": name, "high": high, "low": low, "rules": rules, "n_boot": n_boot, "n_perm": n_perm,
+         "alpha": alpha, "seed": child, "max_bytes": max_bytes}
+        for name, (high, low), child in zip(names, pairs, seeds)
+    ]
+    if workers == 1:
+        frames = [_resample_task(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            frames = list(executor.map(_resample_task, tasks))
+
+    results = pd.concat(frames, ignore_index=True)
+    for mask in (results["Field"] == "Overall", results["Field"] != "Overall"):
+        p_value = results.loc[mask, "P-value (Permutation)"].to_numpy()
+        results.loc[mask, "P-value (Holm)"] = holm_correction(p_value)
+        results.loc[mask, "P-value (BH)"] = bh_correction(p_value)
+    return results
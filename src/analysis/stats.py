@@ -0,0 +1,128 @@
+import numpy as np
+import pandas as pd
+from scipy.special import erfc
+
+
+def count_yes(df, rules):
+    """
+    全指標の yes の件数と行数を一括で数えます。
+    Args:
+        df (DataFrame): データフレーム。
+        rules (list): 指標のリスト。
+    Returns:
+        tuple: (指標ごとの yes の件数の配列, 行数)。
+    """
+    return (df[rules].to_numpy() == 'yes').sum(axis=0), len(df)
+
+
+def proportions_ztest_batch(count1, nobs1, count2, nobs2):
+    """
+    2群の比率の差のz検定（両側、プールした分散）をNumPyのブロードキャストで一括計算します。
+    statsmodels の proportions_ztest(alternative='two-sided') と同じ結果になります。
+    Args:
+        count1, nobs1 (array_like): 1群目の yes の件数と総数。
+        count2, nobs2 (array_like): 2群目の yes の件数と総数。
+    Returns:
+        tuple: (z統計量の配列, p値の配列)。
+    """
+    count1, nobs1, count2, nobs2 = np.broadcast_arrays(
+        *(np.asarray(value, dtype=float) for value in (count1, nobs1, count2, nobs2))
+    )
+    with np.errstate(divide='ignore', invalid='ignore'):
+        prop1 = count1 / nobs1
+        prop2 = count2 / nobs2
+        pooled = (count1 + count2) / (nobs1 + nobs2)
+        std = np.sqrt(pooled * (1 - pooled) * (1 / nobs1 + 1 / nobs2))
+        z = (prop1 - prop2) / std
+    p_value = erfc(np.abs(z) / np.sqrt(2))
+    return z, p_value
+
+
+def holm_correction(p_values):
+    """
+    Holm法で多重比較補正したp値を返します。NaNは補正の対象から除外します。
+    Args:
+        p_values (array_like): p値の配列（任意の形状）。
+    Returns:
+        ndarray: 補正後のp値（入力と同じ形状）。
+    """
+    p_values = np.asarray(p_values, dtype=float)
+    flat = p_values.ravel()
+    adjusted = np.full_like(flat, np.nan)
+    valid = np.flatnonzero(~np.isnan(flat))
+    m = len(valid)
+    if m:
+        order = valid[np.argsort(flat[valid], kind='mergesort')]
+        scaled = (m - np.arange(m)) * flat[order]
+        adjusted[order] = np.minimum(np.maximum.accumulate(scaled), 1.0)
+    return adjusted.reshape(p_values.shape)
+
+
+def bh_correction(p_values):
+    """
+    Benjamini-Hochberg法で多重比較補正したp値（FDR）を返します。NaNは補正の対象から除外します。
+    Args:
+        p_values (array_like): p値の配列（任意の形状）。
+    Returns:
+        ndarray: 補正後のp値（入力と同じ形状）。
+    """
+    p_values = np.asarray(p_values, dtype=float)
+    flat = p_values.ravel()
+    adjusted = np.full_like(flat, np.nan)
+    valid = np.flatnonzero(~np.isnan(flat))
+    m = len(valid)
+    if m:
+        order = valid[np.argsort(flat[valid], kind='mergesort')]
+        scaled = m / np.arange(1, m + 1) * flat[order]
+        adjusted[order] = np.minimum(np.minimum.accumulate(scaled[::-1])[::-1], 1.0)
+    return adjusted.reshape(p_values.shape)
+
+
+def ztest_from_counts(high_yes, high_total, low_yes, low_total, fields, rules):
+    """
+    分野 × 指標の yes の件数と総数の行列から、全組み合わせのz検定と多重比較補正を一括で行います。
+    補正は全分野・全指標をひとつの検定族として扱います。
+    Args:
+        high_yes, low_yes (array_like): 形状 (分野数, 指標数) の yes の件数。
+        high_total, low_total (array_like): 形状 (分野数,) または (分野数, 指標数) の総数。
+        fields (list): 分野名のリスト。
+        rules (list): 指標のリスト。
+    Returns:
+        DataFrame: Field, Rule, Z-statistic, P-value, P-value (Holm), P-value (BH) を含むデータフレーム。
+    """
+    high_total = np.asarray(high_total, dtype=float)
+    low_total = np.asarray(low_total, dtype=float)
+    if high_total.ndim == 1:
+        high_total = high_total[:, None]
+    if low_total.ndim == 1:
+        low_total = low_total[:, None]
+
+    z, p_value = proportions_ztest_batch(high_yes, high_total, low_yes, low_total)
+    return pd.DataFrame({
+        'Field': np.repeat(fields, len(rules)),
+        'Rule': np.tile(rules, len(fields)),
+        'Z-statistic': z.ravel(),
+        'P-value': p_value.ravel(),
+        'P-value (Holm)': holm_correction(p_value).ravel(),
+        'P-value (BH)': bh_correction(p_value).ravel(),
+    })
+
+
+def calculate_ztest_batch(high_group, low_group, rules):
+    """
+    分野ごとのHigh/Lowグループのデータフレームから、全分野・全指標のz検定を一括で行います。
+    Args:
+        high_group (dict): 分野名をキーとするHighグループのデータフレームの辞書。
+        low_group (dict): 分野名をキーとするLowグループのデータフレームの辞書。
+        rules (list): 指標のリスト。
+    Returns:
+        DataFrame: ztest_from_counts と同じ形式のデータフレーム。
+    """
+    fields = [field for field in high_group if field in low_group]
+    high_counts = [count_yes(high_group[field], rules) for field in fields]
+    low_counts = [count_yes(low_group[field], rules) for field in fields]
+    return ztest_from_counts(
+        np.array([yes for yes, _ in high_counts]), np.array([total for _, total in high_counts]),
+        np.array([yes for yes, _ in low_counts]), np.array([total for _, total in low_counts]),
+        fields, rules,
+    )
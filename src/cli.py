@@ -0,0 +1,436 @@
+import os
+import sys
+import argparse
+import functools
+
+# python src/cli.py として実行した場合も各パッケージを読み込めるようにする
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+
+# 重いライブラリ（pandas, matplotlib, google.generativeai など）は各サブコマンドの中でのみ読み込む。
+# --help やプロットしないサブコマンドの起動を速くするため、このモジュールの先頭では標準ライブラリ以外を読み込まない。
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, "..", "data")
+PROMPT_DIR = os.path.join(BASE_DIR, "prompt")
+
+FIELDS = ["Biochemistry_Molecular_Biology", "Chemistry", "Engineering", "Materials_Science", "Physics"]
+CITATION_TYPES = ["high", "low"]
+
+# Web of Science のタグと列名の対応
+COLUMNS_TO_RENAME = {
+    "PT": "Publication Type",
+    "AU": "Authors",
+    "TI": "Title",
+    "SO": "Source",
+    "AB": "Abstract",
+    "DI": "DOI",
+}
+COLUMNS_TO_KEEP = ["Publication Type", "Authors", "Title", "Abstract", "DOI"]
+
+N_RULES = 31
+
+
+def read_text(path):
+    with open(path, "r", encoding="utf-8") as file:
+        return file.read()
+
+
+def create_gemini_model(model_name, system_instructions_path, response_schema=None):
+    """
+    .env のAPIキーでGeminiモデルを作成する。スケジューラーのワーカーでも使用するためトップレベルで定義する。
+    response_schema を指定した場合は、そのスキーマで構造化出力を要求する。
+    """
+    import google.generativeai as genai
+    from dotenv import load_dotenv
+
+    load_dotenv(override=True)
+    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+    generation_config = {
+        "response_mime_type": "application/json",
+        "temperature": 0,
+        "top_p": 0,
+    }
+    if response_schema is not None:
+        generation_config["response_schema"] = response_schema
+    return genai.GenerativeModel(
+        model_name=model_name,
+        system_instruction=read_text(system_instructions_path),
+        generation_config=generation_config,
+    )
+
+
+def model_factory_from_args(args, response_schema=None):
+    if args.fake:
+        from gemini.fake_model import FakeModel
+
+        return functools.partial(FakeModel, latency=args.fake_latency, n_rules=None,
+                                 malformed_rate=args.fake_malformed_rate, fenced_rate=args.fake_malformed_rate,
+                                 prose_rate=args.fake_malformed_rate, missing_rule_rate=args.fake_malformed_rate,
+                                 sample_flip_rate=getattr(args, "fake_flip_rate", 0.0))
+    return functools.partial(create_gemini_model, args.model, args.system_instructions, response_schema)
+
+
+def run_ingest(args):
+    from data_process.ingest import ingest_txt_files
+
+    manifest = ingest_txt_files(args.input_dir, args.output_dir, COLUMNS_TO_RENAME, COLUMNS_TO_KEEP,
+                                rows_per_file=args.rows_per_file, manifest_path=args.manifest)
+    print(f"{len(manifest['shards'])} シャードをマニフェストに記録しました。")
+
+
+def load_local_rules(args):
+    """
+    前段の分類器を作成し、人間の評価結果と照合して正解率が基準以上の評価指標だけを有効にする。
+    """
+    import pandas as pd
+    from gemini.local_rules import LocalRuleClassifier
+    from gemini.rule_versions import parse_rules
+
+    classifier = LocalRuleClassifier()
+    human_df = pd.read_csv(args.local_rules_human)
+    gemini_df = pd.read_csv(args.local_rules_gemini) if args.local_rules_gemini else None
+    report = classifier.calibrate(parse_rules(read_text(args.rules)), human_df, gemini_df,
+                                  min_accuracy=args.local_rules_min_accuracy)
+    print(f"ローカルで判定する評価指標（{args.local_rules_human} で検証）:\n{report.to_string(index=False)}")
+    return classifier
+
+
+def load_consensus(args):
+    """
+    多数決の再サンプリングを作成する。--consensus-rules を指定しない場合は、サンプリングチェックの指標から
+    Precision / Recall が基準未満の評価指標と、その疑わしい回答を求める。
+    """
+    import pandas as pd
+    from gemini.consensus import ConsensusSampler, unstable_rules_from_metrics
+    from sampling_check.metrics import calculate_metrics
+
+    if args.consensus_rules:
+        unstable = args.consensus_rules
+    else:
+        metrics_df = calculate_metrics(pd.read_csv(args.consensus_gemini), pd.read_csv(args.consensus_human))
+        unstable = unstable_rules_from_metrics(metrics_df, min_score=args.consensus_min_score)
+    print(f"多数決で決め直す評価指標: {unstable}")
+    return ConsensusSampler(unstable, max_samples=args.max_samples, temperature=args.sampling_temperature,
+                            concurrency=args.concurrency or 1)
+
+
+def run_evaluate(args):
+    rules = read_text(args.rules)
+    response_schema = None
+    options = {"concurrency": args.concurrency, "batch_size": args.batch_size}
+    if args.resume:
+        # 指定しない場合、スケジューラーはジャーナルのあるシャードをジョブごとに再開する
+        options["resume"] = True
+    if args.local_rules:
+        options["local_rules"] = load_local_rules(args)
+    if args.consensus:
+        options["consensus"] = load_consensus(args)
+    if args.schema:
+        from gemini.validation import ResponseValidator, build_response_schema
+
+        options["validator"] = ResponseValidator(rules, max_reasks=args.max_reasks)
+        n_rules = options["validator"].n_rules
+        # 一部の評価指標だけを送る場合はプロンプトごとに回答数が変わるため、スキーマでは個数を固定しない
+        partial = args.local_rules or args.rule_store or args.consensus
+        response_schema = build_response_schema(None if partial else n_rules)
+    model_factory = model_factory_from_args(args, response_schema)
+    if args.dependencies:
+        from analysis.dependencies import load_dependencies
+
+        options["dependencies"] = load_dependencies(args.dependencies)
+    if args.normalize_abstracts or args.max_abstract_tokens:
+        from gemini.preprocess import AbstractPreprocessor
+
+        options["preprocessor"] = AbstractPreprocessor(normalize=args.normalize_abstracts,
+                                                       max_tokens=args.max_abstract_tokens, overflow=args.overflow)
+
+    if args.workers > 1:
+        from gemini.scheduler import run_scheduler
+
+        run_scheduler(model_factory, rules, args.input_dir, args.output_dir, args.fields, args.citation_types,
+                      workers=args.workers, rpm=args.rpm, tpm=args.tpm, cache_path=args.cache,
+                      dead_letter_path=args.dead_letter, dedup_path=args.dedup, rule_store_path=args.rule_store,
+                      telemetry_path=args.telemetry, results_store_path=args.results_store,
+                      manifest_path=args.manifest, overwrite=args.overwrite, **options)
+        return
+
+    from gemini.gemini_modules import process_gemini
+    from gemini.response_cache import ResponseCache
+    from gemini.retry import DeadLetterQueue
+    from gemini.dedup import DedupIndex
+    from gemini.rule_versions import RuleAnswerStore
+    from gemini.telemetry import Telemetry
+    from data_process.results_store import ResultsStore
+
+    model = model_factory()
+    options.update(
+        journal=args.journal or args.resume,
+        dead_letter=DeadLetterQueue(args.dead_letter) if args.dead_letter else None,
+        dedup=DedupIndex(args.dedup) if args.dedup else None,
+        rule_store=RuleAnswerStore(args.rule_store) if args.rule_store else None,
+        telemetry=Telemetry(args.telemetry) if args.telemetry else None,
+        results_store=ResultsStore(args.results_store) if args.results_store else None,
+    )
+    cache = ResponseCache(args.cache) if args.cache else None
+    for field in args.fields:
+        for citation_type in args.citation_types:
+            process_gemini(model, rules, args.input_dir, args.output_dir, field, citation_type, rpm=args.rpm,
+                           tpm=args.tpm, cache=cache, manifest_path=args.manifest, **options)
+    if options["results_store"] is not None:
+        options["results_store"].compact()
+
+
+def run_merge(args):
+    if args.manifest:
+        from data_process.ingest import combine_results, load_manifest
+
+        combine_results(load_manifest(args.manifest), args.input_dir, args.output_dir, args.fields, args.citation_types)
+    else:
+        from data_process.functions import combine_csv_files
+
+        combine_csv_files(args.input_dir, args.output_dir, args.fields, args.citation_types)
+
+
+def run_analyze(args):
+    from analysis.functions import save_results
+    from analysis.aggregate import calculate_group_results_streaming
+
+    rules = [f"rule{i}" for i in range(1, args.n_rules + 1)]
+    results = calculate_group_results_streaming(args.data_dir, rules, args.chunksize)
+    for name, ((high_ratios, low_ratios), ztest_df) in results.items():
+        ratios_df = high_ratios.rename(columns={"Yes Ratio": "High Yes Ratio"})
+        ratios_df["Low Yes Ratio"] = low_ratios["Yes Ratio"]
+        save_results(ratios_df, args.output_dir, f"{name}_yes_ratios.csv")
+        save_results(ztest_df, args.output_dir, f"{name}_results.csv")
+
+
+def run_resample(args):
+    from analysis.functions import save_results
+    from analysis.resampling import load_group_matrices, load_store_matrices, resample_groups
+
+    if args.results_store:
+        groups, rules = load_store_matrices(args.results_store)
+    else:
+        rules = [f"rule{i}" for i in range(1, args.n_rules + 1)]
+        groups = load_group_matrices(args.data_dir, rules, args.chunksize)
+    results = resample_groups(groups, rules, n_boot=args.n_boot, n_perm=args.n_perm, alpha=args.alpha, seed=args.seed,
+                              workers=args.workers)
+    save_results(results, args.output_dir, "resampling_results.csv")
+
+
+def run_plot(args):
+    from analysis.functions import save_results
+    from analysis.plotting import render_all
+
+    rules = [f"rule{i}" for i in range(1, args.n_rules + 1)]
+    results, _ = render_all(args.data_dir, args.graph_dir, rules, args.y_axis_limit, args.field_y_axis_limit,
+                            workers=args.workers, force=args.force)
+    for name, (_, ztest_df) in results.items():
+        save_results(ztest_df, args.output_dir, f"{name}_results.csv")
+
+
+def run_sampling_metrics(args):
+    from sampling_check.metrics import KEY_COLUMNS, compare_runs
+
+    runs = {os.path.splitext(os.path.basename(path))[0]: path for path in args.gemini}
+    metrics_df, summary_df = compare_runs(runs, args.human, n_boot=args.n_boot, alpha=args.alpha, seed=args.seed,
+                                          on=KEY_COLUMNS if args.match_ids else None)
+    print(summary_df.to_string(index=False))
+    if args.output:
+        metrics_df.to_csv(args.output, index=False, encoding="utf-8")
+        print(f"結果を保存しました: {args.output}")
+
+
+def run_local_rules(args):
+    load_local_rules(args)
+
+
+def run_consensus(args):
+    from gemini.rate_limiter import RateLimiter
+    from data_process.results_store import ResultsStore
+
+    consensus = load_consensus(args)
+    rules = read_text(args.rules)
+    model = model_factory_from_args(args)()
+    dependencies = None
+    if args.dependencies:
+        from analysis.dependencies import load_dependencies
+
+        dependencies = load_dependencies(args.dependencies)
+    results_store = ResultsStore(args.results_store) if args.results_store else None
+    limiter = RateLimiter(rpm=args.rpm, tpm=args.tpm) if (args.rpm or args.tpm) else None
+    for field in args.fields:
+        result_path = os.path.join(args.results_dir, field)
+        if not os.path.isdir(result_path):
+            continue
+        for file_name in sorted(os.listdir(result_path)):
+            if file_name.endswith(".csv") and any(citation in file_name for citation in args.citation_types):
+                consensus.apply_to_file(model, rules, os.path.join(result_path, file_name), dependencies, results_store,
+                                        limiter=limiter)
+    print(f"多数決の再サンプリング: {consensus.stats()}")
+    if results_store is not None:
+        results_store.compact()
+
+
+def add_local_rules_arguments(parser):
+    parser.add_argument("--local-rules-human", default=os.path.join(DATA_DIR, "test", "sampling_check_by_human_updated.csv"),
+                        help="前段の分類器の正解率を検証する人間の評価結果")
+    parser.add_argument("--local-rules-gemini", default=os.path.join(DATA_DIR, "test", "sampling_check_by_gemini_updated.csv"),
+                        help="同じアブストラクトのGeminiの評価結果（正解率の比較用）")
+    parser.add_argument("--local-rules-min-accuracy", type=float, default=0.85,
+                        help="ローカルで判定する評価指標に求める正解率")
+
+
+def add_consensus_arguments(parser):
+    parser.add_argument("--consensus-rules", nargs="+",
+                        help="多数決で決め直す評価指標（例: rule2 rule3）。省略した場合はサンプリングチェックの指標から求める")
+    parser.add_argument("--consensus-human", default=os.path.join(DATA_DIR, "test", "sampling_check_by_human_updated.csv"),
+                        help="不安定な評価指標を求める人間の評価結果")
+    parser.add_argument("--consensus-gemini", default=os.path.join(DATA_DIR, "test", "sampling_check_by_gemini_updated.csv"),
+                        help="不安定な評価指標を求めるGeminiの評価結果")
+    parser.add_argument("--consensus-min-score", type=float, default=0.6,
+                        help="Precision / Recall がこの値未満の評価指標を不安定とする")
+    parser.add_argument("--max-samples", type=int, default=5, help="1つの評価指標の最大の票数（最初の回答を含む）")
+    parser.add_argument("--sampling-temperature", type=float, default=0.7, help="再サンプリング時の温度")
+    parser.add_argument("--fake-flip-rate", type=float, default=0.0,
+                        help="フェイクモデルが再サンプリング時に回答を反転させる確率（--fake）")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Gemini APIを使用したアブストラクトの評価")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    ingest = subparsers.add_parser("ingest", help="Web of Science の.txtファイルをCSVとマニフェストに変換する")
+    ingest.add_argument("--input-dir", default=os.path.join(DATA_DIR, "raw_data"))
+    ingest.add_argument("--output-dir", default=os.path.join(DATA_DIR, "csv", "all"))
+    ingest.add_argument("--rows-per-file", type=int, default=100)
+    ingest.add_argument("--manifest", help="マニフェストの保存先（既定: 出力ディレクトリ/manifest.json）")
+    ingest.set_defaults(handler=run_ingest)
+
+    evaluate = subparsers.add_parser("evaluate", help="アブストラクトをGeminiで評価する")
+    evaluate.add_argument("--input-dir", default=os.path.join(DATA_DIR, "csv"))
+    evaluate.add_argument("--output-dir", default=os.path.join(DATA_DIR, "results"))
+    evaluate.add_argument("--fields", nargs="+", default=FIELDS)
+    evaluate.add_argument("--citation-types", nargs="+", default=CITATION_TYPES, choices=CITATION_TYPES)
+    evaluate.add_argument("--manifest", help="ingest で作成したマニフェスト")
+    evaluate.add_argument("--rules", default=os.path.join(PROMPT_DIR, "rules.txt"))
+    evaluate.add_argument("--system-instructions", default=os.path.join(PROMPT_DIR, "system_instructions.txt"))
+    evaluate.add_argument("--model", default="gemini-1.5-flash")
+    evaluate.add_argument("--fake", action="store_true", help="APIを呼び出さずにフェイクモデルで実行する")
+    evaluate.add_argument("--fake-latency", type=float, default=0.05)
+    evaluate.add_argument("--fake-malformed-rate", type=float, default=0.0,
+                          help="フェイクモデルが不正なJSON・コードフェンス・説明文・回答の欠落をそれぞれ返す確率")
+    evaluate.add_argument("--workers", type=int, default=1, help="2以上の場合はプロセスプールで全シャードを並列に処理する")
+    evaluate.add_argument("--concurrency", type=int)
+    evaluate.add_argument("--batch-size", type=int)
+    evaluate.add_argument("--rpm", type=int)
+    evaluate.add_argument("--tpm", type=int)
+    evaluate.add_argument("--journal", action="store_true")
+    evaluate.add_argument("--resume", action="store_true")
+    evaluate.add_argument("--overwrite", action="store_true", help="処理済みのシャードも再度処理する（--workers 2以上）")
+    evaluate.add_argument("--cache", help="レスポンスキャッシュ（SQLite）のパス")
+    evaluate.add_argument("--dead-letter", help="デッドレターのパス")
+    evaluate.add_argument("--dedup", help="重複排除のインデックス（SQLite）のパス")
+    evaluate.add_argument("--rule-store", help="評価指標ごとの回答のストア（SQLite）のパス")
+    evaluate.add_argument("--telemetry", help="テレメトリのイベント（JSONL）のパス")
+    evaluate.add_argument("--results-store", help="ルール行列（int8）を保存する結果ストアのディレクトリ")
+    evaluate.add_argument("--dependencies", help="保存前に適用する指標間の依存関係の定義ファイル")
+    evaluate.add_argument("--normalize-abstracts", action="store_true",
+                          help="書式タグ・HTMLエンティティ・著作権表示・余分な空白を除去してから送る")
+    evaluate.add_argument("--max-abstract-tokens", type=int, help="1件のアブストラクトの概算トークン数の上限")
+    evaluate.add_argument("--overflow", default="truncate", choices=["truncate", "skip", "keep"],
+                          help="上限を超えたアブストラクトの扱い")
+    evaluate.add_argument("--schema", action="store_true",
+                          help="評価指標の数に合わせたスキーマで構造化出力を要求し、レスポンスを受信するたびに検証する")
+    evaluate.add_argument("--max-reasks", type=int, default=1, help="不正なレスポンスに対して再質問する最大回数（--schema）")
+    add_local_rules_arguments(evaluate)
+    evaluate.add_argument("--local-rules", action="store_true",
+                          help="表層的な評価指標をAPIを呼び出さずに判定し、残りの評価指標だけをモデルに送る")
+    add_consensus_arguments(evaluate)
+    evaluate.add_argument("--consensus", action="store_true",
+                          help="不安定な評価指標の疑わしい回答だけを再度問い合わせ、多数決で決め直す")
+    evaluate.set_defaults(handler=run_evaluate)
+
+    merge = subparsers.add_parser("merge", help="分割処理した結果のCSVを分野・カテゴリごとに結合する")
+    merge.add_argument("--input-dir", default=os.path.join(DATA_DIR, "results"))
+    merge.add_argument("--output-dir", default=os.path.join(DATA_DIR, "results", "combined"))
+    merge.add_argument("--fields", nargs="+", default=FIELDS)
+    merge.add_argument("--citation-types", nargs="+", default=CITATION_TYPES, choices=CITATION_TYPES)
+    merge.add_argument("--manifest", help="ingest で作成したマニフェスト")
+    merge.set_defaults(handler=run_merge)
+
+    analyze = subparsers.add_parser("analyze", help="yes比率とz検定の結果をCSVに保存する")
+    add_analysis_arguments(analyze)
+    analyze.add_argument("--chunksize", type=int, default=100_000, help="1度に読み込む行数")
+    analyze.set_defaults(handler=run_analyze)
+
+    resample = subparsers.add_parser("resample", help="yes比率のブートストラップ信頼区間とHigh/Lowの並べ替え検定の結果をCSVに保存する")
+    add_analysis_arguments(resample)
+    resample.add_argument("--chunksize", type=int, default=100_000, help="1度に読み込む行数")
+    resample.add_argument("--results-store", help="結合済みのCSVの代わりに読み込む結果ストアのディレクトリ")
+    resample.add_argument("--n-boot", type=int, default=10_000, help="ブートストラップの反復回数")
+    resample.add_argument("--n-perm", type=int, default=10_000, help="並べ替え検定の反復回数")
+    resample.add_argument("--alpha", type=float, default=0.05)
+    resample.add_argument("--seed", type=int, default=0)
+    resample.add_argument("--workers", type=int, help="分野を並列に処理するプロセス数（既定: CPU数）")
+    resample.set_defaults(handler=run_resample)
+
+    plot = subparsers.add_parser("plot", help="yes比率とz値のグラフを保存する")
+    add_analysis_arguments(plot)
+    plot.add_argument("--graph-dir", default=os.path.join(DATA_DIR, "results", "graphs"))
+    plot.add_argument("--y-axis-limit", type=float, default=25, help="全体のグラフの縦軸の範囲")
+    plot.add_argument("--field-y-axis-limit", type=float, default=13, help="分野ごとのグラフの縦軸の範囲")
+    plot.add_argument("--workers", type=int, help="描画に使うプロセス数（既定: CPU数）")
+    plot.add_argument("--force", action="store_true", help="入力データに変更のないグラフも描き直す")
+    plot.set_defaults(handler=run_plot)
+
+    sampling_metrics = subparsers.add_parser("sampling-metrics", help="サンプリングチェックのGeminiと人間の評価の一致度を計算する")
+    sampling_metrics.add_argument("--gemini", nargs="+", required=True, help="Geminiの評価結果のCSV（複数指定で比較）")
+    sampling_metrics.add_argument("--human", required=True, help="人間の評価結果のCSV")
+    sampling_metrics.add_argument("--output", help="指標ごとの結果の保存先のCSV")
+    sampling_metrics.add_argument("--n-boot", type=int, default=0, help="信頼区間を求めるブートストラップの反復回数")
+    sampling_metrics.add_argument("--alpha", type=float, default=0.05)
+    sampling_metrics.add_argument("--seed", type=int, default=0)
+    sampling_metrics.add_argument("--match-ids", action="store_true",
+                                  help="行の順番ではなく Field / Citation / ID で対応付ける")
+    sampling_metrics.set_defaults(handler=run_sampling_metrics)
+
+    local_rules = subparsers.add_parser("local-rules", help="前段の分類器の判定率と正解率を人間の評価結果で検証する")
+    local_rules.add_argument("--rules", default=os.path.join(PROMPT_DIR, "rules.txt"))
+    add_local_rules_arguments(local_rules)
+    local_rules.set_defaults(handler=run_local_rules)
+
+    consensus = subparsers.add_parser("consensus", help="評価済みの結果の不安定な評価指標を再サンプリングの多数決で決め直す")
+    consensus.add_argument("--results-dir", default=os.path.join(DATA_DIR, "results"))
+    consensus.add_argument("--fields", nargs="+", default=FIELDS)
+    consensus.add_argument("--citation-types", nargs="+", default=CITATION_TYPES, choices=CITATION_TYPES)
+    consensus.add_argument("--rules", default=os.path.join(PROMPT_DIR, "rules.txt"))
+    consensus.add_argument("--system-instructions", default=os.path.join(PROMPT_DIR, "system_instructions.txt"))
+    consensus.add_argument("--model", default="gemini-1.5-flash")
+    consensus.add_argument("--fake", action="store_true", help="APIを呼び出さずにフェイクモデルで実行する")
+    consensus.add_argument("--fake-latency", type=float, default=0.05)
+    consensus.add_argument("--fake-malformed-rate", type=float, default=0.0)
+    consensus.add_argument("--concurrency", type=int)
+    consensus.add_argument("--rpm", type=int)
+    consensus.add_argument("--tpm", type=int)
+    consensus.add_argument("--dependencies", help="多数決の後に適用する指標間の依存関係の定義ファイル")
+    consensus.add_argument("--results-store", help="ルール行列（int8）を保存する結果ストアのディレクトリ")
+    add_consensus_arguments(consensus)
+    consensus.set_defaults(handler=run_consensus)
+    return parser
+
+
+def add_analysis_arguments(parser):
+    parser.add_argument("--data-dir", default=os.path.join(DATA_DIR, "results", "combined"))
+    parser.add_argument("--output-dir", default=os.path.join(DATA_DIR, "results", "metrics"))
+    parser.add_argument("--n-rules", type=int, default=N_RULES)
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.handler(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,222 @@
+import io
+import os
+import re
+import json
+
+MANIFEST_NAME = "manifest.json"
+
+# "Physics_high1000" のようなファイル名から分野名とカテゴリを取り出す
+FILE_NAME_PATTERN = re.compile(r"^(?P<field>.+)_(?P<citation>high|low)\d*$")
+
+
+def parse_file_name(file_base_name):
+    """
+    `{分野名}_{high or low}1000` 形式のファイル名から分野名とカテゴリを取得します。
+    分野名に "_" を含む場合（例: Biochemistry_Molecular_Biology）にも対応します。
+
+    Returns:
+        tuple: (分野名, カテゴリ)。形式に一致しない場合は (ファイル名, None)。
+    """
+    match = FILE_NAME_PATTERN.match(file_base_name)
+    if match is None:
+        return file_base_name, None
+    return match.group("field"), match.group("citation")
+
+
+def ingest_txt_files(input_dir, output_dir, columns_to_rename, columns_to_keep, rows_per_file=100, manifest_path=None):
+    """
+    Web of Science の.txtファイルをチャンク単位で読み込み、列名の変更・列の選択・分割を1回の走査で行います。
+    各ファイルは `{ファイル名}.csv` として1度だけ書き出し、分割（シャード）はファイルを複製せずに
+    マニフェスト（分野名, カテゴリ, シャード番号, 行範囲, バイト位置）として記録します。
+
+    Args:
+        input_dir (str): 入力.txtファイルが格納されているディレクトリのパス。
+        output_dir (str): 出力.csvファイルとマニフェストを保存するディレクトリのパス。
+        columns_to_rename (dict): 旧列名と新列名の対応を持つ辞書。
+        columns_to_keep (list): 出力CSVに保持する列名のリスト。
+        rows_per_file (int): 1シャードあたりの行数（デフォルト: 100）。
+        manifest_path (str, optional): マニフェストの保存先。Noneの場合は output_dir/manifest.json。
+
+    Returns:
+        dict: 作成したマニフェスト。
+    """
+    import pandas as pd
+
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = manifest_path or os.path.join(output_dir, MANIFEST_NAME)
+
+    # 保持する列に対応する元の列名
+    source_names = {old: new for old, new in columns_to_rename.items() if new in columns_to_keep}
+    wanted = set(source_names) | set(columns_to_keep)
+
+    shards = []
+    txt_files = sorted(f for f in os.listdir(input_dir) if f.endswith(".txt"))
+    for txt_file in txt_files:
+        file_base_name = os.path.splitext(txt_file)[0]
+        field, citation = parse_file_name(file_base_name)
+        input_file = os.path.join(input_dir, txt_file)
+        output_file = os.path.join(output_dir, f"{file_base_name}.csv")
+
+        try:
+            reader = pd.read_csv(input_file, sep="\t", encoding="utf-8", chunksize=rows_per_file,
+                                 usecols=lambda column: column in wanted)
+            file_shards = write_shards(reader, output_file, columns_to_rename, columns_to_keep)
+        except Exception as e:
+            print(f"データの変換中にエラーが発生しました: {txt_file}: {e}")
+            # 書きかけのCSVは削除
+            if os.path.exists(output_file):
+                os.remove(output_file)
+            continue
+
+        for shard in file_shards:
+            shard.update({"field": field, "citation": citation, "name": f"{file_base_name}_{shard['shard']}"})
+        shards.extend(file_shards)
+        print(f"{len(file_shards)} 個のシャードを記録しました: {txt_file}")
+
+    manifest = {"rows_per_file": rows_per_file, "shards": shards}
+    save_manifest(manifest, manifest_path)
+    print(f"マニフェストを保存しました: {manifest_path}")
+    return manifest
+
+
+def write_shards(reader, output_file, columns_to_rename, columns_to_keep):
+    """
+    チャンクごとに列名の変更と列の選択を行って1つのCSVに追記し、各チャンクの行範囲とバイト位置を返します。
+    """
+    shards = []
+    start = 0
+    with open(output_file, "wb") as file:
+        file.write(b"\xef\xbb\xbf")  # utf-8-sig のBOM
+        for i, chunk_df in enumerate(reader):
+            chunk_df = chunk_df.rename(columns=columns_to_rename)[columns_to_keep]
+            data = chunk_df.to_csv(index=False, header=(i == 0)).encode("utf-8")
+            if i == 0:
+                # ヘッダー行はシャードに含めない
+                header_length = data.index(b"\n") + 1
+                file.write(data[:header_length])
+                data = data[header_length:]
+            offset = file.tell()
+            file.write(data)
+            shards.append({
+                "path": output_file,
+                "shard": i + 1,
+                "start": start,
+                "stop": start + len(chunk_df),
+                "offset": offset,
+                "length": len(data),
+            })
+            start += len(chunk_df)
+    return shards
+
+
+def save_manifest(manifest, manifest_path):
+    os.makedirs(os.path.dirname(manifest_path) or ".", exist_ok=True)
+    with open(manifest_path, "w", encoding="utf-8") as file:
+        json.dump(manifest, file, ensure_ascii=False, indent=2)
+
+
+def load_manifest(manifest_path):
+    """
+    マニフェストを読み込みます。CSVのパスはマニフェストからの相対パスとしても解決します。
+    """
+    with open(manifest_path, "r", encoding="utf-8") as file:
+        manifest = json.load(file)
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    for shard in manifest["shards"]:
+        if not os.path.exists(shard["path"]):
+            shard["path"] = os.path.join(base_dir, os.path.basename(shard["path"]))
+    return manifest
+
+
+def find_shards(manifest, field=None, citation=None):
+    """
+    分野名とカテゴリに一致するシャードをシャード番号順に返します。
+    """
+    shards = [
+        shard for shard in manifest["shards"]
+        if (field is None or shard["field"] == field) and (citation is None or shard["citation"] == citation)
+    ]
+    return sorted(shards, key=lambda shard: (shard["field"], shard["citation"], shard["shard"]))
+
+
+def read_shard(shard):
+    """
+    マニフェストのバイト位置からシャードの行だけを読み込みます。
+
+    Returns:
+        DataFrame: シャードのデータフレーム。
+    """
+    import pandas as pd
+
+    with open(shard["path"], "rb") as file:
+        header = file.readline()
+        file.seek(shard["offset"])
+        data = file.read(shard["length"])
+    return pd.read_csv(io.BytesIO(header + data), encoding="utf-8-sig")
+
+
+def shard_reference(manifest_path, name):
+    """
+    シャードを指す文字列（`{マニフェストのパス}#{シャード名}`）を返します。
+    CSVファイルのパスの代わりに gemini の処理やデッドレターの記録に使用できます。
+    """
+    return f"{manifest_path}#{name}"
+
+
+def read_csv_or_shard(input_file):
+    """
+    CSVファイル、またはシャードを指す文字列（shard_reference）からデータフレームを読み込みます。
+    """
+    import pandas as pd
+
+    if os.path.exists(input_file) or "#" not in input_file:
+        return pd.read_csv(input_file, encoding="utf-8")
+    manifest_path, name = input_file.rsplit("#", 1)
+    for shard in load_manifest(manifest_path)["shards"]:
+        if shard["name"] == name:
+            return read_shard(shard)
+    raise KeyError(f"マニフェストにシャードが存在しません: {input_file}")
+
+
+def combine_results(manifest, input_dir, output_dir, fields=None, categories=None):
+    """
+    マニフェストのシャード一覧に基づいて分割処理した結果のCSVを分野・カテゴリごとに結合し、保存します。
+    データフレームを連結せず、シャードごとに読み込んで順に追記します。
+    IDはマニフェストの行範囲から決まる元ファイルでの行番号（1始まり）とするため、欠けたシャードがあってもずれません。
+
+    Args:
+        manifest (dict): load_manifest で読み込んだマニフェスト。
+        input_dir (str): 結果のCSVファイルが `{分野名}/{シャード名}.csv` として格納されているベースディレクトリ。
+        output_dir (str): 結合結果を保存するディレクトリのパス。
+        fields (list, optional): 結合する分野名のリスト。Noneの場合はマニフェストのすべての分野。
+        categories (list, optional): 結合するカテゴリ名（high/low）のリスト。Noneの場合はすべてのカテゴリ。
+    """
+    import pandas as pd
+
+    os.makedirs(output_dir, exist_ok=True)
+    groups = {}
+    for shard in find_shards(manifest):
+        if (fields is None or shard["field"] in fields) and (categories is None or shard["citation"] in categories):
+            groups.setdefault((shard["field"], shard["citation"]), []).append(shard)
+
+    for (field, category), shards in groups.items():
+        output_file = os.path.join(output_dir, f"{os.path.splitext(os.path.basename(shards[0]['path']))[0]}.csv")
+        written = 0
+        with open(output_file, "w", encoding="utf-8", newline="") as file:
+            for shard in shards:
+                input_file = os.path.join(input_dir, field, f"{shard['name']}.csv")
+                if not os.path.exists(input_file):
+                    print(f"ファイル {input_file} が存在しません。")
+                    continue
+                df = pd.read_csv(input_file, encoding="utf-8")
+                df["ID"] = range(shard["start"] + 1, shard["start"] + len(df) + 1)
+                df.to_csv(file, index=False, header=(written == 0))
+                written += 1
+
+        if written:
+            print(f"ファイル {output_file} を保存しました。({written}/{len(shards)} シャード)")
+        else:
+            os.remove(output_file)
+            print(f"{field} の {category} データに結合可能なファイルがありませんでした。")
+
+    print("全ての結合処理が完了しました。")
@@ -0,0 +1,279 @@
+import os
+import re
+import json
+import numpy as np
+
+from gemini.response_parser import MISSING
+
+SEGMENT_DIR = "segments"
+RULES_FILE = "rules.npy"
+METADATA_FILE = "metadata.csv"
+INDEX_FILE = "index.json"
+
+# メタデータの列（本文は入力CSVに残し、必要な場合のみ Source と Row（入力ファイルでの行の位置）で結合する）
+METADATA_COLUMNS = ["ID", "DOI", "Field", "Citation", "Shard", "Source", "Segment", "Row"]
+
+# "Physics_high1000_3" のようなシャード名から分野名・カテゴリ・シャード番号を取り出す
+SHARD_NAME_PATTERN = re.compile(r"^(?P<field>.+)_(?P<citation>high|low)\d*(?:_(?P<shard>\d+))?$")
+
+
+def parse_shard_name(name):
+    """
+    `{分野名}_{high or low}1000_{シャード番号}` 形式の名前から (分野名, カテゴリ, シャード番号) を取得します。
+    形式に一致しない場合は (None, None, None) を返します。
+    """
+    match = SHARD_NAME_PATTERN.match(name)
+    if match is None:
+        return None, None, None
+    shard = match.group("shard")
+    return match.group("field"), match.group("citation"), int(shard) if shard else None
+
+
+def align_matrix(matrix, abstract_ids, ids):
+    """
+    アブストラクトIDの順に並んだルール行列を、データフレームの行（ids）の順に並べ替えます。
+    レスポンスのない行は回答なし（MISSING）になります。
+    """
+    import pandas as pd
+
+    rows = pd.Index(abstract_ids).get_indexer(ids)
+    aligned = np.full((len(rows), matrix.shape[1]), MISSING, dtype=np.int8)
+    found = rows >= 0
+    aligned[found] = matrix[rows[found]]
+    return aligned
+
+
+def build_metadata(df, segment, source=None, field=None, citation=None, shard=None):
+    """
+    結果の行に対応するメタデータ（ID, DOI, 分野, カテゴリ, シャード, 入力ファイル, 行の位置）のデータフレームを作成します。
+    データフレームに Field / Citation 列がある場合はその値を使用します。
+    df は入力ファイルの全行を元の順に持つものとし、各行の位置を Row 列に記録します。
+    """
+    import pandas as pd
+
+    return pd.DataFrame({
+        "ID": df["ID"].to_numpy(),
+        "DOI": df["DOI"].to_numpy() if "DOI" in df.columns else None,
+        "Field": df["Field"].to_numpy() if "Field" in df.columns else field,
+        "Citation": df["Citation"].to_numpy() if "Citation" in df.columns else citation,
+        "Shard": shard,
+        "Source": source,
+        "Segment": segment,
+        "Row": np.arange(len(df)),
+    }, columns=METADATA_COLUMNS)
+
+
+class ResultsStore:
+    """
+    評価結果のルール行列（int8）をメモリマップ可能な .npy ファイルとして保存するストア。
+    メタデータは小さなCSVに分けて保存し、アブストラクトの本文は入力CSVに残す。
+
+    書き込みはシャードごとのセグメント（segments/{名前}.npy と .csv）として行うため、複数のプロセスから同時に書き込める。
+    compact でセグメントを分野・カテゴリ順の1つの行列にまとめると、分野・カテゴリごとのビューをコピーなしで取り出せる。
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): ストアのディレクトリ。
+        """
+        self.path = path
+        self.segment_dir = os.path.join(path, SEGMENT_DIR)
+        os.makedirs(self.segment_dir, exist_ok=True)
+
+    def write(self, segment, matrix, metadata):
+        """
+        1つのセグメント（シャード）の結果を書き込む。同じ名前のセグメントは置き換える。
+
+        Args:
+            segment (str): セグメント名（シャード名など）。
+            matrix (np.ndarray): int8 のルール行列。
+            metadata (pd.DataFrame): build_metadata で作成した、行列の各行に対応するメタデータ。
+        """
+        if len(matrix) != len(metadata):
+            raise ValueError(f"行列とメタデータの行数が一致しません: {len(matrix)} != {len(metadata)}")
+        base = os.path.join(self.segment_dir, segment)
+        # 書きかけのファイルを読まないように、一時ファイルに書き込んでから置き換える
+        with open(f"{base}.npy.tmp", "wb") as file:
+            np.save(file, np.ascontiguousarray(matrix, dtype=np.int8))
+        metadata.to_csv(f"{base}.csv.tmp", index=False, encoding="utf-8")
+        os.replace(f"{base}.csv.tmp", f"{base}.csv")
+        os.replace(f"{base}.npy.tmp", f"{base}.npy")
+
+    def write_results(self, df, matrix, abstract_ids, output_file, source=None):
+        """
+        結果のデータフレームの行順に揃えたルール行列とメタデータを、出力ファイル名のセグメントとして書き込む。
+
+        Args:
+            df (pd.DataFrame): ID列を持つ元のデータフレーム。
+            matrix (np.ndarray): abstract_ids の順に並んだ int8 のルール行列。
+            abstract_ids (list): 行列の各行のアブストラクトID。
+            output_file (str): 結果のCSVファイルのパス（拡張子を除いたファイル名をセグメント名とする）。
+            source (str, optional): 入力ファイル（またはシャード）の識別子。
+        """
+        segment = os.path.splitext(os.path.basename(output_file))[0]
+        field, citation, shard = parse_shard_name(segment)
+        metadata = build_metadata(df, segment, source=source, field=field, citation=citation, shard=shard)
+        self.write(segment, align_matrix(matrix, abstract_ids, df["ID"]), metadata)
+
+    def pending_segments(self):
+        """
+        まだ compact でまとめていないセグメント名のリストを返す。
+        """
+        return sorted(name[:-4] for name in os.listdir(self.segment_dir) if name.endswith(".npy"))
+
+    def load_index(self):
+        path = os.path.join(self.path, INDEX_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as file:
+            return json.load(file)
+
+    def compact(self):
+        """
+        まとめ済みの行列と新しいセグメントを、分野・カテゴリ・シャード・ID順の1つの行列に書き直す。
+        新しいセグメントと同じ名前の行は置き換える。まとめたセグメントのファイルは削除する。
+
+        Returns:
+            dict: インデックス（指標数、行数、分野・カテゴリごとの行範囲）。
+        """
+        import pandas as pd
+
+        segments = self.pending_segments()
+        index = self.load_index()
+        if not segments and index is not None:
+            return index
+
+        # (行列, 使用する行) の組。まとめ済みの行列はメモリマップのまま、置き換えるセグメントの行を除いて使う
+        sources = []
+        metadata = []
+        if index is not None:
+            old_metadata = pd.read_csv(os.path.join(self.path, METADATA_FILE), encoding="utf-8")
+            keep = np.flatnonzero(~old_metadata["Segment"].isin(segments).to_numpy())
+            sources.append((np.load(os.path.join(self.path, RULES_FILE), mmap_mode="r"), keep))
+            metadata.append(old_metadata.iloc[keep])
+        for segment in segments:
+            base = os.path.join(self.segment_dir, segment)
+            matrix = np.load(f"{base}.npy")
+            sources.append((matrix, np.arange(len(matrix))))
+            metadata.append(pd.read_csv(f"{base}.csv", encoding="utf-8"))
+
+        n_rules = max((matrix.shape[1] for matrix, _ in sources), default=0)
+        if any(matrix.shape[1] != n_rules for matrix, rows in sources if len(rows)):
+            raise ValueError("指標数の異なるセグメントはまとめられません。")
+        metadata = pd.concat(metadata, ignore_index=True) if metadata else pd.DataFrame(columns=METADATA_COLUMNS)
+        order = metadata.sort_values(["Field", "Citation", "Shard", "Segment", "ID"], na_position="last").index.to_numpy()
+        metadata = metadata.iloc[order].reset_index(drop=True)
+
+        # 行列はメモリマップで書き出し、全体を一度にメモリへ載せない
+        rules_path = os.path.join(self.path, RULES_FILE)
+        output = np.lib.format.open_memmap(f"{rules_path}.tmp", mode="w+", dtype=np.int8, shape=(len(order), n_rules))
+        offsets = np.cumsum([0] + [len(rows) for _, rows in sources])
+        # 出力の各行がどの行列の何行目から来るかを求め、行列ごとにまとめてコピーする
+        source_of_row = np.searchsorted(offsets, order, side="right") - 1
+        positions_by_source = np.split(np.argsort(source_of_row, kind="stable"),
+                                       np.searchsorted(np.sort(source_of_row), np.arange(1, len(sources))))
+        for (matrix, rows), start, positions in zip(sources, offsets[:-1], positions_by_source):
+            if len(positions):
+                output[positions] = matrix[rows[order[positions] - start]]
+        output.flush()
+        del output, sources
+
+        groups = {}
+        keys = metadata["Field"].fillna("").astype(str) + "/" + metadata["Citation"].fillna("").astype(str)
+        for key, positions in keys.groupby(keys, sort=False).indices.items():
+            groups[key] = [int(positions[0]), int(positions[-1]) + 1]
+        index = {"n_rules": int(n_rules), "rows": int(len(metadata)), "groups": groups}
+
+        metadata.to_csv(os.path.join(self.path, f"{METADATA_FILE}.tmp"), index=False, encoding="utf-8")
+        os.replace(f"{rules_path}.tmp", rules_path)
+        os.replace(os.path.join(self.path, f"{METADATA_FILE}.tmp"), os.path.join(self.path, METADATA_FILE))
+        with open(os.path.join(self.path, INDEX_FILE), "w", encoding="utf-8") as file:
+            json.dump(index, file, ensure_ascii=False, indent=2)
+
+        for segment in segments:
+            base = os.path.join(self.segment_dir, segment)
+            os.remove(f"{base}.npy")
+            os.remove(f"{base}.csv")
+        print(f"結果ストアをまとめました: {len(segments)} セグメント / {len(metadata)} 行")
+        return index
+
+    def load(self):
+        """
+        未処理のセグメントをまとめたうえで、ルール行列をメモリマップで開く。
+
+        Returns:
+            StoredResults: 分野・カテゴリごとのビューを返すオブジェクト。
+        """
+        import pandas as pd
+
+        index = self.compact()
+        matrix = np.load(os.path.join(self.path, RULES_FILE), mmap_mode="r")
+        metadata = pd.read_csv(os.path.join(self.path, METADATA_FILE), encoding="utf-8")
+        return StoredResults(matrix, metadata, index)
+
+
+class StoredResults:
+    """
+    ResultsStore.load が返す、まとめ済みのルール行列（メモリマップ）とメタデータ。
+    """
+
+    def __init__(self, matrix, metadata, index):
+        self.matrix = matrix
+        self.metadata = metadata
+        self.index = index
+
+    @property
+    def rules(self):
+        return [f"rule{i + 1}" for i in range(self.matrix.shape[1])]
+
+    def groups(self):
+        """
+        (分野名, カテゴリ) のリストを返す。
+        """
+        return [tuple(key.split("/", 1)) for key in self.index["groups"]]
+
+    def view(self, field, citation=None):
+        """
+        分野（とカテゴリ）の行のルール行列とメタデータを返す。行列はメモリマップのスライスでコピーしない。
+
+        Returns:
+            tuple: (int8 のルール行列, メタデータのデータフレーム)。
+        """
+        keys = [f"{field}/{citation}"] if citation else [key for key in self.index["groups"] if key.split("/", 1)[0] == field]
+        ranges = [self.index["groups"][key] for key in keys if key in self.index["groups"]]
+        if not ranges:
+            return self.matrix[:0], self.metadata.iloc[:0]
+        # 分野・カテゴリ順に並べているため、同じ分野の行は連続している
+        start, end = min(r[0] for r in ranges), max(r[1] for r in ranges)
+        return self.matrix[start:end], self.metadata.iloc[start:end]
+
+    def to_frame(self, field, citation=None, with_text=False):
+        """
+        分野（とカテゴリ）の結果を "yes"/"no" のルール列を持つデータフレームとして返す。
+        with_text=True の場合は、入力CSV（Source）から本文などの列を読み込んで行の位置（Row）で結合する。
+        """
+        import pandas as pd
+        from gemini.response_parser import rules_matrix_to_frame
+        from data_process.ingest import read_csv_or_shard
+
+        matrix, metadata = self.view(field, citation)
+        df = pd.concat([metadata.reset_index(drop=True), rules_matrix_to_frame(np.asarray(matrix))], axis=1)
+        if not with_text:
+            return df
+
+        frames = []
+        for source, rows in df.groupby("Source", sort=False):
+            if "Row" not in rows.columns or rows["Row"].isna().any():
+                raise ValueError(f"行の位置が記録されていない結果です（評価し直してください）: {source}")
+            rows = rows.astype({"Row": "int64"})
+            text = read_csv_or_shard(source)
+            # ID は書き込み時に振り直したもの（load_shard は行番号、サンプリングチェックは1始まり）のため、
+            # 入力CSVの ID 列は使わず行の位置で結合する
+            text = text.drop(columns=[column for column in ("ID", "DOI", "Field", "Citation") if column in text.columns])
+            text["Row"] = np.arange(len(text))
+            merged = rows.merge(text, on="Row", how="left", validate="many_to_one")
+            if len(merged) != len(rows):
+                raise ValueError(f"本文の結合で行数が変わりました: {len(rows)} -> {len(merged)} ({source})")
+            frames.append(merged)
+        return pd.concat(frames, ignore_index=True) if frames else df
@@ -0,0 +1,105 @@
+import asyncio
+import concurrent.futures
+
+from gemini.rate_limiter import estimate_tokens
+from gemini.retry import RetryPolicy, call_with_retry_async
+
+
+async def generate_content_with_retry_async(model, user_message, limiter=None, retries=3, interval=5, policy=None,
+                                            breaker=None):
+    """
+    リトライ付きの非同期Gemini APIリクエスト処理。
+    モデルが generate_content_async を持たない場合はスレッドで generate_content を実行する。
+
+    Args:
+        model: Geminiモデルオブジェクト。
+        user_message (str): 送信するメッセージ。
+        limiter (RateLimiter, optional): 共有レートリミッター。
+        retries (int): 最大試行回数（policy を指定しない場合に使用）。
+        interval (float): バックオフの基準となる待ち時間（policy を指定しない場合に使用）。
+        policy (RetryPolicy, optional): リトライ方針。
+        breaker (CircuitBreaker, optional): サーキットブレーカー。
+
+    Returns:
+        レスポンスオブジェクト。
+    """
+    tokens = estimate_tokens(user_message)
+    policy = policy or RetryPolicy(max_attempts=retries, base_delay=interval)
+
+    def request():
+        if hasattr(model, "generate_content_async"):
+            return model.generate_content_async(user_message)
+        return asyncio.to_thread(model.generate_content, user_message)
+
+    def before_attempt():
+        return limiter.acquire(tokens)
+
+    return await call_with_retry_async(
+        request, policy=policy, breaker=breaker, before_attempt=before_attempt if limiter is not None else None
+    )
+
+
+async def process_requests_async(model, requests, concurrency, limiter=None, retries=3, interval=5, progress=None,
+                                 on_response=None, on_error=None, policy=None, breaker=None):
+    """
+    最大 concurrency 件のリクエストを同時に送信し、入力順に結果を返す。
+
+    Args:
+        model: Geminiモデルオブジェクト。
+        requests (list): {"abstract_id": ..., "message": ...} 形式の辞書のリスト。
+        concurrency (int): 同時に送信するリクエスト数の上限。
+        limiter (RateLimiter, optional): 共有レートリミッター。
+        retries (int): 最大試行回数。
+        interval (float): リトライ間隔（秒）。
+        progress (tqdm, optional): 進捗バー。
+        on_response (callable, optional): レスポンス受信ごとに on_response(request, text) を呼び出す。
+        on_error (callable, optional): リトライしても失敗した場合に on_error(request, error) を呼び出す。
+        policy (RetryPolicy, optional): リトライ方針。
+        breaker (CircuitBreaker, optional): 全リクエストで共有するサーキットブレーカー。
+
+    Returns:
+        list: {"abstract_id": ..., "response": str or None} 形式の辞書のリスト（入力順）。
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(request):
+        async with semaphore:
+            try:
+                response = await generate_content_with_retry_async(
+                    model, request["message"], limiter=limiter, retries=retries, interval=interval,
+                    policy=policy, breaker=breaker,
+                )
+                text = response.text
+            except Exception as e:
+                print(f"処理エラー: {e}")
+                text = None  # エラー時は空データを追加
+                if on_error is not None:
+                    on_error(request, e)
+        if on_response is not None:
+            on_response(request, text)
+        if progress is not None:
+            progress.update(1)
+        return {"abstract_id": request["abstract_id"], "response": text}
+
+    # gather は入力順に結果を返すため、完了順に関わらずアブストラクト順が保たれる
+    return await asyncio.gather(*(run(request) for request in requests))
+
+
+def run_async(coroutine):
+    """
+    コルーチンを同期的に実行する。
+    Jupyterなどで既にイベントループが動作している場合は別スレッドで実行する。
+
+    Args:
+        coroutine: 実行するコルーチン。
+
+    Returns:
+        コルーチンの戻り値。
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
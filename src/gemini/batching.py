@@ -0,0 +1,78 @@
+import json
+
+ANSWERS = ("yes", "no")
+
+BATCH_INSTRUCTION = """
+---
+# Batch Instruction
+The message contains {count} abstracts, each introduced by its Abstract ID.
+Evaluate every abstract independently using the Rules above.
+Return one object per abstract in "results", in the same order as the abstracts, and add an "abstract_id" field holding the integer Abstract ID to each object.
+"""
+
+
+def chunk(items, size):
+    """
+    リストを size 件ずつに分割する。
+    """
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def create_batch_user_message(abstracts, rules):
+    """
+    複数のアブストラクトをIDつきで1つのメッセージにまとめる。ルール定義は1回だけ記載する。
+
+    Args:
+        abstracts (list): {"abstract_id": ..., "content": ...} 形式の辞書のリスト。
+        rules (str): ルール定義テキスト。
+
+    Returns:
+        str: バッチ用のメッセージ。
+    """
+    sections = [f"Abstract ID: {int(abstract['abstract_id'])}\nAbstract: {abstract['content']}" for abstract in abstracts]
+    return "\n\n".join(sections) + f"\n\n{rules}" + BATCH_INSTRUCTION.format(count=len(abstracts))
+
+
+def is_valid_rules(rules):
+    """
+    ルールの回答が "yes"/"no" のみからなる空でないリストかどうかを判定する。
+    """
+    return isinstance(rules, list) and len(rules) > 0 and all(rule in ANSWERS for rule in rules)
+
+
+def split_batch_response(response, abstract_ids):
+    """
+    バッチのレスポンスをアブストラクトIDごとに分割する。
+    各要素は単一アブストラクトのレスポンスと同じ {"results": [...]} 形式のテキストに変換するため、
+    以降のパース・キャッシュ・ジャーナルの処理はそのまま利用できる。
+    欠落している要素や不正な要素は結果に含めない。
+
+    Args:
+        response (str): バッチのレスポンスのテキスト。
+        abstract_ids (list): バッチに含めたアブストラクトIDのリスト。
+
+    Returns:
+        dict: {abstract_id: レスポンスのテキスト} の辞書。
+    """
+    expected = {int(abstract_id): abstract_id for abstract_id in abstract_ids}
+    try:
+        parsed = json.loads(response)
+    except (json.JSONDecodeError, TypeError):
+        return {}
+
+    items = parsed.get("results", []) if isinstance(parsed, dict) else parsed
+    if not isinstance(items, list):
+        return {}
+
+    responses = {}
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        try:
+            item_id = int(item.get("abstract_id"))
+        except (TypeError, ValueError):
+            continue
+        if item_id not in expected or not is_valid_rules(item.get("rules")):
+            continue
+        responses[expected[item_id]] = json.dumps({"results": [item]}, ensure_ascii=False)
+    return responses
@@ -0,0 +1,317 @@
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+import contextlib
+import numpy as np
+import pandas as pd
+
+# python src/gemini/benchmark.py として実行した場合も gemini パッケージを読み込めるようにする
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from gemini.fake_model import FakeModel
+from gemini.rate_limiter import RateLimiter
+from gemini.retry import RetryPolicy
+from gemini.gemini_modules import process_shard
+from sampling_check.functions import create_test_data
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_INPUT_DIR = os.path.join(BASE_DIR, "..", "..", "data", "csv")
+DEFAULT_RULES_PATH = os.path.join(BASE_DIR, "..", "prompt", "rules.txt")
+DEFAULT_SAMPLING_PATH = os.path.join(BASE_DIR, "..", "..", "data", "test", "sampling_check.csv")
+
+# 計測するシナリオ（process_shard に渡すオプション）
+# serial は固定のスリープ（4秒）を避けるため、十分に大きいRPMのレートリミッターを使用する
+SCENARIOS = {
+    "serial": {"concurrency": None, "rpm": 1_000_000},
+    "concurrent": {"concurrency": 16},
+    "batched": {"concurrency": 16, "batch_size": 5},
+}
+
+# ベースラインとの比較に使う指標と、値が大きいほど良いかどうか
+COMPARED_METRICS = {
+    "abstracts_per_sec": True,
+    "latency_p95": False,
+    "requests": False,
+    "retries": False,
+}
+
+
+class TimedModel:
+    """
+    モデルの generate_content の所要時間（失敗したリクエストを含む）を記録するラッパー。
+    それ以外の属性（model_name など）は元のモデルのものを返す。
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.latencies = []
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def generate_content(self, contents, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self.model.generate_content(contents, **kwargs)
+        finally:
+            self.latencies.append(time.perf_counter() - start)
+
+    async def generate_content_async(self, contents, **kwargs):
+        start = time.perf_counter()
+        try:
+            if hasattr(self.model, "generate_content_async"):
+                return await self.model.generate_content_async(contents, **kwargs)
+            return await asyncio.to_thread(self.model.generate_content, contents, **kwargs)
+        finally:
+            self.latencies.append(time.perf_counter() - start)
+
+
+def list_shards(input_dir=DEFAULT_INPUT_DIR, fields=None, citation_types=("high", "low"), limit=None):
+    """
+    計測に使う分割済みのCSVファイル（シャード）のパスを返す。
+
+    Args:
+        input_dir (str): 分野ごとのディレクトリを含む入力ディレクトリ。
+        fields (list, optional): 対象の分野。Noneの場合はすべての分野。
+        citation_types (tuple): 対象の "high" / "low"。
+        limit (int, optional): シャード数の上限。
+
+    Returns:
+        list: CSVファイルのパスのリスト。
+    """
+    fields = fields or sorted(os.listdir(input_dir))
+    files = []
+    for field in fields:
+        field_dir = os.path.join(input_dir, field)
+        if not os.path.isdir(field_dir):
+            continue
+        files.extend(
+            os.path.join(field_dir, file_name) for file_name in sorted(os.listdir(field_dir))
+            if file_name.endswith(".csv") and any(citation_type in file_name for citation_type in citation_types)
+        )
+    return files[:limit] if limit else files
+
+
+def latency_percentiles(latencies):
+    """
+    リクエストごとの所要時間（秒）から p50/p95/p99（ミリ秒）を返す。
+    """
+    if not latencies:
+        return {"latency_p50": None, "latency_p95": None, "latency_p99": None}
+    p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+    return {"latency_p50": round(float(p50), 3), "latency_p95": round(float(p95), 3), "latency_p99": round(float(p99), 3)}
+
+
+def count_answered(output_dir):
+    """
+    出力ディレクトリの結果CSVから、評価対象のアブストラクト数と回答を取得できた件数を返す。
+    """
+    total = answered = 0
+    for file_name in os.listdir(output_dir):
+        if not file_name.endswith(".csv"):
+            continue
+        df = pd.read_csv(os.path.join(output_dir, file_name))
+        has_abstract = df["Abstract"].notna()
+        total += int(has_abstract.sum())
+        if "rule1" in df.columns:
+            answered += int((has_abstract & df["rule1"].notna()).sum())
+    return total, answered
+
+
+def summarize_run(name, model, fake, wall_time, total, answered, shards):
+    result = {
+        "scenario": name,
+        "shards": shards,
+        "abstracts": total,
+        "answered": answered,
+        "requests": fake.calls,
+        "retries": fake.retries,
+        "wall_time": round(wall_time, 3),
+        "abstracts_per_sec": round(total / wall_time, 3) if wall_time > 0 else None,
+    }
+    result.update(latency_percentiles(model.latencies))
+    return result
+
+
+def run_scenario(name, input_files, rules, model_options=None, policy_options=None, concurrency=None,
+                 batch_size=None, rpm=None, quiet=True):
+    """
+    フェイクモデルを使って実際のパイプライン（process_shard）を実行し、スループットなどを計測する。
+
+    Args:
+        name (str): シナリオ名。
+        input_files (list): 入力CSVファイルのパスのリスト。
+        rules (str): ルール定義テキスト。
+        model_options (dict, optional): FakeModel に渡すオプション（遅延の分布・エラー率・シードなど）。
+        policy_options (dict, optional): RetryPolicy に渡すオプション。
+        concurrency (int, optional): 同時に送信するリクエスト数。
+        batch_size (int, optional): 1リクエストにまとめるアブストラクト数。
+        rpm (int, optional): レートリミッターの1分あたりの最大リクエスト数。
+        quiet (bool): Trueの場合、パイプラインの標準出力と進捗表示を抑制する。
+
+    Returns:
+        dict: 計測結果（abstracts_per_sec, latency_p50/p95/p99, retries, wall_time など）。
+    """
+    fake = FakeModel(**(model_options or {}))
+    model = TimedModel(fake)
+    policy = RetryPolicy(**{"base_delay": 0.05, "max_delay": 1, "seed": 0, **(policy_options or {})})
+    limiter = RateLimiter(rpm=rpm) if rpm else None
+    output_dir = tempfile.mkdtemp(prefix=f"benchmark_{name}_")
+
+    sink = io.StringIO()
+    try:
+        with contextlib.ExitStack() as stack:
+            if quiet:
+                stack.enter_context(contextlib.redirect_stdout(sink))
+                stack.enter_context(contextlib.redirect_stderr(sink))
+            start = time.perf_counter()
+            for input_file in input_files:
+                output_file = os.path.join(output_dir, os.path.basename(input_file))
+                process_shard(model, rules, input_file, output_file, concurrency=concurrency, limiter=limiter,
+                              batch_size=batch_size, policy=policy)
+            wall_time = time.perf_counter() - start
+        total, answered = count_answered(output_dir)
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+    return summarize_run(name, model, fake, wall_time, total, answered, len(input_files))
+
+
+def run_sampling_check(rules, model_options=None, file_path=DEFAULT_SAMPLING_PATH, limit=3, quiet=True):
+    """
+    サンプリングチェック用のテストデータ作成（create_test_data）を計測する。
+    create_test_data はリクエストごとに3秒の間隔を空けるため、先頭の limit 件のみ処理する。
+    """
+    fake = FakeModel(**(model_options or {}))
+    model = TimedModel(fake)
+    work_dir = tempfile.mkdtemp(prefix="benchmark_sampling_check_")
+    input_file = os.path.join(work_dir, "input.csv")
+    output_file = os.path.join(work_dir, "output.csv")
+    pd.read_csv(file_path).head(limit).to_csv(input_file, index=False)
+
+    sink = io.StringIO()
+    try:
+        with contextlib.ExitStack() as stack:
+            if quiet:
+                stack.enter_context(contextlib.redirect_stdout(sink))
+                stack.enter_context(contextlib.redirect_stderr(sink))
+            start = time.perf_counter()
+            create_test_data(input_file, model, rules, output_file)
+            wall_time = time.perf_counter() - start
+        result_df = pd.read_csv(output_file) if os.path.exists(output_file) else pd.DataFrame()
+        answered = int(result_df["rule1"].notna().sum()) if "rule1" in result_df.columns else 0
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return summarize_run("sampling_check", model, fake, wall_time, limit, answered, 1)
+
+
+def save_baseline(results, path):
+    """
+    計測結果をベースライン（JSON）として保存する。
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    baseline = {"created_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "results": {result["scenario"]: result for result in results}}
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(baseline, file, ensure_ascii=False, indent=2)
+
+
+def compare_with_baseline(results, path, tolerance=0.2):
+    """
+    計測結果をベースラインと比較し、許容範囲を超えて悪化した指標を返す。
+
+    Args:
+        results (list): run_scenario の結果のリスト。
+        path (str): ベースライン（JSON）のパス。
+        tolerance (float): 許容する悪化の割合（0.2 の場合は20%まで）。
+
+    Returns:
+        list: 悪化した指標の説明のリスト。
+    """
+    with open(path, "r", encoding="utf-8") as file:
+        baseline = json.load(file)["results"]
+
+    regressions = []
+    for result in results:
+        reference = baseline.get(result["scenario"])
+        if reference is None:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            current, previous = result.get(metric), reference.get(metric)
+            if current is None or previous is None:
+                continue
+            if higher_is_better:
+                regressed = current < previous * (1 - tolerance)
+            else:
+                regressed = current > previous * (1 + tolerance)
+            if regressed:
+                regressions.append(f"{result['scenario']}: {metric} {previous} -> {current}")
+    return regressions
+
+
+def format_results(results):
+    columns = ["scenario", "abstracts", "answered", "requests", "retries", "wall_time", "abstracts_per_sec",
+               "latency_p50", "latency_p95", "latency_p99"]
+    return pd.DataFrame(results)[columns].to_string(index=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="フェイクモデルを使ったGeminiパイプラインのオフラインベンチマーク")
+    parser.add_argument("--input-dir", default=DEFAULT_INPUT_DIR)
+    parser.add_argument("--rules", default=DEFAULT_RULES_PATH)
+    parser.add_argument("--fields", nargs="*")
+    parser.add_argument("--shards", type=int, default=4, help="計測に使うシャード数")
+    parser.add_argument("--scenarios", nargs="*", default=list(SCENARIOS), help=f"{list(SCENARIOS)} と sampling_check")
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--latency-distribution", default="lognormal")
+    parser.add_argument("--quota-error-rate", type=float, default=0.02)
+    parser.add_argument("--server-error-rate", type=float, default=0.01)
+    parser.add_argument("--timeout-rate", type=float, default=0.0)
+    parser.add_argument("--malformed-rate", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", help="比較するベースライン（JSON）")
+    parser.add_argument("--save-baseline", help="計測結果をベースラインとして保存するパス")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    with open(args.rules, "r", encoding="utf-8") as file:
+        rules = file.read()
+    model_options = {
+        "latency": args.latency,
+        "latency_distribution": args.latency_distribution,
+        "quota_error_rate": args.quota_error_rate,
+        "server_error_rate": args.server_error_rate,
+        "timeout_rate": args.timeout_rate,
+        "malformed_rate": args.malformed_rate,
+        "seed": args.seed,
+    }
+    input_files = list_shards(args.input_dir, args.fields, limit=args.shards)
+
+    results = []
+    for name in args.scenarios:
+        if name == "sampling_check":
+            results.append(run_sampling_check(rules, model_options))
+        else:
+            results.append(run_scenario(name, input_files, rules, model_options, **SCENARIOS[name]))
+    print(format_results(results))
+
+    if args.save_baseline:
+        save_baseline(results, args.save_baseline)
+        print(f"ベースラインを保存しました: {args.save_baseline}")
+    if args.baseline:
+        regressions = compare_with_baseline(results, args.baseline, args.tolerance)
+        if regressions:
+            print("ベースラインから悪化した指標があります:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print("ベースラインからの悪化はありません。")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,242 @@
+import os
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+from gemini.gemini_modules import create_user_message
+from gemini.rate_limiter import estimate_tokens
+from gemini.response_parser import (
+    ANSWER_CODES, ANSWER_LABELS, NO, YES, extract_rules, frame_to_rules_matrix, rules_matrix_to_frame,
+)
+from gemini.retry import call_with_retry
+from gemini.rule_versions import parse_rules
+
+# 同時に yes にはならない評価指標の組（例: 背景が1文 / 2文、目的が現在形 / 過去形）
+DEFAULT_EXCLUSIVE_RULES = [("rule2", "rule3"), ("rule8", "rule9"), ("rule19", "rule20")]
+
+# 再サンプリング時の温度（temperature 0 のままでは同じ回答しか得られない）
+DEFAULT_TEMPERATURE = 0.7
+
+
+def unstable_rules_from_metrics(metrics_df, min_score=0.6):
+    """
+    サンプリングチェックの指標（sampling_check.metrics.calculate_metrics の結果）から、不安定な評価指標と
+    疑わしい回答を求めます。Precision が低い指標は "yes"、Recall が低い指標は "no" の回答を疑わしいとします。
+    分母が0（yes の回答がない / 人間の評価に yes がない）のスコアは判断できないため使用しません。
+
+    Returns:
+        dict: {評価指標: 疑わしい回答のタプル}。
+    """
+    unstable = {}
+    for _, row in metrics_df[metrics_df["Rule"] != "Average"].iterrows():
+        suspect = []
+        if row["TP"] + row["FP"] > 0 and row["Precision"] < min_score:
+            suspect.append("yes")
+        if row["TP"] + row["FN"] > 0 and row["Recall"] < min_score:
+            suspect.append("no")
+        if suspect:
+            unstable[row["Rule"]] = tuple(suspect)
+    return unstable
+
+
+class ConsensusSampler:
+    """
+    不安定な評価指標の回答が疑わしいパターンに当てはまるアブストラクトだけを再度問い合わせ、多数決で回答を決める。
+    最初の回答を1票目とし、票差が残りの試行回数を超えて多数決の結果が確定した評価指標から順に問い合わせをやめる。
+    問い合わせには未確定の評価指標だけを含むプロンプトを使用する。
+    """
+
+    def __init__(self, unstable, max_samples=5, temperature=DEFAULT_TEMPERATURE, exclusive=DEFAULT_EXCLUSIVE_RULES,
+                 concurrency=1):
+        """
+        Args:
+            unstable (dict or list): {評価指標: 疑わしい回答のタプル}。リストの場合は両方の回答を疑わしいとする。
+            max_samples (int): 1つの評価指標の最大の票数（最初の回答を含む）。奇数を推奨。
+            temperature (float): 再サンプリング時の温度。
+            exclusive (list): 同時に yes にはならない評価指標の組。両方 yes の場合は両方を疑わしいとする。
+            concurrency (int): 同時に送信するリクエスト数。
+        """
+        if not isinstance(unstable, dict):
+            unstable = {rule: ("yes", "no") for rule in unstable}
+        self.unstable = unstable
+        self.max_samples = max_samples
+        self.temperature = temperature
+        self.exclusive = [pair for pair in exclusive if all(rule in unstable for rule in pair)]
+        self.concurrency = concurrency
+        self._stats = new_stats()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # スケジューラーのワーカーへ渡すため、ロックを除いて pickle する
+        state = dict(self.__dict__)
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def uncertain_cells(self, df):
+        """
+        再度問い合わせる (行, 評価指標) の真偽値の行列を返す（列は self.unstable の順）。
+        """
+        rules = [rule for rule in self.unstable if rule in df.columns]
+        matrix = frame_to_rules_matrix(df, rules)
+        uncertain = np.zeros(matrix.shape, dtype=bool)
+        for j, rule in enumerate(rules):
+            for answer in self.unstable[rule]:
+                uncertain[:, j] |= matrix[:, j] == ANSWER_CODES[answer]
+        columns = {rule: j for j, rule in enumerate(rules)}
+        for first, second in self.exclusive:
+            if first in columns and second in columns:
+                conflict = (matrix[:, columns[first]] == YES) & (matrix[:, columns[second]] == YES)
+                uncertain[conflict, columns[first]] = True
+                uncertain[conflict, columns[second]] = True
+        # アブストラクトがない行は問い合わせない
+        if "Abstract" in df.columns:
+            uncertain[df["Abstract"].isna().to_numpy()] = False
+        return rules, matrix, uncertain
+
+    def _sample(self, model, ruleset, abstract, rules, limiter=None, policy=None, breaker=None):
+        # 未確定の評価指標だけを含むプロンプトを、温度を上げて送信する（キャッシュは使用しない）
+        prompt = create_user_message(abstract, ruleset.format([ruleset.rules[int(rule[4:]) - 1] for rule in rules]))
+        tokens = estimate_tokens(prompt)
+        try:
+            response = call_with_retry(
+                lambda: model.generate_content(prompt, generation_config={"temperature": self.temperature}),
+                policy=policy, breaker=breaker,
+                before_attempt=(lambda: limiter.wait(tokens)) if limiter is not None else None,
+            )
+        except Exception as e:
+            print(f"再サンプリングのエラー: {e}")
+            return None
+        answers, status = extract_rules(response.text)
+        if status != "ok" or len(answers) != len(rules):
+            return None
+        return answers
+
+    def run(self, model, rules_text, df, limiter=None, policy=None, breaker=None):
+        """
+        結果のデータフレーム（Abstract 列と rule 列を持つ）の疑わしい回答を多数決で決め直し、票数の列を加えて返す。
+        票数は `{評価指標}_yes_votes` と `{評価指標}_no_votes` の列として、各評価指標の列の直後に追加する。
+
+        Args:
+            model: Geminiモデルオブジェクト（generate_content に generation_config を渡せるもの）。
+            rules_text (str): ルール定義テキスト。
+            df (pd.DataFrame): 結果のデータフレーム。
+            limiter (RateLimiter, optional): レートリミッター。
+            policy (RetryPolicy, optional): リトライ方針。
+            breaker (CircuitBreaker, optional): サーキットブレーカー。
+        """
+        ruleset = parse_rules(rules_text)
+        rules, matrix, uncertain = self.uncertain_cells(df)
+        yes_votes = (matrix == YES).astype(np.int64)
+        no_votes = (matrix == NO).astype(np.int64)
+        abstracts = df["Abstract"].to_numpy()
+
+        pending = {i: np.flatnonzero(uncertain[i]) for i in np.flatnonzero(uncertain.any(axis=1))}
+        stats = {**new_stats(), "abstracts": len(df), "requeried": len(pending), "uncertain_cells": int(uncertain.sum())}
+        for round_index in range(self.max_samples - 1):
+            if not pending:
+                break
+            items = list(pending.items())
+
+            def sample(item):
+                i, columns = item
+                return self._sample(model, ruleset, abstracts[i], [rules[j] for j in columns], limiter, policy, breaker)
+
+            if self.concurrency > 1:
+                with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                    samples = list(executor.map(sample, items))
+            else:
+                samples = [sample(item) for item in items]
+            stats["calls"] += len(items)
+
+            for (i, columns), answers in zip(items, samples):
+                if answers is None:
+                    continue
+                for j, answer in zip(columns, answers):
+                    yes_votes[i, j] += answer == "yes"
+                    no_votes[i, j] += answer == "no"
+                    stats["votes"] += answer in ("yes", "no")
+                # 票差が残りの試行回数を超えた（残りの票で結果が変わらない）評価指標は問い合わせをやめる
+                rounds_left = self.max_samples - 2 - round_index
+                margin = np.abs(yes_votes[i, columns] - no_votes[i, columns])
+                remaining = columns[margin <= rounds_left] if rounds_left > 0 else columns[:0]
+                if len(remaining):
+                    pending[i] = remaining
+                else:
+                    del pending[i]
+
+        # 多数決（同数の場合は最初の回答のまま）
+        decided = np.where(yes_votes > no_votes, YES, np.where(no_votes > yes_votes, NO, matrix)).astype(np.int8)
+        stats["changed"] = int((decided != matrix).sum())
+        self.merge_stats(stats)
+
+        df = df.copy()
+        for j, rule in enumerate(rules):
+            df[rule] = ANSWER_LABELS[decided[:, j]]
+            position = df.columns.get_loc(rule) + 1
+            for suffix, votes in (("yes_votes", yes_votes), ("no_votes", no_votes)):
+                column = f"{rule}_{suffix}"
+                if column in df.columns:
+                    df = df.drop(columns=[column])
+                df.insert(position, column, votes[:, j])
+                position += 1
+        return df
+
+    def apply_to_file(self, model, rules_text, output_file, dependencies=None, results_store=None, source=None,
+                      **options):
+        """
+        結果のCSVファイルに run を適用して上書きします。
+        dependencies を指定した場合は多数決の後に指標間の依存関係を適用し直し、results_store を指定した場合はセグメントも書き直します。
+
+        Args:
+            **options: run に渡すオプション（limiter, policy, breaker）。
+        """
+        import pandas as pd
+
+        df = pd.read_csv(output_file, encoding="utf-8")
+        if "Abstract" not in df.columns or not any(rule in df.columns for rule in self.unstable):
+            return df
+        calls = self.stats()["calls"]
+        df = self.run(model, rules_text, df, **options)
+        rules = [column for column in df.columns if column.startswith("rule") and column[4:].isdigit()]
+        matrix = frame_to_rules_matrix(df, rules)
+        if dependencies is not None:
+            matrix = dependencies.apply(matrix, inplace=True)
+            df[rules] = rules_matrix_to_frame(matrix, index=df.index).to_numpy()
+        df.to_csv(output_file, index=False, encoding="utf-8")
+        if results_store is not None:
+            results_store.write_results(df, matrix, df["ID"], output_file, source=source)
+        print(f"多数決の結果を保存しました: {os.path.basename(output_file)}（追加の呼び出し {self.stats()['calls'] - calls}回）")
+        return df
+
+    def pop_stats(self):
+        """
+        集計した統計を返し、集計をリセットする（ワーカープロセスからジョブごとに回収するため）。
+        """
+        with self._lock:
+            stats, self._stats = self._stats, new_stats()
+        return stats
+
+    def merge_stats(self, stats):
+        """
+        別のプロセスで集計した統計（pop_stats の戻り値）を加算する。
+        """
+        with self._lock:
+            for key, value in stats.items():
+                self._stats[key] += value
+
+    def stats(self):
+        """
+        再サンプリングの統計を返す。full_voting_calls は全アブストラクトを max_samples 回評価した場合の追加の呼び出し数。
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        full = stats["abstracts"] * (self.max_samples - 1)
+        return {**stats, "full_voting_calls": full, "saved_calls": full - stats["calls"]}
+
+
+def new_stats():
+    return {"abstracts": 0, "requeried": 0, "uncertain_cells": 0, "calls": 0, "votes": 0, "changed": 0}
@@ -0,0 +1,171 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+
+from gemini.response_cache import make_cache_key
+
+
+def normalize_doi(doi):
+    """
+    DOIを比較用に正規化する（小文字化、URLの接頭辞と前後の空白の除去）。空の場合は None を返す。
+    """
+    if not isinstance(doi, str):
+        return None
+    doi = re.sub(r"^(https?://(dx\.)?doi\.org/|doi:)", "", doi.strip().lower())
+    return doi or None
+
+
+def normalize_abstract(text):
+    """
+    アブストラクトを比較用に正規化する（Unicode正規化、小文字化、空白の統一）。空の場合は None を返す。
+    """
+    if not isinstance(text, str):
+        return None
+    text = re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text)).strip().lower()
+    return text or None
+
+
+def abstract_aliases(doi, abstract):
+    """
+    アブストラクトを識別するキーの候補（DOI、正規化したアブストラクトのハッシュ）を優先順に返す。
+    """
+    aliases = []
+    doi = normalize_doi(doi)
+    if doi is not None:
+        aliases.append(f"doi:{doi}")
+    text = normalize_abstract(abstract)
+    if text is not None:
+        aliases.append(f"hash:{hashlib.sha256(text.encode('utf-8')).hexdigest()}")
+    return aliases
+
+
+class DedupIndex:
+    """
+    分野・シャードをまたいで同一のアブストラクトを特定するSQLiteベースの永続インデックス。
+    DOIを優先し、DOIがない場合は正規化したアブストラクトのハッシュで同一性を判定する。
+    一意なアブストラクトごとに評価結果を保存し、同じアブストラクトを参照するすべてのシャードに展開する。
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): SQLiteファイルのパス。
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.calls_saved = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS aliases (alias TEXT PRIMARY KEY, key TEXT NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS refs ("
+            "source TEXT NOT NULL, abstract_id INTEGER NOT NULL, key TEXT NOT NULL, "
+            "PRIMARY KEY (source, abstract_id));"
+            "CREATE INDEX IF NOT EXISTS idx_refs_key ON refs (key);"
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, created_at REAL NOT NULL);"
+        )
+        self._conn.commit()
+
+    def _resolve(self, aliases):
+        # 既知の別名があればその代表キーを使い、なければ最優先の別名を代表キーとする
+        key = None
+        for alias in aliases:
+            row = self._conn.execute("SELECT key FROM aliases WHERE alias = ?", (alias,)).fetchone()
+            if row is not None:
+                key = row[0]
+                break
+        key = key or aliases[0]
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO aliases (alias, key) VALUES (?, ?)", [(alias, key) for alias in aliases]
+        )
+        return key
+
+    def register(self, source, abstracts):
+        """
+        シャードが参照するアブストラクトを登録し、代表キーのリストを返す。
+
+        Args:
+            source (str): 入力ファイル（またはシャード）の識別子。
+            abstracts (list): load_shard が返すアブストラクトのリスト。
+
+        Returns:
+            list: 各アブストラクトの代表キー。
+        """
+        keys = []
+        with self._lock:
+            for abstract in abstracts:
+                aliases = abstract_aliases(abstract.get("doi"), abstract["content"])
+                key = self._resolve(aliases) if aliases else None
+                keys.append(key)
+                if key is not None:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO refs (source, abstract_id, key) VALUES (?, ?, ?)",
+                        (source, int(abstract["abstract_id"]), key),
+                    )
+            self._conn.commit()
+        return keys
+
+    def _response_key(self, model, rules, key):
+        # 評価結果はモデルの設定とルール定義ごとに保存する
+        return make_cache_key(model, rules, key)
+
+    def get(self, model, rules, key):
+        """
+        代表キーに対応する評価結果を返す。存在しない場合は None を返す。
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response FROM responses WHERE key = ?", (self._response_key(model, rules, key),)
+            ).fetchone()
+        return row[0] if row is not None else None
+
+    def put(self, model, rules, key, response):
+        """
+        代表キーに対応する評価結果を保存する。response が None の場合は保存しない。
+        """
+        if response is None:
+            return
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created_at) VALUES (?, ?, ?)",
+                (self._response_key(model, rules, key), response, time.time()),
+            )
+            self._conn.commit()
+
+    def stats(self):
+        """
+        登録済みの参照数、一意なアブストラクト数、重複数と、この実行で節約したAPI呼び出し数を返す。
+        """
+        with self._lock:
+            references, unique = self._conn.execute("SELECT COUNT(*), COUNT(DISTINCT key) FROM refs").fetchone()
+        return {
+            "references": references,
+            "unique": unique,
+            "duplicates": references - unique,
+            "calls_saved": self.calls_saved,
+        }
+
+    def duplicates(self):
+        """
+        複数のシャードから参照されているアブストラクトの (代表キー, 参照元のリスト) を返す。
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, source, abstract_id FROM refs WHERE key IN "
+                "(SELECT key FROM refs GROUP BY key HAVING COUNT(*) > 1) ORDER BY key, source, abstract_id"
+            ).fetchall()
+        groups = {}
+        for key, source, abstract_id in rows:
+            groups.setdefault(key, []).append((source, abstract_id))
+        return groups
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
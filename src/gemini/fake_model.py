@@ -0,0 +1,200 @@
+import re
+import math
+import time
+import json
+import asyncio
+import random
+import hashlib
+
+
+BATCH_PATTERN = re.compile(r"Abstract ID: (\d+)\nAbstract: (.*?)(?=\n\nAbstract ID: |\n\n)", re.S)
+RULE_PATTERN = re.compile(r"^\d+\. ", re.M)
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "exponential", "lognormal")
+
+
+class FakeAPIError(Exception):
+    """
+    APIのエラー（429 / 5xx）を模した例外。
+    """
+
+    def __init__(self, code, retry_after=None):
+        super().__init__(f"{code} Fake API Error")
+        self.code = code
+        self.retry_after = retry_after
+
+
+class FakeResponse:
+    """
+    Geminiのレスポンスを模したオブジェクト。
+    """
+
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeModel:
+    """
+    APIを呼び出さずに動作確認を行うためのローカルのフェイクモデル。
+    generate_content / generate_content_async を実装し、指定した遅延の後に
+    プロンプトから決定的に生成したJSONレスポンスを返す。
+    """
+
+    def __init__(self, latency=0.0, n_rules=31, model_name="models/fake-gemini", drop_batch_items=0,
+                 quota_error_rate=0.0, server_error_rate=0.0, timeout_rate=0.0, malformed_rate=0.0,
+                 fenced_rate=0.0, prose_rate=0.0, missing_rule_rate=0.0, sample_flip_rate=0.0, retry_after=None,
+                 seed=0, latency_distribution="fixed", latency_sigma=0.5, max_latency=None):
+        """
+        Args:
+            latency (float): 1リクエストあたりの遅延（秒）。分布を指定した場合は平均値。
+            n_rules (int): レスポンスに含める評価指標の数。Noneの場合はプロンプト中の番号付きの評価指標の数。
+            model_name (str): モデル名。
+            drop_batch_items (int): バッチのレスポンスから末尾を欠落させる件数（フォールバックの確認用）。
+            quota_error_rate (float): 429エラーを発生させる確率。
+            server_error_rate (float): 503エラーを発生させる確率。
+            timeout_rate (float): タイムアウトを発生させる確率。
+            malformed_rate (float): JSONとして解釈できないレスポンスを返す確率。
+            fenced_rate (float): ```json のコードフェンスで囲んだレスポンスを返す確率。
+            prose_rate (float): JSONの前後に説明文を付けたレスポンスを返す確率。
+            missing_rule_rate (float): 末尾の評価指標の回答が欠けたレスポンスを返す確率。
+            sample_flip_rate (float): generation_config の temperature が0より大きい場合に、各回答を反転させる確率（多数決の確認用）。
+            retry_after (float, optional): 429エラーに付与する再試行までの待ち時間（秒）。
+            seed (int): 障害発生と遅延の乱数シード。
+            latency_distribution (str): 遅延の分布。"fixed", "uniform"（0〜2倍）, "exponential", "lognormal" のいずれか。
+            latency_sigma (float): "lognormal" の場合の対数の標準偏差（裾の重さ）。
+            max_latency (float, optional): 遅延の上限（秒）。
+        """
+        if latency_distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"未対応の遅延の分布です: {latency_distribution}")
+        self.latency = latency
+        self.latency_distribution = latency_distribution
+        self.latency_sigma = latency_sigma
+        self.max_latency = max_latency
+        self.quota_error_rate = quota_error_rate
+        self.server_error_rate = server_error_rate
+        self.timeout_rate = timeout_rate
+        self.malformed_rate = malformed_rate
+        self.fenced_rate = fenced_rate
+        self.prose_rate = prose_rate
+        self.missing_rule_rate = missing_rule_rate
+        self.sample_flip_rate = sample_flip_rate
+        self.retry_after = retry_after
+        self.seed = seed
+        self._attempts = {}
+        self.n_rules = n_rules
+        self.drop_batch_items = drop_batch_items
+        self.model_name = model_name
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def _build_rules(self, text, n_rules):
+        # テキストのハッシュから yes/no を決定的に生成
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        return ["yes" if digest[i % len(digest)] % 2 == 0 else "no" for i in range(n_rules)]
+
+    def _build_text(self, contents, flip=None):
+        contents = str(contents)
+        n_rules = self.n_rules or len(RULE_PATTERN.findall(contents))
+        batch = BATCH_PATTERN.findall(contents)
+        if not batch:
+            rules = self._build_rules(contents, n_rules)
+            if flip is not None:
+                # 温度を上げた場合のばらつきとして、試行ごとに回答を反転させる
+                rules = [{"yes": "no", "no": "yes"}[rule] if flip.random() < self.sample_flip_rate else rule
+                         for rule in rules]
+            return json.dumps({"results": [{"separated_abstract": {}, "rules": rules}]})
+
+        # バッチの場合はアブストラクトIDごとに結果を返す
+        results = [
+            {"abstract_id": int(abstract_id), "separated_abstract": {}, "rules": self._build_rules(abstract, n_rules)}
+            for abstract_id, abstract in batch
+        ]
+        if self.drop_batch_items:
+            results = results[:-self.drop_batch_items]
+        return json.dumps({"results": results})
+
+    def _fault_random(self, contents):
+        # 同じプロンプトの何回目の試行かで乱数を決めるため、実行順に関わらず再現性がある
+        key = hashlib.sha256(str(contents).encode("utf-8")).hexdigest()
+        attempt = self._attempts.get(key, 0)
+        self._attempts[key] = attempt + 1
+        return random.Random(f"{self.seed}:{key}:{attempt}")
+
+    def _sample_latency(self, rng):
+        if not self.latency or self.latency_distribution == "fixed":
+            delay = self.latency
+        elif self.latency_distribution == "uniform":
+            delay = rng.uniform(0, 2 * self.latency)
+        elif self.latency_distribution == "exponential":
+            delay = rng.expovariate(1 / self.latency)
+        else:
+            # 平均が latency となるように対数正規分布の位置を調整
+            delay = rng.lognormvariate(math.log(self.latency) - self.latency_sigma ** 2 / 2, self.latency_sigma)
+        return min(delay, self.max_latency) if self.max_latency is not None else delay
+
+    def _plan(self, contents):
+        # 障害の判定に使う乱数と遅延を決める（乱数は回答の反転にも使う）
+        rng = self._fault_random(contents)
+        draw = rng.random()
+        return draw, self._sample_latency(rng), rng
+
+    @property
+    def retries(self):
+        """
+        同じプロンプトが2回目以降に送信された回数（リトライ回数）。
+        """
+        return sum(attempts - 1 for attempts in self._attempts.values())
+
+    def _sampling_random(self, rng, generation_config):
+        temperature = (generation_config or {}).get("temperature", 0)
+        return rng if self.sample_flip_rate and temperature > 0 else None
+
+    def _respond(self, contents, draw, flip=None):
+        if draw < self.quota_error_rate:
+            raise FakeAPIError(429, retry_after=self.retry_after)
+        draw -= self.quota_error_rate
+        if draw < self.server_error_rate:
+            raise FakeAPIError(503)
+        draw -= self.server_error_rate
+        if draw < self.timeout_rate:
+            raise TimeoutError("Fake request timed out")
+        draw -= self.timeout_rate
+        if draw < self.malformed_rate:
+            return FakeResponse("```json\n{\"results\": [{\"rules\": [\"yes\", ")
+        draw -= self.malformed_rate
+        text = self._build_text(contents, flip)
+        if draw < self.fenced_rate:
+            return FakeResponse(f"```json\n{text}\n```")
+        draw -= self.fenced_rate
+        if draw < self.prose_rate:
+            return FakeResponse(f"Here is the evaluation of the abstract:\n{text}\nLet me know if you need more details.")
+        draw -= self.prose_rate
+        if draw < self.missing_rule_rate:
+            parsed = json.loads(text)
+            for result in parsed["results"]:
+                result["rules"] = result["rules"][:-1]
+            return FakeResponse(json.dumps(parsed))
+        return FakeResponse(text)
+
+    def _enter(self):
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def generate_content(self, contents, **kwargs):
+        self._enter()
+        try:
+            draw, delay, rng = self._plan(contents)
+            time.sleep(delay)
+            return self._respond(contents, draw, self._sampling_random(rng, kwargs.get("generation_config")))
+        finally:
+            self.in_flight -= 1
+
+    async def generate_content_async(self, contents, **kwargs):
+        self._enter()
+        try:
+            draw, delay, rng = self._plan(contents)
+            await asyncio.sleep(delay)
+            return self._respond(contents, draw, self._sampling_random(rng, kwargs.get("generation_config")))
+        finally:
+            self.in_flight -= 1
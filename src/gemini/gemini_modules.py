@@ -1,45 +1,514 @@
 import os
 import time
-import json
-import pandas as pd
-from tqdm import tqdm
+
+from gemini.rate_limiter import RateLimiter, estimate_tokens
+from gemini.async_engine import generate_content_with_retry_async, process_requests_async, run_async
+from gemini.journal import ResponseJournal, journal_path_for, load_journal, rotate_journal
+from gemini.batching import chunk, create_batch_user_message, split_batch_response
+from gemini.response_parser import extract_rules, parse_response, parse_responses_to_matrix, rules_matrix_to_frame, summarize_status
+from gemini.retry import RetryPolicy, call_with_retry
+from gemini.rule_versions import parse_rules, plan_partial_requests, apply_partial_responses, merge_answers
+from gemini.telemetry import InstrumentedModel
+from data_process.ingest import find_shards, load_manifest, read_csv_or_shard, shard_reference
+from data_process.results_store import parse_shard_name
 
 # レスポンス生成用メッセージ
 def create_user_message(abstract, rules):
     return f"Abstract: {abstract}\n\n{rules}"
 
 # リトライ付きのGeminiモデルレスポンス生成
-def generate_response_with_retry(model, abstract, rules, retries=3, interval=5):
+def generate_response_with_retry(model, abstract, rules, retries=3, interval=5, cache=None, policy=None, breaker=None):
     """
     リトライ付きのGemini APIリクエスト処理。
+    エラーの種類（クォータ超過・サーバーエラー・タイムアウト・不正なJSON）に応じてジッター付き指数バックオフで再試行する。
+    cache を指定した場合はキャッシュを先に参照し、取得したレスポンスを保存する。
+    """
+    if cache is not None:
+        cached = cache.get(model, rules, abstract)
+        if cached is not None:
+            return cached
+
+    user_message = create_user_message(abstract, rules)
+    response = generate_content_with_retry(model, user_message, retries=retries, interval=interval, policy=policy, breaker=breaker)
+    if cache is not None:
+        cache.put(model, rules, abstract, response.text)
+    return response
+
+# リトライ付きでメッセージを送信（limiter を指定した場合はリトライを含む各試行の前に枠を消費する）
+def generate_content_with_retry(model, user_message, retries=3, interval=5, policy=None, breaker=None, limiter=None):
+    policy = policy or RetryPolicy(max_attempts=retries, base_delay=interval)
+    tokens = estimate_tokens(user_message)
+    return call_with_retry(
+        lambda: model.generate_content(user_message), policy=policy, breaker=breaker,
+        before_attempt=(lambda: limiter.wait(tokens)) if limiter is not None else None,
+    )
+
+# 非同期版のリトライ付きGeminiモデルレスポンス生成
+async def generate_response_with_retry_async(model, abstract, rules, retries=3, interval=5, limiter=None, cache=None,
+                                             policy=None, breaker=None):
+    """
+    generate_response_with_retry の非同期版。
+    limiter を指定した場合は固定のスリープではなくトークンバケットで送信間隔を制御する。
     """
+    if cache is not None:
+        cached = cache.get(model, rules, abstract)
+        if cached is not None:
+            return cached
+
     user_message = create_user_message(abstract, rules)
-    
-    for attempt in range(retries):
+    response = await generate_content_with_retry_async(
+        model, user_message, limiter=limiter, retries=retries, interval=interval, policy=policy, breaker=breaker
+    )
+    if cache is not None:
+        cache.put(model, rules, abstract, response.text)
+    return response
+
+# バッチのレスポンスをアブストラクトIDごとにパース
+def parse_batch_response(response, abstract_ids):
+    """
+    複数のアブストラクトをまとめたリクエストのレスポンスをIDごとのルール辞書に分割する。
+    欠落・不正な要素のIDは結果に含まれない。
+    """
+    return {abstract_id: parse_response(text) for abstract_id, text in split_batch_response(response, abstract_ids).items()}
+
+# 送信単位（1件または複数件のアブストラクト）のリクエストを作成
+def build_requests(abstracts, rules, batch_size=None):
+    if not batch_size or batch_size <= 1:
+        return [
+            {"abstract_id": abstract["abstract_id"], "abstracts": [abstract], "batch": False,
+             "message": create_user_message(abstract["content"], rules)}
+            for abstract in abstracts
+        ]
+    return [
+        {"abstract_id": batch[0]["abstract_id"], "abstracts": batch, "batch": True,
+         "message": create_batch_user_message(batch, rules)}
+        for batch in chunk(abstracts, batch_size)
+    ]
+
+# リクエストのレスポンスをアブストラクトIDごとのテキストに分割
+def split_request_response(request, text):
+    if text is None:
+        return {}
+    if not request["batch"]:
+        return {request["abstract_id"]: text}
+    return split_batch_response(text, [abstract["abstract_id"] for abstract in request["abstracts"]])
+
+# キャッシュ済みのレスポンスを取り出し、未処理のアブストラクトを返す
+def take_cached(model, rules, abstracts, texts, cache=None, journal=None):
+    if cache is None:
+        return abstracts
+    pending = []
+    for abstract in abstracts:
+        cached = cache.get(model, rules, abstract["content"])
+        if cached is None:
+            pending.append(abstract)
+            continue
+        texts[abstract["abstract_id"]] = cached.text
+        if journal is not None:
+            journal.append(abstract["abstract_id"], cached.text)
+    return pending
+
+# 受信したレスポンスを記録（キャッシュとジャーナルへの書き込みを含む）
+def record_responses(model, rules, request, text, texts, cache=None, journal=None):
+    contents = {abstract["abstract_id"]: abstract["content"] for abstract in request["abstracts"]}
+    for abstract_id, item_text in split_request_response(request, text).items():
+        texts[abstract_id] = item_text
+        if cache is not None:
+            cache.put(model, rules, contents[abstract_id], item_text)
+        if journal is not None:
+            journal.append(abstract_id, item_text)
+
+# 個別に再処理したレスポンスを記録（キャッシュは参照済みのため保存のみ行う）
+def store_fallback_responses(model, rules, abstracts, responses, texts, cache=None):
+    for abstract, response in zip(abstracts, responses):
+        texts[abstract["abstract_id"]] = response["response"]
+        if cache is not None:
+            cache.put(model, rules, abstract["content"], response["response"])
+
+# バッチで取得できなかったアブストラクトを抽出
+def find_missing(abstracts, texts):
+    missing = [abstract for abstract in abstracts if texts.get(abstract["abstract_id"]) is None]
+    if missing:
+        print(f"バッチのレスポンスから取得できなかったアブストラクトを個別に再処理します: {len(missing)}件")
+    return missing
+
+# アブストラクトを1件ずつ（またはバッチごとに）順番に処理
+def collect_responses(model, rules, abstracts, desc, limiter=None, cache=None, journal=None, batch_size=None,
+                      policy=None, breaker=None, on_failure=None):
+    from tqdm import tqdm
+
+    texts = {}
+    # キャッシュ済みの場合はAPIを呼び出さない
+    pending = take_cached(model, rules, abstracts, texts, cache=cache, journal=journal)
+
+    for request in tqdm(build_requests(pending, rules, batch_size), desc=desc):
         try:
-            response = model.generate_content(user_message)
-            # ステータスコードの確認
-            if hasattr(response, "status_code") and response.status_code >= 500:
-                raise Exception(f"Server Error: {response.status_code}")
-            return response
+            text = generate_content_with_retry(model, request["message"], policy=policy, breaker=breaker,
+                                               limiter=limiter).text
+            if limiter is None:
+                time.sleep(4)  # APIレート制限対策（レートリミッターを指定しない場合のみ）
         except Exception as e:
-            print(f"リクエスト失敗: {e} - リトライ中 ({attempt+1}/{retries})")
-            time.sleep(interval)
-    
-    # 最大リトライ回数を超えた場合
-    raise Exception("最大リトライ回数を超えました。レスポンスの取得に失敗しました。")
-
-# レスポンスのパース
-def parse_response(response):
+            print(f"処理エラー: {e}")
+            text = None  # エラー時は空データを追加
+            # バッチの失敗は個別の再処理で扱うため、単一リクエストの失敗のみ記録
+            if on_failure is not None and not request["batch"]:
+                on_failure(request["abstract_id"], e)
+        record_responses(model, rules, request, text, texts, cache=cache, journal=journal)
+
+    # バッチで欠落・不正だったアブストラクトのみ1件ずつ再処理
+    if batch_size:
+        missing = find_missing(pending, texts)
+        if missing:
+            responses = collect_responses(model, rules, missing, desc, limiter=limiter, journal=journal,
+                                          policy=policy, breaker=breaker, on_failure=on_failure)
+            store_fallback_responses(model, rules, missing, responses, texts, cache=cache)
+
+    return [{"abstract_id": abstract["abstract_id"], "response": texts.get(abstract["abstract_id"])} for abstract in abstracts]
+
+# 複数のアブストラクトを並行して処理
+def collect_responses_concurrently(model, rules, abstracts, desc, concurrency, limiter=None, cache=None, journal=None,
+                                   batch_size=None, policy=None, breaker=None, on_failure=None):
+    from tqdm import tqdm
+
+    texts = {}
+    # キャッシュ済みのアブストラクトはリクエストから除外
+    pending = take_cached(model, rules, abstracts, texts, cache=cache, journal=journal)
+    requests = build_requests(pending, rules, batch_size)
+
+    # 受信した時点でキャッシュとジャーナルに記録する
+    def on_response(request, text):
+        record_responses(model, rules, request, text, texts, cache=cache, journal=journal)
+
+    # バッチの失敗は個別の再処理で扱うため、単一リクエストの失敗のみ記録
+    def on_error(request, error):
+        if on_failure is not None and not request["batch"]:
+            on_failure(request["abstract_id"], error)
+
+    with tqdm(total=len(requests), desc=desc) as progress:
+        run_async(process_requests_async(
+            model, requests, concurrency, limiter=limiter, progress=progress, on_response=on_response,
+            on_error=on_error, policy=policy, breaker=breaker,
+        ))
+
+    # バッチで欠落・不正だったアブストラクトのみ1件ずつ再処理
+    if batch_size:
+        missing = find_missing(pending, texts)
+        if missing:
+            responses = collect_responses_concurrently(model, rules, missing, desc, concurrency, limiter=limiter, journal=journal,
+                                                       policy=policy, breaker=breaker, on_failure=on_failure)
+            store_fallback_responses(model, rules, missing, responses, texts, cache=cache)
+
+    # アブストラクト順に並べ直す
+    return [{"abstract_id": abstract["abstract_id"], "response": texts.get(abstract["abstract_id"])} for abstract in abstracts]
+
+# CSVファイル（またはマニフェストのシャード）を読み込み、IDカラムと評価対象のアブストラクトを返す
+def load_shard(input_file):
     try:
-        parsed = json.loads(response)
-        rules = parsed.get("results", [{}])[0].get("rules", [])
-        return {f"rule{i+1}": rule for i, rule in enumerate(rules)}
-    except (json.JSONDecodeError, KeyError, IndexError):
-        return {}
+        # CSV読み込み
+        df = read_csv_or_shard(input_file)
+        print(f"データの読み込みに成功しました: {input_file}")
+    except Exception as e:
+        print(f"読み込みエラー: {e}")
+        return None, []
+
+    # IDカラム追加
+    df["ID"] = df.index
+    abstracts = [
+        {"abstract_id": row["ID"], "content": row["Abstract"], "doi": row.get("DOI")}
+        for _, row in df.dropna(subset=["Abstract"]).iterrows()
+    ]
+    return df, abstracts
+
+# レスポンスをパースして元のデータと結合し、保存
+def save_merged_results(df, raw_responses, output_file, dependencies=None, results_store=None, source=None):
+    import pandas as pd
+
+    try:
+        results_df = pd.DataFrame(raw_responses)
+        if not results_df.empty:
+            # レスポンスを int8 のルール行列に変換し、列として一括で結合
+            matrix, status = parse_responses_to_matrix(results_df["response"].tolist())
+            parse_status = summarize_status(status)
+            print(f"パース結果: {parse_status}")
+            if dependencies is not None:
+                # 指標間の依存関係を行列に一括で適用
+                matrix = dependencies.apply(matrix, inplace=True)
+            if results_store is not None:
+                # ルール行列を結果ストアにも書き込む
+                results_store.write_results(df, matrix, results_df["abstract_id"], output_file, source=source)
+            rules_df = rules_matrix_to_frame(matrix, index=results_df.index)
+            results_df = pd.concat([results_df.drop(columns=["response"]), rules_df], axis=1)
+            merged_df = df.merge(results_df, left_on="ID", right_on="abstract_id", how="left").drop(columns=["abstract_id"])
+
+            # 保存
+            merged_df.to_csv(output_file, index=False, encoding="utf-8")
+            print(f"結果を保存しました: {output_file}")
+            return parse_status
+        else:
+            print(f"結果が空です: {os.path.basename(output_file)}")
+    except Exception as e:
+        print(f"保存エラー: {e}")
+
+# ジャーナルから結果のCSVを作成
+def finalize_journal(input_file, output_file, journal_path=None):
+    """
+    ジャーナルに記録されたレスポンスから結果のCSVを作成する。
+
+    Args:
+        input_file (str): 入力CSVファイルのパス
+        output_file (str): 出力CSVファイルのパス
+        journal_path (str, optional): ジャーナルファイルのパス。Noneの場合は出力ファイルから決定
+    """
+    journal_path = journal_path or journal_path_for(output_file)
+    df, abstracts = load_shard(input_file)
+    if df is None:
+        return
+    save_journal_results(df, abstracts, journal_path, output_file)
+
+# ジャーナルのレスポンスを元のデータと結合し、保存
+def save_journal_results(df, abstracts, journal_path, output_file, dependencies=None, results_store=None, source=None):
+    records = load_journal(journal_path)
+    raw_responses = [
+        {"abstract_id": abstract["abstract_id"], "response": records.get(int(abstract["abstract_id"]))}
+        for abstract in abstracts
+    ]
+    missing = sum(response["response"] is None for response in raw_responses)
+    if missing:
+        print(f"ジャーナルに未記録のアブストラクトがあります: {missing}件")
+    return save_merged_results(df, raw_responses, output_file, dependencies, results_store, source)
+
+# 重複するアブストラクトは1度だけ評価し、同じアブストラクトを参照するすべての行に結果を展開
+def collect_deduplicated(model, rules, abstracts, desc, dedup, source, concurrency=None, journal=None, **options):
+    """
+    DedupIndex を参照し、評価済みのアブストラクトとシャード内の重複を除いたものだけをAPIで処理する。
+
+    Args:
+        dedup (DedupIndex): 重複排除のインデックス
+        source (str): 参照元として登録する入力ファイル（またはシャード）
+    """
+    keys = dedup.register(source, abstracts)
+    texts = {}
+    pending = []
+    pending_keys = []
+    for abstract, key in zip(abstracts, keys):
+        if key is None:
+            pending.append(abstract)
+            pending_keys.append(key)
+        elif key not in texts:
+            # 評価済みでなければ代表として処理（None は処理中を表す）
+            texts[key] = dedup.get(model, rules, key)
+            if texts[key] is None:
+                pending.append(abstract)
+                pending_keys.append(key)
+
+    responses = collect_shard_responses(model, rules, pending, desc, concurrency, journal=journal, **options) if pending else []
+    by_id = {response["abstract_id"]: response["response"] for response in responses}
+    for abstract, key in zip(pending, pending_keys):
+        if key is not None:
+            texts[key] = by_id[abstract["abstract_id"]]
+            dedup.put(model, rules, key, texts[key])
+
+    results = []
+    for abstract, key in zip(abstracts, keys):
+        response = texts.get(key) if key is not None else by_id.get(abstract["abstract_id"])
+        if abstract["abstract_id"] not in by_id and response is not None:
+            dedup.calls_saved += 1
+            if journal is not None:
+                journal.append(abstract["abstract_id"], response)
+        results.append({"abstract_id": abstract["abstract_id"], "response": response})
+    print(f"重複排除: {len(abstracts)}件中 {len(abstracts) - len(pending)}件 はAPIを呼び出さずに取得しました")
+    return results
+
+# 追加・変更された評価指標だけを評価し、保存済みの回答と結合
+def collect_incrementally(model, rules, abstracts, desc, rule_store, concurrency=None, journal=None, **options):
+    """
+    ルール定義を評価指標ごとに分解し、RuleAnswerStore に回答がない評価指標だけを含むプロンプトで評価する。
+    ジャーナルにはすべての評価指標の回答がそろったアブストラクトのみ記録する。
+
+    Args:
+        rule_store (RuleAnswerStore): 評価指標ごとの回答のストア
+    """
+    ruleset = parse_rules(rules)
+    known, groups = plan_partial_requests(model, ruleset, abstracts, rule_store)
+    rules_by_hash = {rule.hash: rule for rule in ruleset.rules}
+    for missing, targets in groups.items():
+        partial = [rules_by_hash[rule_hash] for rule_hash in missing]
+        print(f"未評価の評価指標 {len(partial)}/{len(ruleset.rules)}件 を {len(targets)}件 のアブストラクトについて評価します")
+        responses = collect_shard_responses(model, ruleset.format(partial), targets, desc, concurrency, **options)
+        apply_partial_responses(model, partial, targets, responses, known, rule_store)
+
+    results = []
+    for abstract in abstracts:
+        answers = known[abstract["abstract_id"]]
+        response = merge_answers(ruleset, answers)
+        if journal is not None and len(answers) == len(ruleset.rules):
+            journal.append(abstract["abstract_id"], response)
+        results.append({"abstract_id": abstract["abstract_id"], "response": response})
+    return results
+
+# ローカルで判定できる評価指標を除き、残りの評価指標だけをモデルで評価
+def collect_with_local_rules(model, rules, abstracts, desc, local_rules, concurrency=None, journal=None, **options):
+    """
+    LocalRuleClassifier で判定できた評価指標はAPIを呼び出さずに回答し、判定できなかった評価指標の組み合わせごとに
+    それだけを含むプロンプトで評価する。ジャーナルにはすべての評価指標の回答がそろったアブストラクトのみ記録する。
+
+    Args:
+        local_rules (LocalRuleClassifier): 表層的な評価指標をまとめて判定する前段の分類器
+    """
+    ruleset = parse_rules(rules)
+    known = local_rules.answer(ruleset, abstracts)
+    groups = {}
+    for abstract in abstracts:
+        missing = tuple(rule for rule in ruleset.rules if rule.hash not in known[abstract["abstract_id"]])
+        if missing:
+            groups.setdefault(missing, []).append(abstract)
+
+    for partial, targets in groups.items():
+        if len(partial) < len(ruleset.rules):
+            print(f"ローカルで判定できなかった評価指標 {len(partial)}/{len(ruleset.rules)}件 を {len(targets)}件 のアブストラクトについて評価します")
+        responses = collect_shard_responses(model, ruleset.format(list(partial)), targets, desc, concurrency, **options)
+        for response in responses:
+            answers, status = extract_rules(response["response"])
+            if status != "ok" or len(answers) != len(partial):
+                continue
+            known[response["abstract_id"]].update(
+                (rule.hash, answer) for rule, answer in zip(partial, answers) if answer in ("yes", "no")
+            )
+
+    results = []
+    for abstract in abstracts:
+        answers = known[abstract["abstract_id"]]
+        response = merge_answers(ruleset, answers)
+        if journal is not None and len(answers) == len(ruleset.rules):
+            journal.append(abstract["abstract_id"], response)
+        results.append({"abstract_id": abstract["abstract_id"], "response": response})
+    return results
+
+# 同期・非同期のいずれかのモードでレスポンスを収集
+def collect_shard_responses(model, rules, abstracts, desc, concurrency=None, dedup=None, source=None, rule_store=None,
+                            local_rules=None, **options):
+    if local_rules is not None:
+        return collect_with_local_rules(model, rules, abstracts, desc, local_rules, concurrency=concurrency,
+                                        dedup=dedup, source=source, rule_store=rule_store, **options)
+    if dedup is not None:
+        return collect_deduplicated(model, rules, abstracts, desc, dedup, source, concurrency=concurrency,
+                                    rule_store=rule_store, **options)
+    if rule_store is not None:
+        return collect_incrementally(model, rules, abstracts, desc, rule_store, concurrency=concurrency, **options)
+    if concurrency:
+        return collect_responses_concurrently(model, rules, abstracts, desc, concurrency, **options)
+    return collect_responses(model, rules, abstracts, desc, **options)
+
+# 1つのCSVファイル（シャード）を処理
+def process_shard(model, rules, input_file, output_file, concurrency=None, limiter=None, cache=None,
+                  journal=False, resume=False, batch_size=None, policy=None, breaker=None, dead_letter=None,
+                  dependencies=None, dedup=None, rule_store=None, telemetry=None, results_store=None, preprocessor=None,
+                  validator=None, local_rules=None, consensus=None):
+    """
+    1つのCSVファイルを読み込み、Geminiで評価した結果を保存する。
+
+    Args:
+        model: Geminiモデルオブジェクト
+        rules (str): ルール定義テキスト
+        input_file (str): 入力CSVファイルのパス
+        output_file (str): 出力CSVファイルのパス
+        concurrency (int, optional): 同時に送信するリクエスト数。Noneの場合は1件ずつ順番に処理
+        limiter (RateLimiter, optional): レートリミッター。Noneの場合は固定のスリープで間隔を空ける
+        cache (ResponseCache, optional): レスポンスキャッシュ。キャッシュ済みのアブストラクトはAPIを呼び出さない
+        journal (bool): Trueの場合、レスポンスを受信するたびにジャーナル（JSONL）へ追記する
+        resume (bool): Trueの場合、ジャーナルに記録済みのアブストラクトをスキップして再開する（Falseの場合、既存のジャーナルは .old に退避する）
+        batch_size (int, optional): 1リクエストにまとめるアブストラクト数。欠落・不正な要素のみ1件ずつ再処理する
+        policy (RetryPolicy, optional): リトライ方針。Noneの場合は既定の方針（エラー種別ごとの指数バックオフ）
+        breaker (CircuitBreaker, optional): エラー率が急増した場合に処理全体を停止させるサーキットブレーカー
+        dead_letter (DeadLetterQueue, optional): リトライしても失敗したアブストラクトの記録先
+        dependencies (CompiledDependencies, optional): 保存前にルール行列へ適用する指標間の依存関係
+        dedup (DedupIndex, optional): 分野・シャードをまたいだ重複排除のインデックス。同じアブストラクトは1度だけ評価する
+        rule_store (RuleAnswerStore, optional): 評価指標ごとの回答のストア。ルール定義の変更後は追加・変更された評価指標のみ評価する
+        telemetry (Telemetry, optional): リクエストごとのイベントとシャードごとのサマリーの記録先
+        results_store (ResultsStore, optional): ルール行列（int8）を保存する結果ストア。CSVに加えて書き込む
+        preprocessor (AbstractPreprocessor, optional): モデルに送る前のアブストラクトの正規化とトークン数の上限
+        validator (ResponseValidator, optional): レスポンスを受信するたびに検証し、不正なものはその場で再質問する
+        local_rules (LocalRuleClassifier, optional): 表層的な評価指標をAPIを呼び出さずに判定する前段の分類器
+        consensus (ConsensusSampler, optional): 不安定な評価指標の疑わしい回答だけを再度問い合わせ、多数決で決め直す
+    """
+    file_name = os.path.basename(input_file)
+    desc = f"Processing {file_name}"
+
+    # モデルの呼び出しを計測
+    if telemetry is not None and not isinstance(model, InstrumentedModel):
+        model = InstrumentedModel(model, telemetry)
+
+    # 失敗したアブストラクトをデッドレターに記録
+    def on_failure(abstract_id, error):
+        if dead_letter is not None:
+            dead_letter.append(input_file, output_file, abstract_id, error)
+
+    options = {"concurrency": concurrency, "limiter": limiter, "cache": cache, "batch_size": batch_size,
+               "policy": policy, "breaker": breaker, "on_failure": on_failure, "dedup": dedup, "source": input_file,
+               "rule_store": rule_store, "local_rules": local_rules}
+
+    df, abstracts = load_shard(input_file)
+    if df is None:
+        return
+
+    if preprocessor is not None:
+        # 分野ごとにトークンの削減量を集計する
+        field = parse_shard_name(os.path.splitext(file_name.rsplit("#", 1)[-1])[0])[0]
+        abstracts = preprocessor.process(abstracts, group=field or file_name)
+
+    if not abstracts:
+        print(f"アブストラクトが空のためスキップ: {file_name}")
+        return
+
+    # スキップしたシャードは記録しない（start_shard の後は例外が発生しても end_shard を呼ぶ）
+    if telemetry is not None:
+        telemetry.start_shard(file_name)
+
+    parse_status = None
+    try:
+        # レスポンスを検証し、シャードごとの有効率を集計する
+        if validator is not None:
+            validator.start_shard(file_name)
+            model = validator.wrap(model, limiter)
+
+        if not (journal or resume):
+            # Geminiモデルで処理
+            raw_responses = collect_shard_responses(model, rules, abstracts, desc, **options)
+            parse_status = save_merged_results(df, raw_responses, output_file, dependencies, results_store, input_file)
+        else:
+            # ジャーナルを使用する場合は、記録済みのアブストラクトを除外して処理
+            journal_path = journal_path_for(output_file)
+            if not resume:
+                # 再開しない場合は前回の記録が結果に混ざらないよう、既存のジャーナルを退避してから記録する
+                rotate_journal(journal_path)
+            with ResponseJournal(journal_path) as response_journal:
+                if resume:
+                    completed = response_journal.completed_ids()
+                    remaining = [abstract for abstract in abstracts if int(abstract["abstract_id"]) not in completed]
+                    print(f"ジャーナルから再開します: {len(abstracts) - len(remaining)}件 記録済み / 残り{len(remaining)}件")
+                else:
+                    remaining = abstracts
+
+                if remaining:
+                    collect_shard_responses(model, rules, remaining, desc, journal=response_journal, **options)
+
+            # ジャーナルから結果のCSVを作成
+            parse_status = save_journal_results(df, abstracts, journal_path, output_file, dependencies, results_store,
+                                                input_file)
+
+        if consensus is not None and parse_status is not None:
+            # 不安定な評価指標の疑わしい回答だけを再度問い合わせ、多数決で決め直す
+            consensus.apply_to_file(model, rules, output_file, dependencies, results_store, input_file, limiter=limiter,
+                                    policy=policy, breaker=breaker)
+    finally:
+        if telemetry is not None:
+            telemetry.end_shard(abstracts=len(abstracts), parse_status=parse_status)
+        if validator is not None:
+            validator.end_shard()
 
 # ファイル処理のメイン関数
-def process_gemini(model, rules, base_input_path, base_output_path, selected_field, citation_type):
+def process_gemini(model, rules, base_input_path, base_output_path, selected_field, citation_type,
+                   rpm=None, tpm=None, cache=None, manifest_path=None, **options):
     """
     分野名とhigh/lowに基づきCSVファイルを処理し、結果を保存する。
 
@@ -50,59 +519,112 @@ def process_gemini(model, rules, base_input_path, base_output_path, selected_fie
         base_output_path (str): 出力データの基本ディレクトリ
         selected_field (str): 処理対象の分野名
         citation_type (str): "high" または "low"
+        rpm (int, optional): 1分あたりの最大リクエスト数
+        tpm (int, optional): 1分あたりの最大トークン数
+        cache (ResponseCache, optional): レスポンスキャッシュ
+        manifest_path (str, optional): ingest_txt_files で作成したマニフェスト。指定した場合は分割済みのCSVの代わりにマニフェストのシャードを処理
+        **options: process_shard に渡すオプション（concurrency, journal, resume, batch_size, policy, breaker, dead_letter, dependencies, dedup, rule_store, telemetry, results_store, preprocessor, validator, local_rules, consensus など）
     """
     # 入出力ディレクトリの設定
     input_path = os.path.join(base_input_path, selected_field)
     output_path = os.path.join(base_output_path, selected_field)
     os.makedirs(output_path, exist_ok=True)
 
-    # 対象ファイルを取得
-    csv_files = [f for f in os.listdir(input_path) if f.endswith(".csv") and citation_type in f]
+    # レートリミッター（全ファイルで共有）
+    limiter = RateLimiter(rpm=rpm, tpm=tpm) if (rpm or tpm) else None
+
+    # 対象ファイル（入力と出力のパスの組）を取得
+    if manifest_path:
+        shards = find_shards(load_manifest(manifest_path), selected_field, citation_type)
+        targets = [(shard_reference(manifest_path, shard["name"]), f"{shard['name']}.csv") for shard in shards]
+    else:
+        csv_files = [f for f in os.listdir(input_path) if f.endswith(".csv") and citation_type in f]
+        targets = [(os.path.join(input_path, file_name), file_name) for file_name in csv_files]
 
     # CSVファイルの処理
-    for file_name in csv_files:
-        input_file = os.path.join(input_path, file_name)
+    for input_file, file_name in targets:
         output_file = os.path.join(output_path, file_name)
+        process_shard(model, rules, input_file, output_file, limiter=limiter, cache=cache, **options)
 
-        try:
-            # CSV読み込み
-            df = pd.read_csv(input_file, encoding="utf-8")
-            print(f"データの読み込みに成功しました: {input_file}")
-        except Exception as e:
-            print(f"読み込みエラー: {e}")
-            continue
+    if cache is not None:
+        print(f"キャッシュ統計: {cache.stats()}")
+    if options.get("dedup") is not None:
+        print(f"重複排除の統計: {options['dedup'].stats()}")
+    if options.get("rule_store") is not None:
+        print(f"評価指標ごとの回答: {options['rule_store'].stats()}")
+    if options.get("telemetry") is not None:
+        print(f"テレメトリの合計: {options['telemetry'].summary()['total']}")
+    if options.get("preprocessor") is not None:
+        print(f"前処理によるトークンの削減:\n{options['preprocessor'].summary()}")
+    if options.get("local_rules") is not None:
+        print(f"ローカルで判定した評価: {options['local_rules'].stats()}")
+    if options.get("consensus") is not None:
+        print(f"多数決の再サンプリング: {options['consensus'].stats()}")
+
+# デッドレターに記録されたアブストラクトを再処理
+def redrive_dead_letters(model, rules, dead_letter, **options):
+    """
+    デッドレターに記録されたアブストラクトのみを再処理し、既存の結果CSVを更新する。
+    再処理でも失敗したものはデッドレターに残る。
+
+    Args:
+        model: Geminiモデルオブジェクト
+        rules (str): ルール定義テキスト
+        dead_letter (DeadLetterQueue): デッドレター
+        **options: collect_shard_responses に渡すオプション（concurrency, limiter, policy, breaker など）
+    """
+    records = dead_letter.load()
+    if not records:
+        print("再処理対象のアブストラクトはありません。")
+        return
+    dead_letter.replace([])
 
-        # IDカラム追加
-        df["ID"] = df.index
-        abstracts = [{"abstract_id": row["ID"], "content": row["Abstract"]} for _, row in df.dropna(subset=["Abstract"]).iterrows()]
+    # 入出力ファイルごとにまとめて再処理
+    groups = {}
+    for record in records:
+        groups.setdefault((record["input_file"], record["output_file"]), set()).add(record["abstract_id"])
 
-        if not abstracts:
-            print(f"アブストラクトが空のためスキップ: {file_name}")
+    for (input_file, output_file), abstract_ids in groups.items():
+        df, abstracts = load_shard(input_file)
+        if df is None:
             continue
+        targets = [abstract for abstract in abstracts if int(abstract["abstract_id"]) in abstract_ids]
 
-        # Geminiモデルで処理
-        raw_responses = []
-        for abstract in tqdm(abstracts, desc=f"Processing {file_name}"):
-            try:
-                response = generate_response_with_retry(model, abstract["content"], rules)
-                raw_responses.append({"abstract_id": abstract["abstract_id"], "response": response.text})
-                time.sleep(4)  # APIレート制限対策
-            except Exception as e:
-                print(f"処理エラー: {e}")
-                raw_responses.append({"abstract_id": abstract["abstract_id"], "response": None})  # エラー時は空データを追加
-
-        # レスポンスをパースして保存
-        try:
-            results_df = pd.DataFrame(raw_responses)
-            if not results_df.empty:
-                rules_df = results_df["response"].dropna().apply(parse_response).apply(pd.Series)
-                results_df = pd.concat([results_df, rules_df], axis=1).drop(columns=["response"])
-                merged_df = df.merge(results_df, left_on="ID", right_on="abstract_id", how="left").drop(columns=["abstract_id"])
-
-                # 保存
-                merged_df.to_csv(output_file, index=False, encoding="utf-8")
-                print(f"結果を保存しました: {output_file}")
-            else:
-                print(f"結果が空です: {file_name}")
-        except Exception as e:
-            print(f"保存エラー: {e}")
+        def on_failure(abstract_id, error, input_file=input_file, output_file=output_file):
+            dead_letter.append(input_file, output_file, abstract_id, error)
+
+        raw_responses = collect_shard_responses(
+            model, rules, targets, f"Redriving {os.path.basename(input_file)}", on_failure=on_failure, **options
+        )
+
+        # ジャーナルがある場合は追記し、ジャーナルから結果を作り直す
+        journal_path = journal_path_for(output_file)
+        if os.path.exists(journal_path):
+            with ResponseJournal(journal_path) as response_journal:
+                for response in raw_responses:
+                    response_journal.append(response["abstract_id"], response["response"])
+            save_journal_results(df, abstracts, journal_path, output_file)
+        else:
+            update_results(output_file, raw_responses)
+
+    print(f"再処理が完了しました: {len(records)}件中 {len(records) - len(dead_letter.load())}件 成功")
+
+# 既存の結果CSVのうち、指定したアブストラクトのルール列を更新
+def update_results(output_file, raw_responses):
+    responses = [response for response in raw_responses if response["response"] is not None]
+    if not responses or not os.path.exists(output_file):
+        return
+
+    import pandas as pd
+
+    merged_df = pd.read_csv(output_file, encoding="utf-8")
+    matrix, _ = parse_responses_to_matrix([response["response"] for response in responses])
+    rules_df = rules_matrix_to_frame(matrix)
+    positions = merged_df.index[merged_df["ID"].isin([response["abstract_id"] for response in responses])]
+    row_of_id = {int(response["abstract_id"]): i for i, response in enumerate(responses)}
+    order = [row_of_id[int(abstract_id)] for abstract_id in merged_df.loc[positions, "ID"]]
+    for column in rules_df.columns:
+        merged_df.loc[positions, column] = rules_df[column].to_numpy()[order]
+
+    merged_df.to_csv(output_file, index=False, encoding="utf-8")
+    print(f"結果を更新しました: {output_file}")
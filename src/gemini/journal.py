@@ -0,0 +1,139 @@
+import os
+import json
+
+
+def journal_path_for(output_file):
+    """
+    出力CSVファイルに対応するジャーナルファイルのパスを返す。
+    例: data/results/Physics/Physics_high1000_1.csv -> data/results/Physics/journal/Physics_high1000_1.jsonl
+
+    Args:
+        output_file (str): 出力CSVファイルのパス。
+
+    Returns:
+        str: ジャーナルファイルのパス。
+    """
+    output_dir, file_name = os.path.split(output_file)
+    return os.path.join(output_dir, "journal", f"{os.path.splitext(file_name)[0]}.jsonl")
+
+
+def load_journal(path):
+    """
+    ジャーナルファイルを読み込み、アブストラクトIDごとの最新のレスポンスを返す。
+    クラッシュ時に書きかけとなった末尾の行は無視する。
+
+    Args:
+        path (str): ジャーナルファイルのパス。
+
+    Returns:
+        dict: {abstract_id: response} の辞書（記録順）。
+    """
+    records = {}
+    if not os.path.exists(path):
+        return records
+
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            records[record["abstract_id"]] = record["response"]
+    return records
+
+
+def rotate_journal(journal_path):
+    """
+    既存のジャーナルを `{ジャーナル}.old` に退避する（前回の退避分は上書きする）。
+    """
+    if os.path.exists(journal_path):
+        os.replace(journal_path, f"{journal_path}.old")
+
+
+def truncate_torn_line(path):
+    """
+    書き込み中に停止して末尾の行が途中で切れている場合、最後の改行の直後まで切り詰める。
+    切り詰めないと、次に追記するレコードが途中の行に連結されて読み込めなくなる。
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as file:
+        size = file.seek(0, os.SEEK_END)
+        if size == 0:
+            return
+        file.seek(size - 1)
+        if file.read(1) == b"\n":
+            return
+        # 最後の改行を末尾から探す
+        position = size
+        while position > 0:
+            start = max(0, position - 65536)
+            file.seek(start)
+            newline = file.read(position - start).rfind(b"\n")
+            if newline >= 0:
+                file.truncate(start + newline + 1)
+                return
+            position = start
+        file.truncate(0)
+
+
+class ResponseJournal:
+    """
+    レスポンスを受信した時点で1行ずつ追記する、追記専用のJSONLジャーナル。
+    fsync は fsync_every 件ごとにまとめて行う。
+    """
+
+    def __init__(self, path, fsync_every=10):
+        """
+        Args:
+            path (str): ジャーナルファイルのパス。
+            fsync_every (int): 何件追記するごとに fsync するか。
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.fsync_every = fsync_every
+        self._pending = 0
+        truncate_torn_line(path)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def completed_ids(self):
+        """
+        ジャーナルに記録済みのアブストラクトIDの集合を返す。
+        """
+        return set(load_journal(self.path))
+
+    def append(self, abstract_id, response):
+        """
+        レスポンスを1件追記する。エラー時（None）は記録せず、再開時に再実行させる。
+
+        Args:
+            abstract_id (int): アブストラクトID。
+            response (str): レスポンスのテキスト。
+        """
+        if response is None:
+            return
+        record = {"abstract_id": int(abstract_id), "response": response}
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        self._pending += 1
+        if self._pending >= self.fsync_every:
+            self.sync()
+
+    def sync(self):
+        """
+        未同期の書き込みをディスクに反映する。
+        """
+        if self._pending:
+            os.fsync(self._file.fileno())
+            self._pending = 0
+
+    def close(self):
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
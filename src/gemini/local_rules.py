@@ -0,0 +1,212 @@
+import threading
+import numpy as np
+
+from gemini.response_parser import MISSING, NO, YES, frame_to_rules_matrix
+from gemini.rule_versions import Rule
+
+# 一人称の主語（"I-c" のような記号の一部は除く）
+FIRST_PERSON_SUBJECT = r"(?<![-\w])(?:[Ww]e|I)(?![-\w])"
+FIRST_PERSON = r"(?<![-\w])(?:[Ww]e|I|[Oo]ur|[Uu]s|[Mm]y)(?![-\w])"
+# 割合・倍率・比較を伴う数値（例: "95%", "3-fold", "p < 0.05"）
+QUANTITATIVE_RESULT = r"\d+(?:\.\d+)?\s*(?:%|-?fold\b|times\b)|[<>=]\s*\d"
+# 大文字2文字以上の略語（例: "PCR", "CNNs"）
+ABBREVIATION = r"\b[A-Z]{2,}s?\b"
+
+
+class LocalRule:
+    """
+    アブストラクトの表層的な特徴（正規表現・キーワード・長さ）だけで判定できる評価指標。
+    ルール定義テキストの評価指標とは本文のハッシュで対応付けるため、番号が変わっても使用できる。
+    """
+
+    def __init__(self, text, classify):
+        """
+        Args:
+            text (str): 対応する評価指標の本文（prompt/rules.txt の番号を除いた部分）。
+            classify (callable): アブストラクトの pd.Series を受け取り、(yes と判定できる行, no と判定できる行) の
+                真偽値の配列の組を返す関数。どちらでもない行はモデルに判定させる。
+        """
+        self.text = text
+        self.hash = Rule(0, text).hash
+        self.classify = classify
+
+    def __repr__(self):
+        return f"LocalRule({self.text!r})"
+
+
+def classify_first_person(texts):
+    return texts.str.contains(FIRST_PERSON_SUBJECT).to_numpy(), (~texts.str.contains(FIRST_PERSON)).to_numpy()
+
+
+def classify_quantitative(texts):
+    return texts.str.contains(QUANTITATIVE_RESULT).to_numpy(), (~texts.str.contains(r"\d")).to_numpy()
+
+
+def classify_results_written(texts):
+    # 数値の結果があれば結果は書かれている（ない場合はモデルに判定させる）
+    yes = texts.str.contains(QUANTITATIVE_RESULT).to_numpy()
+    return yes, np.zeros(len(texts), dtype=bool)
+
+
+def classify_abbreviations(texts):
+    return (texts.str.count(ABBREVIATION) >= 3).to_numpy(), (~texts.str.contains(r"[A-Z]{2,}")).to_numpy()
+
+
+DEFAULT_LOCAL_RULES = [
+    LocalRule("Use of I or We as the subject", classify_first_person),
+    LocalRule("Quantitative results are written", classify_quantitative),
+    LocalRule("Experimental results are written", classify_results_written),
+    LocalRule("Abbreviations are included (except when first explained)", classify_abbreviations),
+]
+
+
+class LocalRuleClassifier:
+    """
+    表層的な評価指標をシャード全体に対して pandas の文字列操作でまとめて判定する前段の分類器。
+    判定できた評価指標はAPIを呼び出さずに回答し、残りの評価指標だけをモデルに送る。
+    calibrate で人間の評価結果と照合し、正解率が基準以上の評価指標だけを有効にする。
+    """
+
+    def __init__(self, local_rules=None, enabled=None):
+        """
+        Args:
+            local_rules (list, optional): LocalRule のリスト。Noneの場合は DEFAULT_LOCAL_RULES。
+            enabled (list, optional): 有効にする評価指標の本文のリスト。Noneの場合はすべて有効。
+        """
+        self.local_rules = DEFAULT_LOCAL_RULES if local_rules is None else local_rules
+        self.enabled = None if enabled is None else set(enabled)
+        self.answered = {}
+        self.deferred = 0
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # スケジューラーのワーカーへ渡すため、ロックを除いて pickle する
+        state = dict(self.__dict__)
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def active_rules(self):
+        return [rule for rule in self.local_rules if self.enabled is None or rule.text in self.enabled]
+
+    def classify(self, ruleset, texts):
+        """
+        アブストラクトの本文を、ルール定義の評価指標の順の int8 のルール行列（判定できないものは MISSING）に変換します。
+
+        Args:
+            ruleset (RuleSet): parse_rules で分解したルール定義。
+            texts (list or pd.Series): アブストラクトの本文。
+        """
+        import pandas as pd
+
+        texts = pd.Series(texts, dtype=object).fillna("").astype(str).reset_index(drop=True)
+        matrix = np.full((len(texts), len(ruleset.rules)), MISSING, dtype=np.int8)
+        columns = {rule_hash: j for j, rule_hash in enumerate(ruleset.hashes)}
+        for local_rule in self.active_rules():
+            j = columns.get(local_rule.hash)
+            if j is None:
+                continue
+            yes, no = local_rule.classify(texts)
+            matrix[no, j] = NO
+            matrix[yes, j] = YES
+        return matrix
+
+    def answer(self, ruleset, abstracts):
+        """
+        アブストラクトごとに、判定できた評価指標の回答を {評価指標のハッシュ: 回答} の辞書で返します。
+        回避できたモデルの評価（アブストラクト × 評価指標）の件数を集計します。
+
+        Returns:
+            dict: {abstract_id: {評価指標のハッシュ: "yes" or "no"}}。
+        """
+        matrix = self.classify(ruleset, [abstract["content"] for abstract in abstracts])
+        labels = np.array(["no", "yes"], dtype=object)
+        known = {}
+        for abstract, row in zip(abstracts, matrix):
+            decided = np.flatnonzero(row != MISSING)
+            known[abstract["abstract_id"]] = {ruleset.hashes[j]: labels[row[j]] for j in decided}
+        decided_counts = (matrix != MISSING).sum(axis=0)
+        with self._lock:
+            for rule, count in zip(ruleset.rules, decided_counts):
+                if count:
+                    self.answered[rule.text] = self.answered.get(rule.text, 0) + int(count)
+            self.deferred += int(matrix.size - decided_counts.sum())
+        return known
+
+    def validate(self, ruleset, human_df, gemini_df=None):
+        """
+        人間の評価結果（sampling_check_by_human*.csv）と照合し、評価指標ごとの判定率と正解率を返します。
+        gemini_df を指定した場合は、同じ行についてのGeminiの正解率も並べます。
+
+        Returns:
+            pd.DataFrame: Rule, Text, Covered, Coverage, Accuracy（, Gemini Accuracy）列のデータフレーム。
+        """
+        import pandas as pd
+
+        human_df = human_df[human_df["Abstract"].notna()].reset_index(drop=True)
+        if gemini_df is not None:
+            gemini_df = gemini_df[gemini_df["Abstract"].notna()].reset_index(drop=True)
+        local = self.classify(ruleset, human_df["Abstract"])
+        rows = []
+        for j, rule in enumerate(ruleset.rules):
+            if not any(local_rule.hash == rule.hash for local_rule in self.local_rules):
+                continue
+            column = f"rule{j + 1}"
+            if column not in human_df.columns:
+                continue
+            truth = frame_to_rules_matrix(human_df, [column])[:, 0]
+            covered = (local[:, j] != MISSING) & (truth != MISSING)
+            row = {
+                "Rule": column, "Text": rule.text, "Covered": int(covered.sum()),
+                "Coverage": covered.sum() / max((truth != MISSING).sum(), 1),
+                "Accuracy": (local[covered, j] == truth[covered]).mean() if covered.any() else np.nan,
+            }
+            if gemini_df is not None:
+                pred = frame_to_rules_matrix(gemini_df, [column])[:, 0]
+                row["Gemini Accuracy"] = (pred[covered] == truth[covered]).mean() if covered.any() else np.nan
+            rows.append(row)
+        return pd.DataFrame(rows)
+
+    def calibrate(self, ruleset, human_df, gemini_df=None, min_accuracy=0.85, min_covered=10):
+        """
+        validate の結果から、正解率が min_accuracy 以上（かつ判定できた行が min_covered 件以上）の評価指標だけを有効にします。
+
+        Returns:
+            pd.DataFrame: validate の結果に Enabled 列を加えたデータフレーム。
+        """
+        report = self.validate(ruleset, human_df, gemini_df)
+        if report.empty:
+            self.enabled = set()
+            return report
+        report["Enabled"] = (report["Accuracy"] >= min_accuracy) & (report["Covered"] >= min_covered)
+        self.enabled = set(report.loc[report["Enabled"], "Text"])
+        return report
+
+    def pop_stats(self):
+        """
+        集計した統計を返し、集計をリセットする（ワーカープロセスからジョブごとに回収するため）。
+        """
+        with self._lock:
+            stats = {"answered": self.answered, "deferred": self.deferred}
+            self.answered, self.deferred = {}, 0
+        return stats
+
+    def merge_stats(self, stats):
+        """
+        別のプロセスで集計した統計（pop_stats の戻り値）を加算する。
+        """
+        with self._lock:
+            for text, count in stats["answered"].items():
+                self.answered[text] = self.answered.get(text, 0) + count
+            self.deferred += stats["deferred"]
+
+    def stats(self):
+        """
+        ローカルで回答した評価の件数（回避したモデルの評価数）と、モデルに送った評価の件数を返す。
+        """
+        with self._lock:
+            avoided = sum(self.answered.values())
+            return {"avoided": avoided, "sent_to_model": self.deferred, "by_rule": dict(self.answered)}
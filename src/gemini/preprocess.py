@@ -0,0 +1,159 @@
+import re
+import html
+
+from gemini.rate_limiter import estimate_tokens
+
+# Web of Science の書式タグ（中身の文字列は残してタグだけ除去する）
+FORMAT_TAG_PATTERN = re.compile(r"</?\s*(sub|sup|inf|i|b|u|em|strong|bold|italic|scp)\s*>", re.IGNORECASE)
+
+# 記号を表すタグ（例: <nu>, <degrees>, <epsilon >）と置き換える文字
+SYMBOL_TAGS = {
+    "alpha": "α", "beta": "β", "gamma": "γ", "delta": "δ", "epsilon": "ε", "zeta": "ζ", "eta": "η",
+    "theta": "θ", "kappa": "κ", "lambda": "λ", "mu": "μ", "nu": "ν", "xi": "ξ", "pi": "π", "rho": "ρ",
+    "sigma": "σ", "tau": "τ", "phi": "φ", "chi": "χ", "psi": "ψ", "omega": "ω",
+    "Delta": "Δ", "Gamma": "Γ", "Lambda": "Λ", "Omega": "Ω", "Phi": "Φ", "Sigma": "Σ",
+    "degrees": "°",
+}
+SYMBOL_TAG_PATTERN = re.compile(r"<\s*(" + "|".join(re.escape(name) for name in SYMBOL_TAGS) + r")\s*>")
+
+# 末尾の著作権表示（例: "(C) 2019 Elsevier B.V. All rights reserved.", "(C) The Authors."）
+# 箇条書きの "(c) ..." と区別するため、"(C)" の後には年または "The" が続くものに限る
+COPYRIGHT_PATTERN = re.compile(r"\s*(?:Copyright\b|(?:\([cC]\)|©)\s*(?=\d{4}\b)|\(C\)\s*(?=The\b)).*$", re.DOTALL)
+# 著作権表示として除去する末尾の最大文字数（本文中の "(C)" などを誤って除去しないため）
+COPYRIGHT_MAX_LENGTH = 300
+
+# 文末（切り詰める位置の候補）
+SENTENCE_END_PATTERN = re.compile(r"[.!?](?=\s)")
+
+OVERFLOW_POLICIES = ("truncate", "skip", "keep")
+
+
+def clean_abstract(text):
+    """
+    アブストラクトから書式タグ・HTMLエンティティ・末尾の著作権表示・連続する空白を除去します。
+    同じ入力には常に同じ結果を返します。空の場合は None を返します。
+    """
+    if not isinstance(text, str):
+        return None
+    text = FORMAT_TAG_PATTERN.sub("", text)
+    text = SYMBOL_TAG_PATTERN.sub(lambda match: SYMBOL_TAGS[match.group(1)], text)
+    text = html.unescape(text)
+    match = COPYRIGHT_PATTERN.search(text)
+    if match is not None and len(text) - match.start() <= COPYRIGHT_MAX_LENGTH:
+        text = text[:match.start()]
+    text = re.sub(r"\s+", " ", text).strip()
+    return text or None
+
+
+def truncate_to_tokens(text, max_tokens):
+    """
+    概算トークン数が max_tokens 以下になるように、文末（なければ単語の区切り）で切り詰めます。
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # estimate_tokens は4文字で1トークンとして数えるため、その文字数で切る
+    limit = max(max_tokens - 1, 0) * 4
+    head = text[:limit]
+    ends = [match.end() for match in SENTENCE_END_PATTERN.finditer(head)]
+    if ends and ends[-1] >= limit // 2:
+        return head[:ends[-1]]
+    cut = head.rfind(" ")
+    return head[:cut] if cut > 0 else head
+
+
+class AbstractPreprocessor:
+    """
+    モデルに送る前にアブストラクトを正規化し、トークン数の上限を適用する前処理。
+    アブストラクトID（abstract_id）は変更しないため、結果はこれまでどおりIDで元のデータと結合できる。
+    元の本文は "original" に残す。分野（グループ）ごとに削減できたトークン数を集計する。
+    """
+
+    def __init__(self, normalize=True, max_tokens=None, overflow="truncate"):
+        """
+        Args:
+            normalize (bool): Trueの場合、clean_abstract で正規化する。
+            max_tokens (int, optional): 1件のアブストラクトの概算トークン数の上限。Noneの場合は上限なし。
+            overflow (str): 上限を超えた場合の扱い。"truncate"（文末で切り詰める）、"skip"（評価しない）、"keep"（そのまま送る）。
+        """
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow は {OVERFLOW_POLICIES} のいずれかを指定してください: {overflow}")
+        self.normalize = normalize
+        self.max_tokens = max_tokens
+        self.overflow = overflow
+        self._stats = {}
+
+    def process(self, abstracts, group="all"):
+        """
+        {"abstract_id": ..., "content": ...} 形式の辞書のリストを前処理し、モデルに送るもののリストを返す。
+        overflow="skip" で除外したアブストラクトは返さない（結果では回答なしになる）。
+
+        Args:
+            abstracts (list): アブストラクトの辞書のリスト。
+            group (str): 統計を集計するグループ名（分野名など）。
+        """
+        stats = self._stats.setdefault(group, new_stats())
+        processed = []
+        for abstract in abstracts:
+            original = abstract["content"]
+            content = clean_abstract(original) if self.normalize else original
+            original_tokens = estimate_tokens(original)
+            stats["abstracts"] += 1
+            stats["original_tokens"] += original_tokens
+            if content is None:
+                stats["skipped"] += 1
+                continue
+            if self.max_tokens is not None and estimate_tokens(content) > self.max_tokens:
+                stats["over_budget"] += 1
+                if self.overflow == "skip":
+                    stats["skipped"] += 1
+                    continue
+                if self.overflow == "truncate":
+                    content = truncate_to_tokens(content, self.max_tokens)
+                    stats["truncated"] += 1
+            stats["tokens"] += estimate_tokens(content)
+            processed.append({**abstract, "content": content, "original": original})
+        return processed
+
+    def pop_stats(self):
+        """
+        集計したグループごとの統計を返し、集計をリセットする（ワーカープロセスからジョブごとに回収するため）。
+        """
+        stats, self._stats = self._stats, {}
+        return stats
+
+    def merge_stats(self, stats):
+        """
+        別のプロセスで集計した統計（pop_stats の戻り値）を加算する。
+        """
+        for group, group_stats in stats.items():
+            total = self._stats.setdefault(group, new_stats())
+            for key, value in group_stats.items():
+                total[key] += value
+
+    def stats(self):
+        """
+        グループごとの統計（件数、元と前処理後のトークン数、削減率、切り詰め・除外の件数）を返す。
+        """
+        return {group: with_savings(group_stats) for group, group_stats in self._stats.items()}
+
+    def summary(self):
+        """
+        グループごとの削減量を表示用の文字列にまとめる。
+        """
+        lines = []
+        for group, stats in self.stats().items():
+            lines.append(
+                f"{group}: {stats['abstracts']}件, トークン {stats['original_tokens']} → {stats['tokens']}"
+                f"（{stats['savings']:.1%} 削減）, 上限超過 {stats['over_budget']}件"
+                f"（切り詰め {stats['truncated']}件 / 除外 {stats['skipped']}件）"
+            )
+        return "\n".join(lines)
+
+
+def new_stats():
+    return {"abstracts": 0, "original_tokens": 0, "tokens": 0, "over_budget": 0, "truncated": 0, "skipped": 0}
+
+
+def with_savings(stats):
+    savings = 1 - stats["tokens"] / stats["original_tokens"] if stats["original_tokens"] else 0.0
+    return {**stats, "savings": savings}
@@ -0,0 +1,121 @@
+import time
+import asyncio
+import threading
+
+# 待たずに送信できる量（バケットの容量）を何秒分の枠とするか。
+# 容量を1分間の上限にすると、起動直後や待機の後に1分間分のリクエストをまとめて送信して 429 を招くため、数秒分に抑える
+DEFAULT_BURST_SECONDS = 2
+
+
+def estimate_tokens(text):
+    """
+    プロンプトのトークン数をローカルで概算する関数。
+    英文ではおおよそ4文字で1トークンとなるため、その近似を使用する。
+
+    Args:
+        text (str): 対象のテキスト。
+
+    Returns:
+        int: 概算トークン数。
+    """
+    if not text:
+        return 0
+    return len(text) // 4 + 1
+
+
+def bucket_capacity(limit, burst, minimum=0):
+    """
+    1分あたりの上限 limit に対して、burst 秒分のバケットの容量を返します（minimum 未満にはしない）。
+    """
+    return max(limit / 60 * burst, minimum)
+
+
+class TokenBucket:
+    """
+    トークンバケット方式のレート制御。
+    残量が不足している場合は負の値（借り）を許容し、返済までの待ち時間を返す。
+    """
+
+    def __init__(self, rate, capacity):
+        """
+        Args:
+            rate (float): 1秒あたりの補充量。
+            capacity (float): バケットの最大容量。
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def reserve(self, amount):
+        """
+        指定量を予約し、利用可能になるまでの待ち時間（秒）を返す。
+
+        Args:
+            amount (float): 消費する量。
+
+        Returns:
+            float: 待ち時間（秒）。即時利用可能な場合は0。
+        """
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self._tokens -= amount
+        if self._tokens >= 0:
+            return 0.0
+        return -self._tokens / self.rate
+
+
+class RateLimiter:
+    """
+    1分あたりのリクエスト数（RPM）とトークン数（TPM）を同時に制御するレートリミッター。
+    非同期処理からは acquire、同期処理からは wait を使用する。
+    """
+
+    def __init__(self, rpm=None, tpm=None, burst=DEFAULT_BURST_SECONDS):
+        """
+        Args:
+            rpm (int, optional): 1分あたりの最大リクエスト数。Noneの場合は制限なし。
+            tpm (int, optional): 1分あたりの最大トークン数。Noneの場合は制限なし。
+            burst (float): 待たずに送信できる量を何秒分の枠とするか（リクエストは最低1件）。
+        """
+        self.rpm = rpm
+        self.tpm = tpm
+        self.burst = burst
+        self._request_bucket = TokenBucket(rpm / 60, bucket_capacity(rpm, burst, 1)) if rpm else None
+        self._token_bucket = TokenBucket(tpm / 60, bucket_capacity(tpm, burst)) if tpm else None
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens=0):
+        """
+        1リクエスト分の枠を予約し、送信可能になるまでの待ち時間（秒）を返す。
+
+        Args:
+            tokens (int): リクエストの概算トークン数。
+
+        Returns:
+            float: 待ち時間（秒）。
+        """
+        with self._lock:
+            delays = [0.0]
+            if self._request_bucket is not None:
+                delays.append(self._request_bucket.reserve(1))
+            if self._token_bucket is not None:
+                delays.append(self._token_bucket.reserve(tokens))
+            return max(delays)
+
+    async def acquire(self, tokens=0):
+        """
+        非同期処理用。送信可能になるまで待機する。
+        """
+        delay = self.reserve(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def wait(self, tokens=0):
+        """
+        同期処理用。送信可能になるまで待機する。
+        """
+        delay = self.reserve(tokens)
+        if delay > 0:
+            time.sleep(delay)
@@ -0,0 +1,152 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+
+class CachedResponse:
+    """
+    キャッシュから取り出したレスポンス。Geminiのレスポンスと同様に text 属性を持つ。
+    """
+
+    def __init__(self, text):
+        self.text = text
+
+
+def model_fingerprint(model):
+    """
+    レスポンスに影響するモデルの設定（モデル名・生成設定・システムプロンプト）を取り出す。
+
+    Args:
+        model: Geminiモデルオブジェクト。
+
+    Returns:
+        dict: モデル設定の辞書。
+    """
+    system_instruction = getattr(model, "_system_instruction", None)
+    return {
+        "model_name": getattr(model, "model_name", type(model).__name__),
+        "generation_config": getattr(model, "_generation_config", None),
+        "system_instruction": str(system_instruction) if system_instruction is not None else None,
+    }
+
+
+def make_cache_key(model, rules, abstract):
+    """
+    (モデル, 生成設定, ルール定義テキスト, アブストラクト) のハッシュからキャッシュキーを作成する。
+    """
+    payload = json.dumps(
+        {"model": model_fingerprint(model), "rules": rules, "abstract": abstract},
+        sort_keys=True, ensure_ascii=False, default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Geminiのレスポンスを保存するSQLiteベースの永続キャッシュ。
+    同じモデル・ルール・アブストラクトの組み合わせに対してはAPIを呼び出さずに結果を返す。
+    """
+
+    def __init__(self, path, max_entries=None, max_age_days=None, evict_every=100):
+        """
+        Args:
+            path (str): SQLiteファイルのパス。
+            max_entries (int, optional): 保持する最大件数。超えた分は最終参照が古い順に削除する。
+            max_age_days (float, optional): 保持期間（日）。超えたエントリは削除する。
+            evict_every (int): 何件書き込むごとに削除処理を行うか。
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+            "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_accessed_at ON responses (accessed_at)")
+        self._conn.commit()
+
+    def get(self, model, rules, abstract):
+        """
+        キャッシュ済みのレスポンスを返す。存在しない場合は None を返す。
+        """
+        key = make_cache_key(model, rules, abstract)
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+        return CachedResponse(row[0])
+
+    def put(self, model, rules, abstract, response_text):
+        """
+        レスポンスを保存する。None（エラー時）は保存しない。
+        """
+        if response_text is None:
+            return
+        key = make_cache_key(model, rules, abstract)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, response_text, now, now),
+            )
+            self._conn.commit()
+            self._puts += 1
+            should_evict = self._puts % self.evict_every == 0
+        if should_evict:
+            self.evict()
+
+    def evict(self):
+        """
+        保持期間と最大件数の設定に基づいて古いエントリを削除する。
+
+        Returns:
+            int: 削除した件数。
+        """
+        removed = 0
+        with self._lock:
+            if self.max_age_days is not None:
+                cutoff = time.time() - self.max_age_days * 86400
+                removed += self._conn.execute("DELETE FROM responses WHERE created_at < ?", (cutoff,)).rowcount
+            if self.max_entries is not None:
+                removed += self._conn.execute(
+                    "DELETE FROM responses WHERE key IN ("
+                    "SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                ).rowcount
+            self._conn.commit()
+        return removed
+
+    def stats(self):
+        """
+        ヒット数・ミス数・ヒット率・保存件数を返す。
+        """
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": size,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,129 @@
+import json
+import numpy as np
+
+# ルール行列の値（-1 は回答なし）
+YES = 1
+NO = 0
+MISSING = -1
+
+ANSWER_CODES = {"yes": YES, "no": NO}
+
+# np.int8 の行列をインデックスとして使用する（-1 は末尾の NaN に対応）
+ANSWER_LABELS = np.array(["no", "yes", np.nan], dtype=object)
+
+
+def extract_rules(response):
+    """
+    これまでに確認されたすべてのJSON形式からルールの回答リストを取り出す。
+    対応する形式: [{"rules": [...]}], {"results": [{"rules": [...]}]}, {"rules": [...]}
+
+    Args:
+        response (str): レスポンスのテキスト。
+
+    Returns:
+        tuple: (回答のリスト or None, パース状態)。
+            パース状態は "ok", "missing", "invalid_json", "no_rules" のいずれか。
+    """
+    if response is None or (isinstance(response, float) and np.isnan(response)):
+        return None, "missing"
+    try:
+        parsed = json.loads(response)
+    except (json.JSONDecodeError, TypeError):
+        return None, "invalid_json"
+
+    if isinstance(parsed, list):  # リストの場合
+        item = parsed[0] if parsed else None
+    elif isinstance(parsed, dict) and "results" in parsed:  # "results"キーがある場合
+        results = parsed["results"]
+        item = results[0] if isinstance(results, list) and results else None
+    else:  # "rules"キーが直接ある場合
+        item = parsed
+
+    rules = item.get("rules") if isinstance(item, dict) else None
+    if not isinstance(rules, list) or not rules:
+        return None, "no_rules"
+    return rules, "ok"
+
+
+def parse_response(response):
+    """
+    レスポンスを {"rule1": "yes", ...} 形式の辞書に変換する。パースできない場合は空の辞書を返す。
+    """
+    rules, _ = extract_rules(response)
+    if rules is None:
+        return {}
+    return {f"rule{i+1}": rule for i, rule in enumerate(rules)}
+
+
+def parse_responses_to_matrix(responses, n_rules=None):
+    """
+    レスポンスのリストを (アブストラクト数, ルール数) の int8 行列に変換する。
+    yes は 1、no は 0、回答なしは -1 として事前に確保した行列へ直接書き込む。
+
+    Args:
+        responses (list): レスポンスのテキストのリスト（None や NaN を含んでもよい）。
+        n_rules (int, optional): ルール数。Noneの場合はレスポンス中の最大の回答数を使用する。
+
+    Returns:
+        tuple: (np.ndarray int8 行列, 各行のパース状態の np.ndarray)。
+            パース状態は extract_rules の状態に加え、回答数の不一致や yes/no 以外の回答がある場合は "partial"。
+    """
+    parsed = [extract_rules(response) for response in responses]
+    if n_rules is None:
+        n_rules = max((len(rules) for rules, _ in parsed if rules is not None), default=0)
+
+    matrix = np.full((len(parsed), n_rules), MISSING, dtype=np.int8)
+    status = np.empty(len(parsed), dtype=object)
+    for i, (rules, row_status) in enumerate(parsed):
+        status[i] = row_status
+        if rules is None:
+            continue
+        codes = [ANSWER_CODES.get(rule, MISSING) for rule in rules[:n_rules]]
+        matrix[i, :len(codes)] = codes
+        if len(rules) != n_rules or MISSING in codes:
+            status[i] = "partial"
+    return matrix, status
+
+
+def rules_matrix_to_frame(matrix, index=None, prefix="rule"):
+    """
+    int8 のルール行列を "yes"/"no"/NaN の rule1..ruleN 列を持つデータフレームに一括で変換する。
+
+    Args:
+        matrix (np.ndarray): parse_responses_to_matrix が返す行列。
+        index (pd.Index, optional): データフレームのインデックス。
+        prefix (str): 列名の接頭辞。
+
+    Returns:
+        pd.DataFrame: ルール列のデータフレーム。
+    """
+    import pandas as pd
+
+    columns = [f"{prefix}{i+1}" for i in range(matrix.shape[1])]
+    return pd.DataFrame(ANSWER_LABELS[matrix], index=index, columns=columns)
+
+
+def frame_to_rules_matrix(df, rules):
+    """
+    "yes"/"no" のルール列を持つデータフレームを int8 のルール行列に一括で変換する（rules_matrix_to_frame の逆変換）。
+
+    Args:
+        df (pd.DataFrame): ルール列を持つデータフレーム。
+        rules (list): 変換するルール列名のリスト。
+
+    Returns:
+        np.ndarray: int8 のルール行列。
+    """
+    values = df[rules].to_numpy()
+    matrix = np.full(values.shape, MISSING, dtype=np.int8)
+    matrix[values == "yes"] = YES
+    matrix[values == "no"] = NO
+    return matrix
+
+
+def summarize_status(status):
+    """
+    パース状態ごとの件数を返す。
+    """
+    values, counts = np.unique(status.astype(str), return_counts=True)
+    return dict(zip(values.tolist(), counts.tolist()))
@@ -0,0 +1,369 @@
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import threading
+import contextvars
+from collections import deque
+
+from gemini.response_parser import extract_rules
+
+# エラーの分類
+QUOTA = "quota"          # 429 / ResourceExhausted
+SERVER = "server"        # 5xx
+TIMEOUT = "timeout"      # タイムアウト / DeadlineExceeded
+MALFORMED = "malformed"  # JSONとして解釈できないレスポンス
+CLIENT = "client"        # 429以外の4xx（リトライしても成功しない）
+OTHER = "other"
+
+# call_with_retry の中で実行中の試行の番号（1から）。InstrumentedModel がリトライかどうかの記録に使用する
+current_attempt = contextvars.ContextVar("current_attempt", default=1)
+
+# サーキットブレーカーの対象とするエラー（API側の障害・制限を示すもの）
+BREAKER_ERRORS = (QUOTA, SERVER, TIMEOUT)
+
+
+class ServerResponseError(Exception):
+    """
+    ステータスコードが5xxのレスポンスを受け取った場合のエラー。
+    """
+
+    def __init__(self, status_code):
+        super().__init__(f"Server Error: {status_code}")
+        self.code = status_code
+
+
+class MalformedResponseError(Exception):
+    """
+    レスポンスからルールの回答を取り出せない場合のエラー。
+    """
+
+
+class RetryExhaustedError(Exception):
+    """
+    最大リトライ回数を超えた場合のエラー。最後のエラーとその分類を保持する。
+    """
+
+    def __init__(self, error_class, last_error):
+        super().__init__(f"最大リトライ回数を超えました。レスポンスの取得に失敗しました。({error_class}: {last_error})")
+        self.error_class = error_class
+        self.last_error = last_error
+
+
+def error_code(error):
+    """
+    例外からHTTPステータスコードを取り出す。取り出せない場合は None を返す。
+    """
+    for attribute in ("code", "status_code"):
+        value = getattr(error, attribute, None)
+        if isinstance(value, int):
+            return value
+        # grpc の StatusCode などは value 属性にコードを持つ場合がある
+        if value is not None and isinstance(getattr(value, "value", None), int):
+            return value.value
+    return None
+
+
+def classify_error(error):
+    """
+    例外をリトライ方針の分類（quota, server, timeout, malformed, client, other）に振り分ける。
+
+    Args:
+        error (Exception): 発生した例外。
+
+    Returns:
+        str: エラーの分類。
+    """
+    if isinstance(error, RetryExhaustedError):
+        return error.error_class
+    if isinstance(error, MalformedResponseError):
+        return MALFORMED
+
+    name = type(error).__name__
+    code = error_code(error)
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError)) or code in (408, 504) or "DeadlineExceeded" in name:
+        return TIMEOUT
+    if code == 429 or "ResourceExhausted" in name or "TooManyRequests" in name:
+        return QUOTA
+    if (code is not None and code >= 500) or name in ("InternalServerError", "ServiceUnavailable", "BadGateway"):
+        return SERVER
+    if code is not None and 400 <= code < 500:
+        return CLIENT
+    return OTHER
+
+
+def retry_after_seconds(error):
+    """
+    サーバーから返された再試行までの待ち時間（秒）を取り出す。指定がない場合は None を返す。
+    retry_after 属性、Retry-After ヘッダー、エラーメッセージ中の retry_delay の順に参照する。
+    """
+    value = getattr(error, "retry_after", None)
+    if value is not None:
+        return float(value)
+
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    header = headers.get("Retry-After") if hasattr(headers, "get") else None
+    if header is not None:
+        try:
+            return float(header)
+        except ValueError:
+            pass
+
+    match = re.search(r"retry_delay\s*\{\s*seconds:\s*(\d+)", str(error)) or re.search(r"retry in ([\d.]+)\s*s", str(error), re.I)
+    if match:
+        return float(match.group(1))
+    return None
+
+
+def check_response(response, validate_json=True):
+    """
+    レスポンスの内容を確認し、リトライ対象であれば例外を送出する。
+    """
+    # ステータスコードの確認
+    if hasattr(response, "status_code") and response.status_code >= 500:
+        raise ServerResponseError(response.status_code)
+    if validate_json:
+        _, status = extract_rules(response.text)
+        if status != "ok":
+            raise MalformedResponseError(f"不正なレスポンス: {status}")
+
+
+class RetryPolicy:
+    """
+    エラーの分類ごとの最大試行回数と、ジッター付き指数バックオフによる待ち時間を決定する。
+    """
+
+    def __init__(self, max_attempts=3, base_delay=5, max_delay=120, jitter=True, class_attempts=None,
+                 validate_json=True, seed=None):
+        """
+        Args:
+            max_attempts (int): 基本の最大試行回数（server, timeout, other に適用）。
+            base_delay (float): バックオフの基準となる待ち時間（秒）。
+            max_delay (float): 待ち時間の上限（秒）。
+            jitter (bool): Trueの場合、待ち時間にランダムな揺らぎ（フルジッター）を加える。
+            class_attempts (dict, optional): 分類ごとの最大試行回数の上書き。
+            validate_json (bool): Trueの場合、ルールを取り出せないレスポンスを malformed としてリトライする。
+            seed (int, optional): ジッター用の乱数シード。
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.validate_json = validate_json
+        self.class_attempts = {
+            QUOTA: max_attempts * 2,   # クォータ超過は待てば回復するため多めに試行
+            MALFORMED: min(max_attempts, 2),
+            CLIENT: 1,                 # リクエスト自体の誤りはリトライしない
+        }
+        self.class_attempts.update(class_attempts or {})
+        self._random = random.Random(seed)
+
+    def attempts_for(self, error_class):
+        return self.class_attempts.get(error_class, self.max_attempts)
+
+    def next_delay(self, error, attempt):
+        """
+        attempt 回目の失敗後の待ち時間（秒）を返す。リトライしない場合は None を返す。
+
+        Args:
+            error (Exception): 発生した例外。
+            attempt (int): これまでの試行回数（1以上）。
+
+        Returns:
+            float or None: 待ち時間（秒）。
+        """
+        error_class = classify_error(error)
+        if attempt >= self.attempts_for(error_class):
+            return None
+        if error_class == MALFORMED:
+            return 0.0  # 形式の誤りはすぐに再送する
+
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        if self.jitter:
+            delay = self._random.uniform(delay / 2, delay)
+        retry_after = retry_after_seconds(error)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+
+class CircuitBreaker:
+    """
+    直近のリクエストのエラー率が閾値を超えた場合に、実行全体を一定時間停止させる。
+    """
+
+    def __init__(self, window=20, threshold=0.5, cooldown=60, min_calls=10):
+        """
+        Args:
+            window (int): エラー率の計算に使う直近のリクエスト数。
+            threshold (float): 停止するエラー率の閾値。
+            cooldown (float): 停止する時間（秒）。
+            min_calls (int): エラー率を判定するのに必要な最小リクエスト数。
+        """
+        self.window = window
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.min_calls = min_calls
+        self.trips = 0
+        self._outcomes = deque(maxlen=window)
+        self._open_until = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, success, error_class=None):
+        """
+        リクエストの結果を記録し、必要であればブレーカーを作動させる。
+        """
+        failed = not success and error_class in BREAKER_ERRORS
+        with self._lock:
+            self._outcomes.append(failed)
+            if len(self._outcomes) < self.min_calls:
+                return
+            if sum(self._outcomes) / len(self._outcomes) >= self.threshold:
+                self._open_until = time.monotonic() + self.cooldown
+                self._outcomes.clear()
+                self.trips += 1
+                print(f"エラー率が閾値を超えたため {self.cooldown} 秒間処理を停止します")
+
+    def remaining(self):
+        """
+        停止が解除されるまでの残り時間（秒）を返す。
+        """
+        with self._lock:
+            return max(0.0, self._open_until - time.monotonic())
+
+    def wait(self):
+        delay = self.remaining()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def wait_async(self):
+        delay = self.remaining()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def call_with_retry(request, policy=None, breaker=None, before_attempt=None):
+    """
+    request() をリトライ方針に従って実行する。
+
+    Args:
+        request (callable): レスポンスを返す関数。
+        policy (RetryPolicy, optional): リトライ方針。Noneの場合は既定の方針を使用する。
+        breaker (CircuitBreaker, optional): サーキットブレーカー。
+        before_attempt (callable, optional): 各試行の前に呼び出す関数（レート制御用）。
+
+    Returns:
+        レスポンスオブジェクト。
+    """
+    policy = policy or RetryPolicy()
+    attempt = 0
+    while True:
+        if breaker is not None:
+            breaker.wait()
+        if before_attempt is not None:
+            before_attempt()
+        try:
+            token = current_attempt.set(attempt + 1)
+            try:
+                response = request()
+            finally:
+                current_attempt.reset(token)
+            check_response(response, policy.validate_json)
+            if breaker is not None:
+                breaker.record(True)
+            return response
+        except Exception as e:
+            error_class = classify_error(e)
+            if breaker is not None:
+                breaker.record(False, error_class)
+            attempt += 1
+            delay = policy.next_delay(e, attempt)
+            if delay is None:
+                raise RetryExhaustedError(error_class, e) from e
+            print(f"リクエスト失敗 ({error_class}): {e} - {delay:.1f}秒後にリトライ ({attempt}/{policy.attempts_for(error_class)})")
+            time.sleep(delay)
+
+
+async def call_with_retry_async(request, policy=None, breaker=None, before_attempt=None):
+    """
+    call_with_retry の非同期版。
+
+    Args:
+        request (callable): レスポンスを返すコルーチンを作成する関数。
+        policy (RetryPolicy, optional): リトライ方針。
+        breaker (CircuitBreaker, optional): サーキットブレーカー。
+        before_attempt (callable, optional): 各試行の前に待機するコルーチンを作成する関数（レート制御用）。
+
+    Returns:
+        レスポンスオブジェクト。
+    """
+    policy = policy or RetryPolicy()
+    attempt = 0
+    while True:
+        if breaker is not None:
+            await breaker.wait_async()
+        if before_attempt is not None:
+            await before_attempt()
+        try:
+            token = current_attempt.set(attempt + 1)
+            try:
+                response = await request()
+            finally:
+                current_attempt.reset(token)
+            check_response(response, policy.validate_json)
+            if breaker is not None:
+                breaker.record(True)
+            return response
+        except Exception as e:
+            error_class = classify_error(e)
+            if breaker is not None:
+                breaker.record(False, error_class)
+            attempt += 1
+            delay = policy.next_delay(e, attempt)
+            if delay is None:
+                raise RetryExhaustedError(error_class, e) from e
+            print(f"リクエスト失敗 ({error_class}): {e} - {delay:.1f}秒後にリトライ ({attempt}/{policy.attempts_for(error_class)})")
+            await asyncio.sleep(delay)
+
+
+class DeadLetterQueue:
+    """
+    リトライしても失敗したアブストラクトを記録するJSONLファイル。
+    redrive_dead_letters で後から再処理できる。
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+
+    def append(self, input_file, output_file, abstract_id, error):
+        record = {
+            "input_file": input_file,
+            "output_file": output_file,
+            "abstract_id": int(abstract_id),
+            "error_class": classify_error(error),
+            "error": str(error),
+            "failed_at": time.time(),
+        }
+        with self._lock, open(self.path, "a", encoding="utf-8") as file:
+            file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def load(self):
+        """
+        記録されたすべての失敗を返す。
+        """
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, "r", encoding="utf-8") as file:
+            return [json.loads(line) for line in file if line.strip()]
+
+    def replace(self, records):
+        """
+        記録を指定したものに置き換える（再処理で成功した分を取り除く際に使用）。
+        """
+        with self._lock, open(self.path, "w", encoding="utf-8") as file:
+            for record in records:
+                file.write(json.dumps(record, ensure_ascii=False) + "\n")
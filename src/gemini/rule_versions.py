@@ -0,0 +1,204 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+from gemini.response_cache import make_cache_key
+from gemini.response_parser import extract_rules
+
+# "12. Proposed research method is written in past tense" 形式の行
+RULE_LINE_PATTERN = re.compile(r"^\s*(\d+)\.\s+(.+?)\s*$")
+
+
+class Rule:
+    """
+    ルール定義テキストの1つの評価指標。ハッシュは番号を除いた本文から計算する。
+    """
+
+    def __init__(self, number, text):
+        self.number = number
+        self.text = text
+        self.hash = hashlib.sha256(" ".join(text.split()).encode("utf-8")).hexdigest()
+
+    def __repr__(self):
+        return f"Rule({self.number}, {self.text!r})"
+
+
+class RuleSet:
+    """
+    ルール定義テキストを、前置き・番号付きの評価指標・後書きに分解したもの。
+    """
+
+    def __init__(self, header, rules, footer):
+        self.header = header
+        self.rules = rules
+        self.footer = footer
+
+    @property
+    def hashes(self):
+        return [rule.hash for rule in self.rules]
+
+    def format(self, rules=None):
+        """
+        指定した評価指標だけを含むルール定義テキストを作成する。番号は1から振り直す。
+
+        Args:
+            rules (list, optional): 含める Rule のリスト。Noneの場合はすべての評価指標。
+
+        Returns:
+            str: ルール定義テキスト。
+        """
+        rules = self.rules if rules is None else rules
+        lines = [f"{i + 1}. {rule.text}" for i, rule in enumerate(rules)]
+        return "\n".join(part for part in (self.header, "\n".join(lines), self.footer) if part)
+
+
+def parse_rules(rules_text):
+    """
+    ルール定義テキストを評価指標ごとに分解する。
+    最初の番号付きの行から連続する番号付きの行（空行を含む）を評価指標とみなす。
+
+    Args:
+        rules_text (str): ルール定義テキスト（prompt/rules.txt の内容）。
+
+    Returns:
+        RuleSet: 分解したルール定義。
+    """
+    lines = rules_text.splitlines()
+    numbered = [i for i, line in enumerate(lines) if RULE_LINE_PATTERN.match(line)]
+    if not numbered:
+        raise ValueError("ルール定義テキストに番号付きの評価指標がありません。")
+
+    start = numbered[0]
+    end = start
+    while end + 1 < len(lines) and (RULE_LINE_PATTERN.match(lines[end + 1]) or not lines[end + 1].strip()):
+        end += 1
+    while not lines[end].strip():
+        end -= 1
+
+    rules = []
+    for line in lines[start:end + 1]:
+        match = RULE_LINE_PATTERN.match(line)
+        if match:
+            rules.append(Rule(int(match.group(1)), match.group(2)))
+    header = "\n".join(lines[:start]).rstrip()
+    footer = "\n".join(lines[end + 1:]).strip("\n")
+    return RuleSet(header, rules, "\n" + footer if footer else "")
+
+
+class RuleAnswerStore:
+    """
+    評価結果を (アブストラクト, 評価指標のハッシュ) ごとに保存するSQLiteベースのストア。
+    ルール定義を変更した場合も、本文が変わっていない評価指標の回答は再利用できる。
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): SQLiteファイルのパス。
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.reused = 0
+        self.evaluated = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            "abstract_key TEXT NOT NULL, rule_hash TEXT NOT NULL, answer TEXT NOT NULL, created_at REAL NOT NULL, "
+            "PRIMARY KEY (abstract_key, rule_hash))"
+        )
+        self._conn.commit()
+
+    def abstract_key(self, model, abstract):
+        # 回答はモデルの設定ごとに保存する（ルール定義は評価指標のハッシュで区別する）
+        return make_cache_key(model, None, abstract)
+
+    def get(self, model, abstract, rule_hashes):
+        """
+        保存済みの回答を {評価指標のハッシュ: 回答} の辞書で返す。
+        """
+        key = self.abstract_key(model, abstract)
+        placeholders = ",".join("?" * len(rule_hashes))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT rule_hash, answer FROM answers WHERE abstract_key = ? AND rule_hash IN ({placeholders})",
+                [key, *rule_hashes],
+            ).fetchall()
+        return dict(rows)
+
+    def put(self, model, abstract, answers):
+        """
+        {評価指標のハッシュ: 回答} の辞書を保存する。
+        """
+        if not answers:
+            return
+        key = self.abstract_key(model, abstract)
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO answers (abstract_key, rule_hash, answer, created_at) VALUES (?, ?, ?, ?)",
+                [(key, rule_hash, answer, now) for rule_hash, answer in answers.items()],
+            )
+            self._conn.commit()
+
+    def stats(self):
+        """
+        この実行で再利用した回答数と、新たに評価した回答数を返す。
+        """
+        return {"reused": self.reused, "evaluated": self.evaluated}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def merge_answers(ruleset, answers):
+    """
+    評価指標のハッシュごとの回答を、ルール定義の順に並べたレスポンス（JSON文字列）に変換する。
+    回答がない評価指標は null とし、すべて回答がない場合は None を返す。
+    """
+    rules = [answers.get(rule_hash) for rule_hash in ruleset.hashes]
+    if all(answer is None for answer in rules):
+        return None
+    return json.dumps({"results": [{"rules": rules}]})
+
+
+def plan_partial_requests(model, ruleset, abstracts, store):
+    """
+    アブストラクトごとに保存済みの回答を取り出し、未評価の評価指標の組み合わせごとにまとめる。
+
+    Returns:
+        tuple: ({abstract_id: 回答の辞書}, {未評価の評価指標のハッシュのタプル: アブストラクトのリスト})
+    """
+    known = {}
+    groups = {}
+    for abstract in abstracts:
+        answers = store.get(model, abstract["content"], ruleset.hashes)
+        known[abstract["abstract_id"]] = answers
+        store.reused += len(answers)
+        missing = tuple(rule_hash for rule_hash in ruleset.hashes if rule_hash not in answers)
+        if missing:
+            groups.setdefault(missing, []).append(abstract)
+    return known, groups
+
+
+def apply_partial_responses(model, rules, abstracts, responses, known, store):
+    """
+    一部の評価指標だけを含むプロンプトのレスポンスを評価指標のハッシュに対応付けて保存する。
+    回答数が評価指標の数と一致しないレスポンスは保存しない。
+    """
+    contents = {abstract["abstract_id"]: abstract["content"] for abstract in abstracts}
+    for response in responses:
+        answers, status = extract_rules(response["response"])
+        if status != "ok" or len(answers) != len(rules):
+            continue
+        new_answers = {rule.hash: answer for rule, answer in zip(rules, answers) if answer in ("yes", "no")}
+        known[response["abstract_id"]].update(new_answers)
+        store.put(model, contents[response["abstract_id"]], new_answers)
+        store.evaluated += len(new_answers)
@@ -0,0 +1,250 @@
+import os
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from gemini.rate_limiter import DEFAULT_BURST_SECONDS, RateLimiter, bucket_capacity
+from gemini.journal import journal_path_for, load_journal, rotate_journal
+from gemini.response_cache import ResponseCache
+from gemini.retry import DeadLetterQueue
+from gemini.dedup import DedupIndex
+from gemini.rule_versions import RuleAnswerStore
+from gemini.telemetry import Telemetry
+from gemini.gemini_modules import process_shard
+from data_process.results_store import ResultsStore
+from data_process.ingest import find_shards, load_manifest, read_csv_or_shard, shard_reference
+
+
+class SharedRateLimiter(RateLimiter):
+    """
+    複数のプロセスで共有するレートリミッター。
+    RateLimiter と同じトークンバケット（借りを許容する方式）の状態を共有メモリに置き、
+    プロセス間のロックで更新するため、ワーカー全体でRPM・TPMの上限を超えない。
+    ProcessPoolExecutor の initializer の引数としてワーカーに渡す。
+    """
+
+    def __init__(self, rpm=None, tpm=None, burst=DEFAULT_BURST_SECONDS, context=None):
+        """
+        Args:
+            rpm (int, optional): 1分あたりの最大リクエスト数。Noneの場合は制限なし。
+            tpm (int, optional): 1分あたりの最大トークン数。Noneの場合は制限なし。
+            burst (float): 待たずに送信できる量を何秒分の枠とするか（リクエストは最低1件）。
+            context: multiprocessing のコンテキスト。Noneの場合は既定のコンテキスト。
+        """
+        context = context or multiprocessing.get_context()
+        self.rpm = rpm
+        self.tpm = tpm
+        self.burst = burst
+        self._capacities = (bucket_capacity(rpm or 0, burst, 1), bucket_capacity(tpm or 0, burst))
+        self._lock = context.Lock()
+        # [リクエストの残量, トークンの残量, 最終更新時刻]
+        self._state = context.RawArray("d", [*self._capacities, time.time()])
+
+    def reserve(self, tokens=0):
+        with self._lock:
+            now = time.time()
+            elapsed = max(0.0, now - self._state[2])
+            self._state[2] = now
+            delays = [0.0]
+            for i, (limit, amount) in enumerate(((self.rpm, 1), (self.tpm, tokens))):
+                if not limit:
+                    continue
+                rate = limit / 60
+                self._state[i] = min(self._capacities[i], self._state[i] + elapsed * rate) - amount
+                if self._state[i] < 0:
+                    delays.append(-self._state[i] / rate)
+            return max(delays)
+
+
+def count_remaining(input_file, output_file):
+    """
+    シャードのアブストラクト数と、ジャーナルに記録済みの件数を返す。
+    """
+    df = read_csv_or_shard(input_file)
+    ids = set(df.index[df["Abstract"].notna()].tolist())
+    completed = set(load_journal(journal_path_for(output_file))) & ids
+    return len(ids), len(completed)
+
+
+def build_jobs(base_input_path, base_output_path, fields, citation_types, manifest_path=None, overwrite=False):
+    """
+    分野 × high/low × シャードのジョブの一覧を作成する。
+    途中まで処理したシャード（ジャーナルあり）を先頭に並べ、結果のCSVが存在するシャードは overwrite=False の場合は除外する。
+
+    Args:
+        base_input_path (str): 入力データの基本ディレクトリ
+        base_output_path (str): 出力データの基本ディレクトリ
+        fields (list): 分野名のリスト
+        citation_types (list): "high" / "low" のリスト
+        manifest_path (str, optional): 指定した場合はマニフェストのシャードを処理する
+        overwrite (bool): Trueの場合、処理済みのシャードも再度処理する（既存のジャーナルは .old に退避する）
+
+    Returns:
+        list: ジョブ（field, citation_type, input_file, output_file, total, completed）の辞書のリスト
+    """
+    manifest = load_manifest(manifest_path) if manifest_path else None
+    jobs = []
+    for field in fields:
+        for citation_type in citation_types:
+            if manifest is not None:
+                targets = [(shard_reference(manifest_path, shard["name"]), f"{shard['name']}.csv")
+                           for shard in find_shards(manifest, field, citation_type)]
+            else:
+                input_path = os.path.join(base_input_path, field)
+                csv_files = sorted(f for f in os.listdir(input_path) if f.endswith(".csv") and citation_type in f)
+                targets = [(os.path.join(input_path, file_name), file_name) for file_name in csv_files]
+
+            for input_file, file_name in targets:
+                output_file = os.path.join(base_output_path, field, file_name)
+                if os.path.exists(output_file) and not overwrite:
+                    continue
+                if overwrite:
+                    # ジャーナルはルール定義やモデルで区別しないため、古い記録から再開せずに退避して評価し直す
+                    rotate_journal(journal_path_for(output_file))
+                total, completed = count_remaining(input_file, output_file)
+                jobs.append({"field": field, "citation_type": citation_type, "input_file": input_file,
+                             "output_file": output_file, "total": total, "completed": completed})
+
+    # 途中まで処理したシャードを優先し、その中では残りの少ない順に並べる
+    jobs.sort(key=lambda job: (job["completed"] == 0, job["total"] - job["completed"]))
+    return jobs
+
+
+# ワーカープロセスごとの状態（モデル・キャッシュなどはプロセス内で1度だけ作成する）
+_worker = {}
+
+
+def _init_worker(model_factory, rules, limiter, cache_path, dead_letter_path, dedup_path, rule_store_path, telemetry_path,
+                 results_store_path, options):
+    _worker["model"] = model_factory()
+    _worker["rules"] = rules
+    _worker["limiter"] = limiter
+    _worker["cache"] = ResponseCache(cache_path) if cache_path else None
+    _worker["dead_letter"] = DeadLetterQueue(dead_letter_path) if dead_letter_path else None
+    _worker["dedup"] = DedupIndex(dedup_path) if dedup_path else None
+    _worker["rule_store"] = RuleAnswerStore(rule_store_path) if rule_store_path else None
+    _worker["telemetry"] = Telemetry(telemetry_path) if telemetry_path else None
+    _worker["results_store"] = ResultsStore(results_store_path) if results_store_path else None
+    _worker["options"] = options
+
+
+def _run_job(job):
+    start = time.monotonic()
+    dedup = _worker["dedup"]
+    saved_before = dedup.calls_saved if dedup is not None else 0
+    os.makedirs(os.path.dirname(job["output_file"]), exist_ok=True)
+    options = dict(_worker["options"])
+    options.setdefault("resume", job["completed"] > 0)
+    process_shard(
+        _worker["model"], _worker["rules"], job["input_file"], job["output_file"],
+        limiter=_worker["limiter"], cache=_worker["cache"], dead_letter=_worker["dead_letter"],
+        dedup=dedup, rule_store=_worker["rule_store"],
+        telemetry=_worker["telemetry"], results_store=_worker["results_store"], **options
+    )
+    calls_saved = dedup.calls_saved - saved_before if dedup is not None else 0
+    # 前処理の統計はワーカー内で集計されるため、ジョブごとに回収して親プロセスで合算する
+    preprocessor, validator = options.get("preprocessor"), options.get("validator")
+    local_rules, consensus = options.get("local_rules"), options.get("consensus")
+    preprocess_stats = preprocessor.pop_stats() if preprocessor is not None else {}
+    validation_stats = validator.pop_stats() if validator is not None else {}
+    local_rules_stats = local_rules.pop_stats() if local_rules is not None else None
+    consensus_stats = consensus.pop_stats() if consensus is not None else None
+    return {"input_file": job["input_file"], "processed": job["total"] - job["completed"],
+            "elapsed": time.monotonic() - start, "calls_saved": calls_saved, "preprocess_stats": preprocess_stats,
+            "validation_stats": validation_stats, "local_rules_stats": local_rules_stats,
+            "consensus_stats": consensus_stats}
+
+
+def run_scheduler(model_factory, rules, base_input_path, base_output_path, fields, citation_types=("high", "low"),
+                  workers=4, rpm=None, tpm=None, cache_path=None, dead_letter_path=None, dedup_path=None,
+                  rule_store_path=None, telemetry_path=None, results_store_path=None, manifest_path=None, overwrite=False,
+                  **options):
+    """
+    全分野 × high/low × シャードのジョブをプロセスプールで並列に処理する。
+    レート制限は全ワーカーで共有するため、ワーカー数に関わらずアカウントの上限を超えない。
+    ジャーナルは既定で有効にし、途中で停止しても再実行すると記録済みのアブストラクトから再開する。
+
+    Args:
+        model_factory (callable): ワーカー内でGeminiモデルを作成する関数（モジュールのトップレベルで定義したもの）
+        rules (str): ルール定義テキスト
+        base_input_path (str): 入力データの基本ディレクトリ
+        base_output_path (str): 出力データの基本ディレクトリ
+        fields (list): 処理対象の分野名のリスト
+        citation_types (tuple): 処理対象の "high" / "low"
+        workers (int): ワーカープロセス数
+        rpm (int, optional): 全体での1分あたりの最大リクエスト数
+        tpm (int, optional): 全体での1分あたりの最大トークン数
+        cache_path (str, optional): レスポンスキャッシュ（SQLite）のパス
+        dead_letter_path (str, optional): デッドレターのパス
+        dedup_path (str, optional): 重複排除のインデックス（SQLite）のパス。同じアブストラクトは全ワーカーで1度だけ評価する
+        rule_store_path (str, optional): 評価指標ごとの回答のストア（SQLite）のパス。追加・変更された評価指標のみ評価する
+        telemetry_path (str, optional): テレメトリのイベント（JSONL）のパス。全ワーカーが同じファイルに追記する
+        results_store_path (str, optional): 結果ストアのディレクトリ。各ワーカーがシャードごとのセグメントを書き込み、最後にまとめる
+        manifest_path (str, optional): ingest_txt_files で作成したマニフェスト
+        overwrite (bool): Trueの場合、処理済みのシャードも再度処理する（既存のジャーナルは退避して評価し直す）
+        **options: process_shard に渡すオプション（concurrency, batch_size, policy, dependencies, preprocessor, validator, local_rules, consensus など、pickle可能なもの）
+
+    Returns:
+        list: 各ジョブの結果（input_file, processed, elapsed, calls_saved, preprocess_stats, validation_stats, local_rules_stats, consensus_stats）のリスト
+    """
+    from tqdm import tqdm
+
+    jobs = build_jobs(base_input_path, base_output_path, fields, citation_types, manifest_path, overwrite)
+    if not jobs:
+        print("処理対象のシャードはありません。")
+        return []
+
+    remaining = sum(job["total"] - job["completed"] for job in jobs)
+    resumed = sum(job["completed"] > 0 for job in jobs)
+    print(f"{len(jobs)} シャード（再開 {resumed} 件） / 残り {remaining} 件のアブストラクトを {workers} プロセスで処理します")
+
+    options.setdefault("journal", True)
+    limiter = SharedRateLimiter(rpm=rpm, tpm=tpm) if (rpm or tpm) else None
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(model_factory, rules, limiter, cache_path, dead_letter_path, dedup_path,
+                                       rule_store_path, telemetry_path, results_store_path, options)) as executor:
+        futures = {executor.submit(_run_job, job): job for job in jobs}
+        # 全体の進捗と推定残り時間
+        with tqdm(total=remaining, desc="All shards", unit="abstract") as progress:
+            for future in as_completed(futures):
+                job = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"シャードの処理に失敗しました: {job['input_file']}: {e}")
+                    result = {"input_file": job["input_file"], "processed": 0, "elapsed": None, "calls_saved": 0,
+                              "preprocess_stats": {}, "validation_stats": {}, "local_rules_stats": None,
+                              "consensus_stats": None}
+                    progress.total -= job["total"] - job["completed"]
+                results.append(result)
+                progress.update(result["processed"])
+
+    print(f"全シャードの処理が完了しました: {sum(result['processed'] for result in results)} 件")
+    if dedup_path:
+        print(f"重複排除で節約したAPI呼び出し: {sum(result['calls_saved'] for result in results)} 件")
+    if options.get("preprocessor") is not None:
+        preprocessor = options["preprocessor"]
+        for result in results:
+            preprocessor.merge_stats(result["preprocess_stats"])
+        print(f"前処理によるトークンの削減:\n{preprocessor.summary()}")
+    if options.get("validator") is not None:
+        validator = options["validator"]
+        for result in results:
+            validator.merge_stats(result["validation_stats"])
+        print(f"シャードごとのレスポンスの有効率:\n{validator.summary()}")
+    if options.get("local_rules") is not None:
+        local_rules = options["local_rules"]
+        for result in results:
+            if result["local_rules_stats"] is not None:
+                local_rules.merge_stats(result["local_rules_stats"])
+        print(f"ローカルで判定した評価: {local_rules.stats()}")
+    if options.get("consensus") is not None:
+        consensus = options["consensus"]
+        for result in results:
+            if result["consensus_stats"] is not None:
+                consensus.merge_stats(result["consensus_stats"])
+        print(f"多数決の再サンプリング: {consensus.stats()}")
+    if results_store_path:
+        ResultsStore(results_store_path).compact()
+    return results
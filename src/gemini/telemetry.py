@@ -0,0 +1,265 @@
+import os
+import json
+import time
+import asyncio
+import threading
+import numpy as np
+
+from gemini.rate_limiter import estimate_tokens
+from gemini.retry import MALFORMED, classify_error, current_attempt
+from gemini.response_parser import extract_rules
+
+# 1Mトークンあたりの料金（USD）。gemini-1.5-flash（128kトークン以下のプロンプト）の公開価格を既定値とする
+DEFAULT_INPUT_PRICE = 0.075
+DEFAULT_OUTPUT_PRICE = 0.30
+
+# レイテンシのヒストグラムの区切り（ミリ秒）
+LATENCY_BUCKETS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+
+class ShardStats:
+    """
+    1つのシャード（またはファイル）の集計値。
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.started_at = time.time()
+        self.finished_at = None
+        self.requests = 0
+        self.successes = 0
+        self.retries = 0
+        self.errors = {}
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.prompt_chars = 0
+        self.response_chars = 0
+        self.latencies = []
+        self.abstracts = 0
+        self.parse_status = {}
+
+
+class Telemetry:
+    """
+    モデル呼び出しごとのイベントをJSONLに記録し、シャードごとのカウンターとヒストグラムを集計する。
+    InstrumentedModel でモデルを包み、process_shard / create_test_data の telemetry 引数に渡して使用する。
+    """
+
+    def __init__(self, path=None, input_price=DEFAULT_INPUT_PRICE, output_price=DEFAULT_OUTPUT_PRICE):
+        """
+        Args:
+            path (str, optional): イベントを追記するJSONLファイルのパス。Noneの場合は集計のみ行う。
+            input_price (float): 入力1Mトークンあたりの料金（USD）。
+            output_price (float): 出力1Mトークンあたりの料金（USD）。
+        """
+        self.path = path
+        self.input_price = input_price
+        self.output_price = output_price
+        self.shards = {}
+        self.current_shard = None
+        self._lock = threading.Lock()
+        self._file = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._file = open(path, "a", encoding="utf-8")
+
+    def emit(self, event, **fields):
+        """
+        イベントをJSONLに1行として記録する。
+        """
+        if self._file is None:
+            return
+        record = {"event": event, "time": time.time(), "shard": self.current_shard, **fields}
+        with self._lock:
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._file.flush()
+
+    def _stats(self, shard=None):
+        shard = shard or self.current_shard or "default"
+        if shard not in self.shards:
+            self.shards[shard] = ShardStats(shard)
+        return self.shards[shard]
+
+    def start_shard(self, name):
+        """
+        以降のリクエストを指定したシャードの集計に含める。
+        """
+        with self._lock:
+            self.current_shard = name
+            self.shards[name] = ShardStats(name)
+        self.emit("shard_start")
+
+    def record_request(self, latency, prompt, response_text=None, usage=None, error=None, attempt=1):
+        """
+        1回のモデル呼び出しを記録する。
+
+        Args:
+            latency (float): 所要時間（秒）。
+            prompt (str): プロンプト。
+            response_text (str, optional): レスポンスのテキスト。
+            usage (optional): レスポンスの usage_metadata（prompt_token_count, candidates_token_count）。
+            error (Exception, optional): 発生した例外。
+            attempt (int): call_with_retry の何回目の試行か（1回目以外はリトライとして数える）。
+        """
+        input_tokens = getattr(usage, "prompt_token_count", None) or estimate_tokens(prompt)
+        output_tokens = getattr(usage, "candidates_token_count", None) or estimate_tokens(response_text)
+        error_class = classify_error(error) if error is not None else None
+        # 受信できてもルールを取り出せないレスポンスは malformed として数える
+        if error is None and extract_rules(response_text)[1] != "ok":
+            error_class = MALFORMED
+        with self._lock:
+            stats = self._stats()
+            stats.requests += 1
+            stats.retries += attempt > 1
+            stats.latencies.append(latency)
+            stats.prompt_chars += len(prompt)
+            stats.input_tokens += input_tokens
+            if error is None:
+                stats.output_tokens += output_tokens
+                stats.response_chars += len(response_text or "")
+            if error_class is None:
+                stats.successes += 1
+            else:
+                stats.errors[error_class] = stats.errors.get(error_class, 0) + 1
+        self.emit(
+            "request", latency_ms=round(latency * 1000, 3), attempt=attempt, prompt_chars=len(prompt),
+            response_chars=len(response_text or ""), input_tokens=input_tokens,
+            output_tokens=output_tokens if error is None else 0, error_class=error_class,
+            error=str(error) if error is not None else None,
+        )
+
+    def end_shard(self, abstracts=0, parse_status=None):
+        """
+        現在のシャードの集計を終了し、サマリーを記録して返す。
+        """
+        with self._lock:
+            stats = self._stats()
+            stats.finished_at = time.time()
+            stats.abstracts = abstracts
+            stats.parse_status = parse_status or {}
+        summary = self.summarize(stats)
+        self.emit("shard_summary", **summary)
+        print(f"テレメトリ: {format_summary(summary)}")
+        self.current_shard = None
+        return summary
+
+    def estimate_cost(self, input_tokens, output_tokens):
+        return (input_tokens * self.input_price + output_tokens * self.output_price) / 1_000_000
+
+    def summarize(self, stats):
+        """
+        シャードの集計値から、スループット・エラーの内訳・トークン数・推定料金などのサマリーを作成する。
+        """
+        wall_time = (stats.finished_at or time.time()) - stats.started_at
+        latencies = np.array(stats.latencies) * 1000
+        percentiles = np.percentile(latencies, [50, 95, 99]).round(3).tolist() if len(latencies) else [None] * 3
+        histogram = np.histogram(latencies, bins=[0, *LATENCY_BUCKETS, np.inf])[0].tolist()
+        return {
+            "name": stats.name,
+            "abstracts": stats.abstracts,
+            "requests": stats.requests,
+            "successes": stats.successes,
+            "retries": stats.retries,
+            "errors": stats.errors,
+            "parse_status": stats.parse_status,
+            "wall_time": round(wall_time, 3),
+            "abstracts_per_sec": round(stats.abstracts / wall_time, 3) if wall_time > 0 else None,
+            "latency_p50": percentiles[0],
+            "latency_p95": percentiles[1],
+            "latency_p99": percentiles[2],
+            "latency_histogram": dict(zip([f"<{bucket}ms" for bucket in LATENCY_BUCKETS] + ["inf"], histogram)),
+            "prompt_chars": stats.prompt_chars,
+            "response_chars": stats.response_chars,
+            "input_tokens": stats.input_tokens,
+            "output_tokens": stats.output_tokens,
+            "estimated_cost": round(self.estimate_cost(stats.input_tokens, stats.output_tokens), 6),
+        }
+
+    def summary(self):
+        """
+        すべてのシャードのサマリーと合計を返す。
+        """
+        summaries = [self.summarize(stats) for stats in self.shards.values()]
+        total = {
+            key: sum(summary[key] for summary in summaries)
+            for key in ("abstracts", "requests", "successes", "retries", "input_tokens", "output_tokens")
+        }
+        total["estimated_cost"] = round(self.estimate_cost(total["input_tokens"], total["output_tokens"]), 6)
+        errors = {}
+        for summary in summaries:
+            for error_class, count in summary["errors"].items():
+                errors[error_class] = errors.get(error_class, 0) + count
+        total["errors"] = errors
+        return {"shards": summaries, "total": total}
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def format_summary(summary):
+    """
+    サマリーを1行の文字列にする。
+    """
+    return (
+        f"{summary['name']} {summary['abstracts']}件 / {summary['wall_time']}秒 "
+        f"({summary['abstracts_per_sec']}件/秒), リクエスト {summary['requests']} (リトライ {summary['retries']}, "
+        f"エラー {summary['errors']}), p50/p95 {summary['latency_p50']}/{summary['latency_p95']}ms, "
+        f"トークン {summary['input_tokens']}+{summary['output_tokens']}, 推定料金 ${summary['estimated_cost']}"
+    )
+
+
+class InstrumentedModel:
+    """
+    モデルの呼び出しを Telemetry に記録するラッパー。
+    model_name などのその他の属性は元のモデルのものを返すため、キャッシュのキーは変わらない。
+    """
+
+    def __init__(self, model, telemetry):
+        self.model = model
+        self.telemetry = telemetry
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def _record(self, start, prompt, attempt, response=None, error=None):
+        text = None
+        if response is not None:
+            try:
+                text = response.text
+            except Exception:
+                text = None
+        self.telemetry.record_request(
+            time.perf_counter() - start, prompt, text, usage=getattr(response, "usage_metadata", None),
+            error=error, attempt=attempt,
+        )
+
+    def generate_content(self, contents, **kwargs):
+        prompt = str(contents)
+        # 試行の番号は call_with_retry から受け取る（同じプロンプトの再送信でもリトライとは限らないため）
+        attempt = current_attempt.get()
+        start = time.perf_counter()
+        try:
+            response = self.model.generate_content(contents, **kwargs)
+        except Exception as e:
+            self._record(start, prompt, attempt, error=e)
+            raise
+        self._record(start, prompt, attempt, response=response)
+        return response
+
+    async def generate_content_async(self, contents, **kwargs):
+        prompt = str(contents)
+        attempt = current_attempt.get()
+        start = time.perf_counter()
+        try:
+            if hasattr(self.model, "generate_content_async"):
+                response = await self.model.generate_content_async(contents, **kwargs)
+            else:
+                response = await asyncio.to_thread(self.model.generate_content, contents, **kwargs)
+        except Exception as e:
+            self._record(start, prompt, attempt, error=e)
+            raise
+        self._record(start, prompt, attempt, response=response)
+        return response
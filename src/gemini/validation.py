@@ -0,0 +1,313 @@
+import re
+import json
+import asyncio
+import threading
+
+from gemini.batching import ANSWERS
+from gemini.rate_limiter import estimate_tokens
+from gemini.response_parser import extract_rules
+from gemini.rule_versions import RULE_LINE_PATTERN, Rule, parse_rules
+
+# ```json ... ``` で囲まれたレスポンス（閉じていないものも含む）
+FENCE_PATTERN = re.compile(r"^```[A-Za-z]*\s*(.*?)\s*(?:```)?$", re.S)
+
+# バッチのメッセージ（batching.BATCH_INSTRUCTION）の見出し
+BATCH_MARKER = "# Batch Instruction"
+
+# 不正なレスポンスに対して、理由を添えて再度回答を求める指示
+REASK_INSTRUCTION = """
+---
+# Correction
+Your previous response was rejected: {error}.
+Respond again with only the JSON object (no markdown, no explanation) and exactly {n_rules} answers, each "yes" or "no", in "rules".
+"""
+
+# 検証結果の状態
+VALID_STATUSES = ("ok", "repaired")
+
+
+def build_response_schema(n_rules=None):
+    """
+    評価指標の数に合わせた、Gemini の構造化出力（response_schema）用のスキーマを作成します。
+    rules は "yes" / "no" のみからなる、ちょうど n_rules 個の配列です。
+    n_rules が None の場合（プロンプトごとに評価指標の数が変わる場合）は個数を制限しません（個数は検証で確認します）。
+    """
+    rules_schema = {"type": "array", "items": {"type": "string", "format": "enum", "enum": list(ANSWERS)}}
+    if n_rules is not None:
+        rules_schema.update(min_items=n_rules, max_items=n_rules)
+    return {
+        "type": "object",
+        "properties": {
+            "results": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "separated_abstract": {"type": "array", "items": {"type": "string"}},
+                        "rules": rules_schema,
+                    },
+                    "required": ["rules"],
+                },
+            },
+        },
+        "required": ["results"],
+    }
+
+
+def repair_response_text(text):
+    """
+    コードフェンスや前後の説明文を取り除き、最初のJSONの値だけを取り出します。
+    JSONとして解釈できない場合は None を返します。
+    """
+    text = text.strip()
+    match = FENCE_PATTERN.match(text)
+    if match is not None:
+        text = match.group(1)
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if not starts:
+        return None
+    try:
+        _, end = json.JSONDecoder().raw_decode(text, min(starts))
+    except json.JSONDecodeError:
+        return None
+    return text[min(starts):end]
+
+
+def validate_response(text, n_rules, batch=False):
+    """
+    レスポンスのテキストを検証し、軽微な問題（コードフェンス・前後の説明文）は修復します。
+
+    Args:
+        text (str): レスポンスのテキスト。
+        n_rules (int): 評価指標の数。
+        batch (bool): Trueの場合はバッチのレスポンスとして、JSONの形式のみを確認する（要素ごとの確認は split_batch_response で行う）。
+
+    Returns:
+        tuple: (検証・修復後のテキスト, 状態, 不正な理由)。
+            状態は "ok", "repaired", "missing", "invalid_json", "no_rules", "wrong_count", "invalid_answer" のいずれか。
+    """
+    if not isinstance(text, str) or not text.strip():
+        return text, "missing", "the response was empty"
+    status = "ok"
+    try:
+        json.loads(text)
+    except json.JSONDecodeError:
+        repaired = repair_response_text(text)
+        if repaired is None:
+            return text, "invalid_json", "the response was not valid JSON"
+        text, status = repaired, "repaired"
+
+    rules, _ = extract_rules(text)
+    if rules is None:
+        return text, "no_rules", 'the response did not contain a "rules" list'
+    if batch:
+        return text, status, None
+    if len(rules) != n_rules:
+        return text, "wrong_count", f'"rules" had {len(rules)} answers instead of {n_rules}'
+    invalid = [i + 1 for i, rule in enumerate(rules) if rule not in ANSWERS]
+    if invalid:
+        return text, "invalid_answer", f'rules {invalid} were not "yes" or "no"'
+    return text, status, None
+
+
+def count_prompt_rules(prompt, ruleset):
+    """
+    プロンプトに含まれる、ルール定義（ruleset）の評価指標の数を返します。見つからない場合は None を返します。
+    アブストラクト中の番号付きの行（"1. We propose ..." など）を数えないよう、本文がルール定義の評価指標と一致する行だけを数えます。
+    一部の評価指標だけを含むプロンプト（RuleAnswerStore や LocalRuleClassifier）では、期待する回答数がルール定義全体より少なくなります。
+    """
+    hashes = set(ruleset.hashes)
+    count = 0
+    for line in prompt.splitlines():
+        match = RULE_LINE_PATTERN.match(line)
+        if match and Rule(int(match.group(1)), match.group(2)).hash in hashes:
+            count += 1
+    return count or None
+
+
+def new_stats():
+    return {"responses": 0, "valid": 0, "repaired": 0, "reasks": 0, "recovered": 0, "invalid": 0}
+
+
+class ResponseValidator:
+    """
+    レスポンスを受信するたびに検証し、修復できないものはその場で理由を添えて再度回答を求める（ValidatingModel）。
+    シャードごとに、最初のレスポンスの有効率と再質問後の有効率を集計する。
+    """
+
+    def __init__(self, rules_text, max_reasks=1):
+        """
+        Args:
+            rules_text (str): ルール定義テキスト。プロンプトごとの期待する回答数は、この評価指標から数える。
+            max_reasks (int): 1件のレスポンスに対して再度回答を求める最大回数。
+        """
+        self.ruleset = parse_rules(rules_text)
+        self.n_rules = len(self.ruleset.rules)
+        self.max_reasks = max_reasks
+        self.current_shard = None
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # スケジューラーのワーカーへ渡すため、ロックを除いて pickle する
+        state = dict(self.__dict__)
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def wrap(self, model, limiter=None):
+        return ValidatingModel(model, self, limiter)
+
+    def start_shard(self, name):
+        """
+        以降のレスポンスを指定したシャードの集計に含める。
+        """
+        with self._lock:
+            self.current_shard = name
+            self._stats[name] = new_stats()
+
+    def record(self, **counts):
+        with self._lock:
+            stats = self._stats.setdefault(self.current_shard or "default", new_stats())
+            for key, value in counts.items():
+                stats[key] += value
+
+    def end_shard(self):
+        """
+        現在のシャードの有効率を表示して返す。
+        """
+        stats = self.stats().get(self.current_shard or "default")
+        if stats is not None:
+            print(f"レスポンスの検証: {format_stats(stats)}")
+        return stats
+
+    def pop_stats(self):
+        """
+        集計したシャードごとの統計を返し、集計をリセットする（ワーカープロセスからジョブごとに回収するため）。
+        """
+        with self._lock:
+            stats, self._stats = self._stats, {}
+        return stats
+
+    def merge_stats(self, stats):
+        """
+        別のプロセスで集計した統計（pop_stats の戻り値）を加算する。
+        """
+        with self._lock:
+            for shard, shard_stats in stats.items():
+                total = self._stats.setdefault(shard, new_stats())
+                for key, value in shard_stats.items():
+                    total[key] += value
+
+    def stats(self):
+        """
+        シャードごとの統計（レスポンス数、有効・修復・再質問・回復・無効の件数と有効率）を返す。
+        """
+        with self._lock:
+            return {shard: with_rates(shard_stats) for shard, shard_stats in self._stats.items()}
+
+    def summary(self):
+        return "\n".join(f"{shard}: {format_stats(stats)}" for shard, stats in self.stats().items())
+
+
+def with_rates(stats):
+    responses = stats["responses"]
+    first_pass = (stats["valid"] + stats["repaired"]) / responses if responses else 0.0
+    final = (stats["valid"] + stats["repaired"] + stats["recovered"]) / responses if responses else 0.0
+    return {**stats, "first_pass_rate": first_pass, "validity_rate": final}
+
+
+def format_stats(stats):
+    return (
+        f"{stats['responses']}件, 有効 {stats['first_pass_rate']:.1%}"
+        f"（修復 {stats['repaired']}件）→ 再質問後 {stats['validity_rate']:.1%}"
+        f"（再質問 {stats['reasks']}回 / 無効 {stats['invalid']}件）"
+    )
+
+
+class ValidatedResponse:
+    """
+    修復したテキストを返すレスポンス。text 以外の属性は元のレスポンスのものを返す。
+    """
+
+    def __init__(self, response, text):
+        self.response = response
+        self.text = text
+
+    def __getattr__(self, name):
+        return getattr(self.response, name)
+
+
+class ValidatingModel:
+    """
+    レスポンスを ResponseValidator で検証するラッパー。修復できないレスポンスはその場で再質問し、
+    それでも不正な場合は最後のレスポンスをそのまま返す（以降は通常のリトライとパースの扱いになる）。
+    model_name などのその他の属性は元のモデルのものを返すため、キャッシュのキーは変わらない。
+    limiter を指定した場合、再質問も最初の問い合わせと同じレートリミッターの枠を消費してから送信する。
+    """
+
+    def __init__(self, model, validator, limiter=None):
+        self.model = model
+        self.validator = validator
+        self.limiter = limiter
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def _check(self, contents, response):
+        try:
+            original = response.text
+        except Exception:
+            # ブロックされたレスポンスなど、テキストを取り出せない場合は回答なしとして扱う
+            original = None
+        prompt = str(contents)
+        text, status, error = validate_response(original, self.expected_rules(prompt), batch=BATCH_MARKER in prompt)
+        if text != original:
+            response = ValidatedResponse(response, text)
+        return response, status, error
+
+    def expected_rules(self, prompt):
+        return count_prompt_rules(prompt, self.validator.ruleset) or self.validator.n_rules
+
+    def _reask_prompt(self, contents, error):
+        prompt = str(contents)
+        return prompt + REASK_INSTRUCTION.format(error=error, n_rules=self.expected_rules(prompt))
+
+    def _record(self, first_status, status, reasks):
+        self.validator.record(
+            responses=1, valid=first_status == "ok", repaired=first_status == "repaired", reasks=reasks,
+            recovered=first_status not in VALID_STATUSES and status in VALID_STATUSES,
+            invalid=status not in VALID_STATUSES,
+        )
+
+    def generate_content(self, contents, **kwargs):
+        response, status, error = self._check(contents, self.model.generate_content(contents, **kwargs))
+        first_status, reasks = status, 0
+        while status not in VALID_STATUSES and reasks < self.validator.max_reasks:
+            reasks += 1
+            reask = self._reask_prompt(contents, error)
+            if self.limiter is not None:
+                self.limiter.wait(estimate_tokens(reask))
+            response, status, error = self._check(contents, self.model.generate_content(reask, **kwargs))
+        self._record(first_status, status, reasks)
+        return response
+
+    async def generate_content_async(self, contents, **kwargs):
+        async def generate(prompt):
+            if hasattr(self.model, "generate_content_async"):
+                return await self.model.generate_content_async(prompt, **kwargs)
+            return await asyncio.to_thread(self.model.generate_content, prompt, **kwargs)
+
+        response, status, error = self._check(contents, await generate(contents))
+        first_status, reasks = status, 0
+        while status not in VALID_STATUSES and reasks < self.validator.max_reasks:
+            reasks += 1
+            reask = self._reask_prompt(contents, error)
+            if self.limiter is not None:
+                await self.limiter.acquire(estimate_tokens(reask))
+            response, status, error = self._check(contents, await generate(reask))
+        self._record(first_status, status, reasks)
+        return response
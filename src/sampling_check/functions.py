@@ -2,46 +2,32 @@ import os
 import time
 import pandas as pd
 from tqdm import tqdm
-import json
 
-
-def create_user_message(abstract, rules):
-    return f"""
-    Abstract: {abstract}
-    
-    {rules}
-    """
+from gemini.response_cache import CachedResponse
+from gemini.response_parser import parse_responses_to_matrix, rules_matrix_to_frame, summarize_status
+from gemini.retry import call_with_retry
+from gemini.telemetry import InstrumentedModel
 
 
-def generate_response(model, abstract, rules):
-    response = model.generate_content(create_user_message(abstract, rules))
+# gemini_modules と同じ形式（三重引用符の f 文字列によるインデントの空白を送らない）
+def create_user_message(abstract, rules):
+    return f"Abstract: {abstract}\n\n{rules}"
+
+
+def generate_response(model, abstract, rules, cache=None, policy=None, breaker=None):
+    # キャッシュ済みの場合はAPIを呼び出さない
+    if cache is not None:
+        cached = cache.get(model, rules, abstract)
+        if cached is not None:
+            return cached
+    # エラーの種類に応じてリトライ
+    user_message = create_user_message(abstract, rules)
+    response = call_with_retry(lambda: model.generate_content(user_message), policy=policy, breaker=breaker)
+    if cache is not None:
+        cache.put(model, rules, abstract, response.text)
     return response
 
 
-def parse_response(response):
-    if pd.isna(response):
-        return {}
-    try:
-        # JSON形式をデコード
-        parsed = json.loads(response)
-        if isinstance(parsed, list):  # リストの場合
-            if isinstance(parsed[0], dict) and "rules" in parsed[0]:
-                rules = parsed[0]["rules"]
-            else:
-                rules = []
-        elif isinstance(parsed, dict):  # 辞書の場合
-            if "results" in parsed:  # "results"キーがある場合
-                rules = parsed["results"][0].get("rules", [])
-            else:  # "rules"キーが直接ある場合
-                rules = parsed.get("rules", [])
-        else:
-            rules = []
-        # ルールを辞書形式で返す
-        return {f"rule{i+1}": rule for i, rule in enumerate(rules)}
-    except json.JSONDecodeError:
-        return {}
-
-
 def load_csv_with_id(file_path):
     """
     CSVファイルを読み込み、IDカラムを追加して再配置します。
@@ -65,7 +51,7 @@ def load_csv_with_id(file_path):
     return df[cols]
 
 
-def process_abstracts(df, model, rules):
+def process_abstracts(df, model, rules, cache=None, preprocessor=None, policy=None, breaker=None):
     """
     データフレームからアブストラクトを抽出し、モデルを使用してレスポンスを生成します。
 
@@ -73,30 +59,43 @@ def process_abstracts(df, model, rules):
         df (pd.DataFrame): 入力データフレーム。
         model: モデルオブジェクト。
         rules (str): ルール定義テキスト。
+        cache (ResponseCache, optional): レスポンスキャッシュ。
+        preprocessor (AbstractPreprocessor, optional): モデルに送る前のアブストラクトの正規化とトークン数の上限。
+        policy (RetryPolicy, optional): リトライ方針。
+        breaker (CircuitBreaker, optional): サーキットブレーカー。
 
     Returns:
         pd.DataFrame: 生成されたレスポンスを含むデータフレーム。
     """
     # アブストラクトを辞書形式リストに変換
-    abstracts = [
-        {"abstract_id": row["ID"], "content": row["Abstract"]}
-        for _, row in df.dropna(subset=["Abstract"]).iterrows()
-    ]
+    abstracts = []
+    for field, rows in df.dropna(subset=["Abstract"]).groupby("Field", sort=False):
+        group = [{"abstract_id": abstract_id, "content": content}
+                 for abstract_id, content in zip(rows["ID"], rows["Abstract"])]
+        # 分野ごとにトークンの削減量を集計する
+        abstracts.extend(preprocessor.process(group, group=field) if preprocessor is not None else group)
 
     raw_responses = []
     for i in tqdm(range(len(abstracts))):
         abstract = abstracts[i]
-        response = generate_response(model, abstract["content"], rules)
+        try:
+            response = generate_response(model, abstract["content"], rules, cache=cache, policy=policy, breaker=breaker)
+        except Exception as e:
+            print(f"処理エラー: {e}")
+            raw_responses.append({"abstract_id": abstract["abstract_id"], "response": None})
+            continue
         raw_responses.append({
             "abstract_id": abstract["abstract_id"],
             "response": response.text
         })
-        time.sleep(3)  # インターバルを挿入
+        # キャッシュ済みの場合はAPIを呼び出していないため、インターバルを挿入しない
+        if not isinstance(response, CachedResponse):
+            time.sleep(3)  # インターバルを挿入
 
     return pd.DataFrame(raw_responses)
 
 
-def merge_and_save_results(df, results_df, output_file):
+def merge_and_save_results(df, results_df, output_file, results_store=None, source=None):
     """
     レスポンスを元のデータフレームとマージし、結果を保存します。
 
@@ -104,20 +103,30 @@ def merge_and_save_results(df, results_df, output_file):
         df (pd.DataFrame): 元のデータフレーム。
         results_df (pd.DataFrame): レスポンスデータフレーム。
         output_file (str): 保存先のCSVファイルパス。
+        results_store (ResultsStore, optional): ルール行列（int8）を保存する結果ストア。
+        source (str, optional): 入力CSVファイルのパス（結果ストアのメタデータに記録）。
+
+    Returns:
+        dict: パース状態ごとの件数。
     """
-    # レスポンスをパースして新しいカラムを作成
-    rules_df = results_df["response"].apply(parse_response).apply(pd.Series)
+    # レスポンスを int8 のルール行列に変換し、新しいカラムを一括で作成
+    matrix, status = parse_responses_to_matrix(results_df["response"].tolist())
+    rules_df = rules_matrix_to_frame(matrix, index=results_df.index)
+    if results_store is not None:
+        results_store.write_results(df, matrix, results_df["abstract_id"], output_file, source=source)
 
     # 元のデータフレームに結合
-    results_df = pd.concat([results_df, rules_df], axis=1).drop(columns=["response"])
+    results_df = pd.concat([results_df.drop(columns=["response"]), rules_df], axis=1)
     merged_df = df.merge(results_df, left_on="ID", right_on="abstract_id", how="left").drop(columns=["abstract_id"])
 
     # 結果を保存
     merged_df.to_csv(output_file, index=False, encoding="utf-8")
     print(f"結果を保存しました: {output_file}")
+    return summarize_status(status)
 
 # 関数をまとめて実行するエントリーポイント
-def create_test_data(file_path, model, rules, output_file):
+def create_test_data(file_path, model, rules, output_file, cache=None, telemetry=None, results_store=None,
+                     preprocessor=None, validator=None, policy=None, breaker=None):
     """
     CSVデータの読み込みから処理、結果保存までを一括で実行する関数。
 
@@ -126,11 +135,38 @@ def create_test_data(file_path, model, rules, output_file):
         model: モデルオブジェクト。
         rules (str): ルール定義テキスト。
         output_file (str): 結果保存先のCSVファイルパス。
+        cache (ResponseCache, optional): レスポンスキャッシュ。キャッシュ済みのアブストラクトはAPIを呼び出さない。
+        telemetry (Telemetry, optional): リクエストごとのイベントとサマリーの記録先。
+        results_store (ResultsStore, optional): ルール行列（int8）を保存する結果ストア。
+        preprocessor (AbstractPreprocessor, optional): モデルに送る前のアブストラクトの正規化とトークン数の上限。
+        validator (ResponseValidator, optional): レスポンスを受信するたびに検証し、不正なものはその場で再質問する。
+        policy (RetryPolicy, optional): リトライ方針。Noneの場合は既定の方針（エラー種別ごとの指数バックオフ）。
+        breaker (CircuitBreaker, optional): エラー率が急増した場合に処理全体を停止させるサーキットブレーカー。
     """
     df = load_csv_with_id(file_path)
     if df is None:
         return
 
-    results_df = process_abstracts(df, model, rules)
-    merge_and_save_results(df, results_df, output_file)
+    # start_shard の後は例外が発生しても end_shard を呼ぶ（process_shard と同様）
+    if telemetry is not None:
+        if not isinstance(model, InstrumentedModel):
+            model = InstrumentedModel(model, telemetry)
+        telemetry.start_shard(os.path.basename(file_path))
+
+    parse_status = None
+    try:
+        if validator is not None:
+            validator.start_shard(os.path.basename(file_path))
+            model = validator.wrap(model)
+
+        results_df = process_abstracts(df, model, rules, cache=cache, preprocessor=preprocessor, policy=policy,
+                                       breaker=breaker)
+        parse_status = merge_and_save_results(df, results_df, output_file, results_store, file_path)
+    finally:
+        if telemetry is not None:
+            telemetry.end_shard(abstracts=len(df), parse_status=parse_status)
+        if validator is not None:
+            validator.end_shard()
+    if preprocessor is not None:
+        print(f"前処理によるトークンの削減:\n{preprocessor.summary()}")
     print("処理が完了しました。")
@@ -0,0 +1,202 @@
+import warnings
+import numpy as np
+import pandas as pd
+
+from gemini.response_parser import frame_to_rules_matrix
+
+# 行を列で対応付ける場合のキー
+KEY_COLUMNS = ["Field", "Citation", "ID"]
+
+COUNT_COLUMNS = ["TP", "FP", "FN", "TN"]
+SCORE_COLUMNS = ["Precision", "Recall", "F1 Score", "Accuracy", "Cohen's Kappa"]
+
+# 混同行列のセルの番号（Gemini の回答 * 2 + 人間の回答）。どちらかが回答なしの行は INVALID
+TN, FN, FP, TP, INVALID = 0, 1, 2, 3, 4
+
+
+def find_rules(df):
+    """
+    rule1, rule2, ... の列を番号順に返します。
+    """
+    rules = [column for column in df.columns if column.startswith("rule") and column[4:].isdigit()]
+    return sorted(rules, key=lambda rule: int(rule[4:]))
+
+
+def align_results(gemini_df, human_df, rules=None, on=None):
+    """
+    Geminiと人間の評価結果を行ごとに対応付け、int8 のルール行列の組を返します。
+
+    Args:
+        gemini_df (pd.DataFrame): Geminiの評価結果。
+        human_df (pd.DataFrame): 人間の評価結果。
+        rules (list, optional): 比較する指標。Noneの場合は両方にある rule 列。
+        on (list, optional): 対応付けに使う列（例: KEY_COLUMNS）。Noneの場合は行の順番で対応付ける
+            （sampling_check_analysis.ipynb と同じ）。人間の評価結果のIDは層ごとの番号のことがあるため、
+            列で対応付けるのは両方のファイルのIDが揃っている場合のみ。
+
+    Returns:
+        tuple: (Geminiのルール行列, 人間のルール行列, 指標のリスト)。
+    """
+    if rules is None:
+        rules = [rule for rule in find_rules(gemini_df) if rule in human_df.columns]
+    if on is None:
+        if len(gemini_df) != len(human_df):
+            raise ValueError(f"行数が一致しません（{len(gemini_df)} != {len(human_df)}）。on で対応付ける列を指定してください。")
+        return frame_to_rules_matrix(gemini_df, rules), frame_to_rules_matrix(human_df, rules), rules
+
+    def prepare(df):
+        df = df.dropna(subset=on)[on + rules].copy()
+        if "Field" in on:
+            # 分野名の表記（BioChemistry / Biochemistry）の違いは区別しない
+            df["Field"] = df["Field"].str.lower()
+        return df
+
+    merged = prepare(gemini_df).merge(prepare(human_df), on=on, suffixes=("_gemini", "_human"))
+    pred = frame_to_rules_matrix(merged, [f"{rule}_gemini" for rule in rules])
+    truth = frame_to_rules_matrix(merged, [f"{rule}_human" for rule in rules])
+    return pred, truth, rules
+
+
+def confusion_codes(pred, truth):
+    """
+    ルール行列の組を混同行列のセルの番号（TN, FN, FP, TP, INVALID）の行列に変換します。
+    """
+    codes = (pred.astype(np.int8) * 2 + truth).astype(np.int8)
+    codes[(pred < 0) | (truth < 0)] = INVALID
+    return codes
+
+
+def confusion_counts(codes):
+    """
+    セルの番号の行列（...、行、指標）から、指標ごとの混同行列の件数を bincount で一括で数えます。
+    先頭の次元（ブートストラップの反復など）はそのまま残ります。
+
+    Returns:
+        np.ndarray: (...、指標, 4) の件数。最後の次元は TN, FN, FP, TP の順。
+    """
+    *batch, n_rows, n_rules = codes.shape
+    n_groups = int(np.prod(batch, dtype=np.int64)) * n_rules
+    # 反復 × 指標ごとに5つのセルの区間を割り当て、1回の bincount で数える
+    group = np.arange(n_groups).reshape(*batch, 1, n_rules)
+    flat = (group * 5 + codes).ravel()
+    counts = np.bincount(flat, minlength=n_groups * 5).reshape(*batch, n_rules, 5)
+    return counts[..., :4]
+
+
+def scores_from_counts(counts):
+    """
+    混同行列の件数から Precision, Recall, F1, Accuracy, Cohen's kappa をベクトル演算で計算します。
+    分母が0の場合は 0 とします（kappa は一致率の期待値が1の場合 NaN）。
+
+    Returns:
+        dict: {指標名: 配列}。
+    """
+    counts = counts.astype(float)
+    tn, fn, fp, tp = counts[..., 0], counts[..., 1], counts[..., 2], counts[..., 3]
+    n = tn + fn + fp + tp
+
+    def divide(a, b, fill=0.0):
+        return np.divide(a, b, out=np.full(np.broadcast(a, b).shape, fill), where=b > 0)
+
+    precision = divide(tp, tp + fp)
+    recall = divide(tp, tp + fn)
+    f1 = divide(2 * precision * recall, precision + recall)
+    accuracy = divide(tp + tn, n)
+    # 偶然による一致率の期待値
+    expected = divide((tp + fp) * (tp + fn) + (fn + tn) * (fp + tn), n * n)
+    kappa = divide(accuracy - expected, 1 - expected, fill=np.nan)
+    return {"Precision": precision, "Recall": recall, "F1 Score": f1, "Accuracy": accuracy, "Cohen's Kappa": kappa}
+
+
+def bootstrap_intervals(codes, n_boot=1000, alpha=0.05, seed=0, block_size=200):
+    """
+    行を復元抽出したブートストラップで、各スコアの信頼区間を指標ごとに計算します。
+    反復はブロック単位でまとめて生成し、混同行列もまとめて数えます。
+
+    Returns:
+        dict: {スコア名: (下限の配列, 上限の配列)}。
+    """
+    rng = np.random.default_rng(seed)
+    n_rows = codes.shape[0]
+    samples = {name: [] for name in SCORE_COLUMNS}
+    for start in range(0, n_boot, block_size):
+        size = min(block_size, n_boot - start)
+        rows = rng.integers(0, n_rows, size=(size, n_rows))
+        scores = scores_from_counts(confusion_counts(codes[rows]))
+        for name in SCORE_COLUMNS:
+            samples[name].append(scores[name])
+
+    intervals = {}
+    for name, values in samples.items():
+        values = np.concatenate(values)
+        with warnings.catch_warnings():
+            # 全ての反復で kappa が定義されない指標は NaN のままにする
+            warnings.simplefilter("ignore", RuntimeWarning)
+            lower, upper = np.nanquantile(values, [alpha / 2, 1 - alpha / 2], axis=0)
+        intervals[name] = (lower, upper)
+    return intervals
+
+
+def calculate_metrics(gemini_df, human_df, rules=None, n_boot=0, alpha=0.05, seed=0, average=True, on=None):
+    """
+    Geminiと人間の評価結果から、指標ごとの TP/FP/FN/TN と各スコアを計算します。
+
+    Args:
+        gemini_df (pd.DataFrame): Geminiの評価結果（sampling_check_by_gemini*.csv）。
+        human_df (pd.DataFrame): 人間の評価結果（sampling_check_by_human*.csv）。
+        rules (list, optional): 比較する指標。
+        n_boot (int): ブートストラップの反復回数。0の場合は信頼区間を計算しない。
+        alpha (float): 信頼区間の有意水準。
+        seed (int): ブートストラップの乱数のシード。
+        average (bool): Trueの場合、先頭にスコアの平均（Average）の行を追加する。
+        on (list, optional): 行の対応付けに使う列（align_results を参照）。
+
+    Returns:
+        pd.DataFrame: sampling_check_metrics*.csv と同じ列に Cohen's Kappa（と信頼区間）を加えたデータフレーム。
+    """
+    pred, truth, rules = align_results(gemini_df, human_df, rules, on)
+    codes = confusion_codes(pred, truth)
+    counts = confusion_counts(codes)
+    scores = scores_from_counts(counts)
+
+    metrics_df = pd.DataFrame({"Rule": rules, "TP": counts[:, TP], "FP": counts[:, FP], "FN": counts[:, FN],
+                               "TN": counts[:, TN]})
+    for name in SCORE_COLUMNS:
+        metrics_df[name] = scores[name]
+    if n_boot:
+        for name, (lower, upper) in bootstrap_intervals(codes, n_boot, alpha, seed).items():
+            metrics_df[f"{name} CI Lower"] = lower
+            metrics_df[f"{name} CI Upper"] = upper
+
+    if average:
+        average_row = {"Rule": "Average", **metrics_df[SCORE_COLUMNS].mean().to_dict()}
+        # 列の順は指標ごとの行に合わせる（Rule, TP, FP, FN, TN, Precision, Recall, ...）
+        metrics_df = pd.concat([pd.DataFrame([average_row]), metrics_df], ignore_index=True)[metrics_df.columns]
+    return metrics_df
+
+
+def compare_runs(runs, human_df, rules=None, n_boot=0, alpha=0.05, seed=0, on=None):
+    """
+    複数のGeminiの評価結果（実行やルール定義のバージョンごと）を、同じ人間の評価結果と一度に比較します。
+
+    Args:
+        runs (dict): {実行名: Geminiの評価結果のデータフレーム、またはCSVのパス}。
+        human_df (pd.DataFrame or str): 人間の評価結果（またはCSVのパス）。
+        rules (list, optional): 比較する指標。
+        n_boot (int): ブートストラップの反復回数。
+
+    Returns:
+        tuple: (実行名の列を加えた指標ごとのデータフレーム, 実行ごとの平均スコアのデータフレーム)。
+    """
+    if isinstance(human_df, str):
+        human_df = pd.read_csv(human_df)
+    frames = []
+    for name, gemini_df in runs.items():
+        if isinstance(gemini_df, str):
+            gemini_df = pd.read_csv(gemini_df)
+        metrics_df = calculate_metrics(gemini_df, human_df, rules, n_boot, alpha, seed, average=False, on=on)
+        metrics_df.insert(0, "Run", name)
+        frames.append(metrics_df)
+    metrics_df = pd.concat(frames, ignore_index=True)
+    summary_df = metrics_df.groupby("Run", sort=False)[SCORE_COLUMNS].mean().reset_index()
+    return metrics_df, summary_df
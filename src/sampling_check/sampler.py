@@ -0,0 +1,147 @@
+import os
+import re
+import zlib
+import numpy as np
+import pandas as pd
+
+data_path = "../../data/csv"
+fields = ["Biochemistry_Molecular_Biology", "Chemistry", "Engineering", "Materials_Science", "Physics"]
+citations = ["high", "low"]
+
+OUTPUT_COLUMNS = ["Field", "Citation", "ID", "Title", "Abstract"]
+
+# 1度に読み込む行数
+DEFAULT_CHUNKSIZE = 10_000
+
+# "Physics_high1000_3.csv" のシャード番号
+SHARD_NUMBER_PATTERN = re.compile(r"_(\d+)\.csv$")
+
+
+def find_field_files(data_path, field, citation):
+    """
+    分野・カテゴリのCSVファイルを行の順に返します。
+    結合済みのファイル（`{分野名}_{カテゴリ}1000.csv`）があればそれを、なければ
+    分割済みのファイル（`{分野名}/{分野名}_{カテゴリ}1000_{番号}.csv`）を番号順に返します。
+    """
+    combined = os.path.join(data_path, f"{field}_{citation}1000.csv")
+    if os.path.exists(combined):
+        return [combined]
+    field_dir = os.path.join(data_path, field)
+    if not os.path.isdir(field_dir):
+        return []
+    prefix = f"{field}_{citation}1000_"
+    shards = [f for f in os.listdir(field_dir) if f.startswith(prefix) and SHARD_NUMBER_PATTERN.search(f)]
+    shards.sort(key=lambda f: int(SHARD_NUMBER_PATTERN.search(f).group(1)))
+    return [os.path.join(field_dir, f) for f in shards]
+
+
+def stratum_key(field, citation):
+    # 既存のサンプリングチェックの分野名（例: BioChemistry_Molecular_Biology）と大文字・小文字を区別せずに照合する
+    return field.lower(), citation.lower()
+
+
+def load_excluded(paths):
+    """
+    過去のサンプリングチェックのCSVから、使用済みの (分野, カテゴリ, ID) の集合を読み込みます。
+    """
+    excluded = {}
+    for path in paths or []:
+        df = pd.read_csv(path, usecols=["Field", "Citation", "ID"], encoding="utf-8")
+        for field, citation, row_id in zip(df["Field"], df["Citation"], df["ID"]):
+            excluded.setdefault(stratum_key(field, citation), set()).add(int(row_id))
+    return excluded
+
+
+class Reservoir:
+    """
+    1つの層の行を1度だけ走査して、一様に k 件を選ぶリザーバーサンプリング（Algorithm R）。
+    チャンク単位で乱数をまとめて生成し、置き換えが発生した行だけを記録します。
+    """
+
+    def __init__(self, k, rng):
+        self.k = k
+        self.rng = rng
+        self.seen = 0
+        self.items = []
+
+    def offer(self, ids, titles, abstracts):
+        n = len(ids)
+        if n == 0 or self.k == 0:
+            self.seen += n
+            return
+        # リザーバーが埋まるまではそのまま追加する
+        fill = min(max(self.k - self.seen, 0), n)
+        self.items.extend(zip(ids[:fill], titles[:fill], abstracts[:fill]))
+        if fill < n:
+            # t 件目の行は確率 k/t で、ランダムな位置の行と置き換える
+            seen = self.seen + np.arange(fill + 1, n + 1)
+            slots = self.rng.integers(0, seen)
+            for i in np.flatnonzero(slots < self.k):
+                self.items[slots[i]] = (ids[fill + i], titles[fill + i], abstracts[fill + i])
+        self.seen += n
+
+
+def sample_stratum(files, k, rng, excluded=None, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    1つの層（分野 × カテゴリ）のファイルを順に走査し、アブストラクトのある行から k 件を選びます。
+    IDは層のファイルを連結したときの行番号（1始まり）です。
+
+    Returns:
+        list: (ID, タイトル, アブストラクト) のリスト（ID順）。
+    """
+    reservoir = Reservoir(k, rng)
+    offset = 0
+    for file_path in files:
+        for chunk in pd.read_csv(file_path, usecols=["Title", "Abstract"], chunksize=chunksize, encoding="utf-8"):
+            ids = np.arange(offset + 1, offset + len(chunk) + 1)
+            offset += len(chunk)
+            valid = chunk["Abstract"].notna().to_numpy()
+            if excluded:
+                valid &= ~np.isin(ids, list(excluded))
+            reservoir.offer(ids[valid], chunk["Title"].to_numpy()[valid], chunk["Abstract"].to_numpy()[valid])
+    if reservoir.seen < k:
+        print(f"候補が {k} 件に足りません（{reservoir.seen} 件）: {files[0] if files else ''}")
+    return sorted(reservoir.items, key=lambda item: item[0])
+
+
+def stratum_rng(seed, field, citation):
+    # 層ごとに独立した乱数列を使い、層の順番や追加に関わらず同じシードなら同じ標本を選ぶ
+    return np.random.default_rng([seed, zlib.crc32(field.encode("utf-8")), zlib.crc32(citation.encode("utf-8"))])
+
+
+def sample_abstracts(quotas=10, data_path=data_path, fields=fields, citations=citations, seed=0, exclude_files=None,
+                     field_labels=None, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    分野 × カテゴリで層化し、各層のファイルを1度だけ走査してシード付きのリザーバーサンプリングで抽出します。
+
+    Args:
+        quotas (int or dict): 層ごとの抽出件数。辞書の場合は {(分野名, カテゴリ): 件数} で指定し、ないものは抽出しない。
+        data_path (str): CSVファイルが格納されているフォルダのパス。
+        fields (list): 分野名（ディレクトリ名）のリスト。
+        citations (list): 引用分類のリスト。
+        seed (int): 乱数のシード。同じシード・データなら同じ標本になります。
+        exclude_files (list, optional): 過去のサンプリングチェックのCSV。含まれる行は抽出しません。
+        field_labels (dict, optional): 出力の Field 列に使う分野名（{ディレクトリ名: 表示名}）。
+        chunksize (int): 1度に読み込む行数。
+
+    Returns:
+        pd.DataFrame: Field, Citation, ID, Title, Abstract 列のデータフレーム。
+    """
+    excluded = load_excluded(exclude_files)
+    field_labels = field_labels or {}
+    columns = {column: [] for column in OUTPUT_COLUMNS}
+    for field in fields:
+        for citation in citations:
+            k = quotas.get((field, citation), 0) if isinstance(quotas, dict) else quotas
+            files = find_field_files(data_path, field, citation)
+            if not k or not files:
+                continue
+            rows = sample_stratum(files, k, stratum_rng(seed, field, citation),
+                                  excluded.get(stratum_key(field, citation)), chunksize)
+            columns["Field"].extend([field_labels.get(field, field)] * len(rows))
+            columns["Citation"].extend([citation] * len(rows))
+            for column, values in zip(("ID", "Title", "Abstract"), zip(*rows) if rows else ((), (), ())):
+                columns[column].extend(values)
+
+    # 最後に1度だけデータフレームを作成する
+    return pd.DataFrame(columns, columns=OUTPUT_COLUMNS)
@@ -1,52 +1,28 @@
 import os
-import pandas as pd
+
+from sampling_check.sampler import sample_abstracts
 
 data_path = "../../data/csv/all"
-fields = ["BioChemistry_Molecular_Biology", "Chemistry", "Engineering", "Materials_Science", "Physics"]
+fields = ["Biochemistry_Molecular_Biology", "Chemistry", "Engineering", "Materials_Science", "Physics"]
 citations = ["high", "low"]
 
 
-def process_csv_files(output_file, data_path=data_path, fields=fields, citations=citations):
+def process_csv_files(output_file, data_path=data_path, fields=fields, citations=citations, quotas=10, seed=0,
+                      exclude_files=None):
     """
-    指定されたフォルダ内のCSVファイルを処理し、指定条件に基づいてデータを抽出・保存します。
+    指定されたフォルダ内のCSVファイルから、分野 × 引用分類ごとにアブストラクトを抽出・保存します。
+    各ファイルは1度だけ走査し、シード付きのリザーバーサンプリングで抽出します（sample_abstracts）。
 
     Args:
-        data_path (str): CSVファイルが格納されているフォルダのパス。
+        output_file (str): 保存先のCSVファイルパス。
+        data_path (str): CSVファイル（結合済み、または分野ごとのディレクトリに分割済み）が格納されているフォルダのパス。
         fields (list): フィールド名のリスト。
         citations (list): 引用分類のリスト。
-        output_file (str): 保存先のCSVファイルパス。
+        quotas (int or dict): 層ごとの抽出件数（{(分野名, 引用分類): 件数} でも指定可能）。
+        seed (int): 乱数のシード。
+        exclude_files (list, optional): 過去のサンプリングチェックのCSV。含まれる行は抽出しません。
     """
-    # 最終的に格納するデータフレーム
-    final_df = pd.DataFrame(columns=["Field", "Citation", "ID", "Title", "Abstract"])
-
-    # 各フィールドと分類に対応するファイルを処理
-    for field in fields:
-        for citation in citations:
-            file_name = f"{field}_{citation}1000.csv"
-            file_path = os.path.join(data_path, file_name)
-
-            if os.path.exists(file_path):
-                # CSVを読み込み
-                df = pd.read_csv(file_path, encoding="utf-8")
-
-                # アブストラクトが欠損していない行を選択
-                valid_rows = df.dropna(subset=["Abstract"])
-
-                # 先頭10件を取得
-                selected_rows = valid_rows.head(10)
-
-                # データフレームに格納するためのリストを作成
-                for idx, row in selected_rows.iterrows():
-                    final_df = pd.concat([
-                        final_df,
-                        pd.DataFrame({
-                            "Field": [field],
-                            "Citation": [citation],
-                            "ID": [idx + 1],
-                            "Title": [row["Title"]],
-                            "Abstract": [row["Abstract"]],
-                        })
-                    ], ignore_index=True)
+    final_df = sample_abstracts(quotas, data_path, fields, citations, seed=seed, exclude_files=exclude_files)
 
     # DataFrameをCSVファイルとして保存
     final_df.to_csv(output_file, index=False, encoding="utf-8")
@@ -0,0 +1,33 @@
+import os
+import sys
+
+import pytest
+
+# cli.py と同様に src を基準として gemini / analysis などのパッケージを読み込む
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+RULES_PATH = os.path.join(SRC_DIR, "prompt", "rules.txt")
+sys.path.insert(0, SRC_DIR)
+
+
+@pytest.fixture
+def rules():
+    with open(RULES_PATH, "r", encoding="utf-8") as file:
+        return file.read()
+
+
+@pytest.fixture
+def shard_file(tmp_path):
+    """
+    アブストラクト8件（うち1件は空）の入力CSV（シャード）を作成し、そのパスを返す。
+    """
+    import pandas as pd
+
+    input_dir = tmp_path / "input" / "Physics"
+    input_dir.mkdir(parents=True)
+    path = input_dir / "Physics_high1000_1.csv"
+    pd.DataFrame({
+        "Title": [f"Title {i}" for i in range(8)],
+        "Abstract": [f"Abstract number {i}. We study topic {i} and report the results." for i in range(7)] + [None],
+        "DOI": [f"10.1000/{i}" for i in range(8)],
+    }).to_csv(path, index=False)
+    return str(path)
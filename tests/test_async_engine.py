@@ -0,0 +1,84 @@
+import time
+
+import pytest
+
+from gemini.async_engine import generate_content_with_retry_async, process_requests_async, run_async
+from gemini.fake_model import FakeModel
+from gemini.gemini_modules import generate_content_with_retry
+from gemini.rate_limiter import RateLimiter
+from gemini.retry import RetryExhaustedError, RetryPolicy
+
+# リトライの待ち時間を0にした方針（クォータ超過は最大6回試行する）
+NO_WAIT_POLICY = RetryPolicy(max_attempts=3, base_delay=0, jitter=False)
+
+
+class CountingLimiter(RateLimiter):
+    """
+    枠を予約した回数を数えるレートリミッター。
+    """
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.reservations = 0
+
+    def reserve(self, tokens=0):
+        self.reservations += 1
+        return super().reserve(tokens)
+
+
+def build_requests(n):
+    return [{"abstract_id": i, "message": f"Abstract: abstract {i}\n\n1. Rule"} for i in range(n)]
+
+
+def test_concurrency_limit_is_respected():
+    model = FakeModel(latency=0.02)
+    results = run_async(process_requests_async(model, build_requests(20), concurrency=4, policy=NO_WAIT_POLICY))
+
+    assert model.max_in_flight == 4
+    assert model.calls == 20
+    # 完了順に関わらず入力順に返す
+    assert [result["abstract_id"] for result in results] == list(range(20))
+    assert all(result["response"] is not None for result in results)
+
+
+def test_rpm_limit_paces_concurrent_requests():
+    # 1件ずつ（0.1秒間隔で）送信する設定
+    limiter = RateLimiter(rpm=600, burst=0)
+    model = FakeModel()
+    start = time.perf_counter()
+    run_async(process_requests_async(model, build_requests(6), concurrency=6, limiter=limiter, policy=NO_WAIT_POLICY))
+    elapsed = time.perf_counter() - start
+
+    assert model.calls == 6
+    assert elapsed >= 0.5 - 0.05
+
+
+def test_bucket_starts_with_a_short_burst():
+    limiter = RateLimiter(rpm=60)
+    delays = [limiter.reserve() for _ in range(4)]
+
+    # 既定では2秒分の枠だけを待たずに送信し、1分間分をまとめて送信しない
+    assert delays[:2] == [0.0, 0.0]
+    assert delays[2] == pytest.approx(1.0, abs=0.05)
+    assert delays[3] == pytest.approx(2.0, abs=0.05)
+
+
+def test_sync_retries_take_a_limiter_slot_per_attempt():
+    limiter = CountingLimiter(rpm=1_000_000)
+    model = FakeModel(quota_error_rate=1.0)
+    with pytest.raises(RetryExhaustedError):
+        generate_content_with_retry(model, "Abstract: a\n\n1. Rule", policy=NO_WAIT_POLICY, limiter=limiter)
+
+    assert model.calls == NO_WAIT_POLICY.attempts_for("quota")
+    assert limiter.reservations == model.calls
+
+
+def test_async_retries_take_a_limiter_slot_per_attempt():
+    limiter = CountingLimiter(rpm=1_000_000)
+    model = FakeModel(quota_error_rate=1.0)
+    with pytest.raises(RetryExhaustedError):
+        run_async(generate_content_with_retry_async(model, "Abstract: a\n\n1. Rule", limiter=limiter,
+                                                    policy=NO_WAIT_POLICY))
+
+    assert model.calls == NO_WAIT_POLICY.attempts_for("quota")
+    assert limiter.reservations == model.calls
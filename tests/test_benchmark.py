@@ -0,0 +1,60 @@
+import json
+
+from gemini.benchmark import SCENARIOS, compare_with_baseline, run_scenario, save_baseline
+
+# 障害を含むフェイクモデルの設定（障害の有無はプロンプトと試行回数から決まる）
+MODEL_OPTIONS = {"latency": 0, "quota_error_rate": 0.2, "server_error_rate": 0.1, "malformed_rate": 0.1, "seed": 0}
+POLICY_OPTIONS = {"base_delay": 0, "jitter": False}
+COUNTED_METRICS = ["shards", "abstracts", "answered", "requests", "retries"]
+
+
+def run(name, shard_file, rules):
+    return run_scenario(name, [shard_file], rules, model_options=MODEL_OPTIONS, policy_options=POLICY_OPTIONS,
+                        **SCENARIOS[name])
+
+
+def counts(result):
+    return {metric: result[metric] for metric in COUNTED_METRICS}
+
+
+def test_counts_are_stable_across_runs(shard_file, rules):
+    first = run("concurrent", shard_file, rules)
+    second = run("concurrent", shard_file, rules)
+
+    assert counts(first) == counts(second)
+    assert first["abstracts"] == 7
+    assert first["retries"] > 0
+    assert first["requests"] == 7 + first["retries"]
+
+
+def test_counts_do_not_depend_on_concurrency(shard_file, rules):
+    serial = run("serial", shard_file, rules)
+    concurrent = run("concurrent", shard_file, rules)
+
+    assert counts(serial) == counts(concurrent)
+
+
+def test_batched_scenario_answers_every_abstract(shard_file, rules):
+    result = run_scenario("batched", [shard_file], rules, model_options={"latency": 0},
+                          policy_options=POLICY_OPTIONS, **SCENARIOS["batched"])
+
+    assert result["answered"] == result["abstracts"] == 7
+    # 5件ずつまとめて送信する
+    assert result["requests"] == 2
+
+
+def test_baseline_comparison(tmp_path, shard_file, rules):
+    results = [run("serial", shard_file, rules)]
+    path = str(tmp_path / "baseline.json")
+    save_baseline(results, path)
+    assert compare_with_baseline(results, path) == []
+
+    # ベースラインよりリクエスト数が増えた場合は悪化として報告する
+    with open(path, "r", encoding="utf-8") as file:
+        baseline = json.load(file)
+    baseline["results"]["serial"]["requests"] = results[0]["requests"] // 2
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(baseline, file)
+    regressions = compare_with_baseline(results, path)
+    assert len(regressions) == 1
+    assert regressions[0].startswith("serial: requests")
@@ -0,0 +1,55 @@
+import os
+import json
+import subprocess
+import sys
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# CLI の起動やパイプラインのモジュールの読み込みだけでは読み込まない重いパッケージ
+HEAVY_MODULES = ["pandas", "matplotlib", "google.generativeai"]
+
+# 起動時の読み込みにかける時間の上限（秒）。pandas や matplotlib を読み込むと大きく超える
+IMPORT_BUDGET_SECONDS = 1.0
+
+# `python src/cli.py --help` と同じように cli.py を実行し、読み込まれたモジュールと所要時間を出力する
+CHILD_CODE = """
+import contextlib, io, json, runpy, sys, time
+start = time.perf_counter()
+sys.argv = ["src/cli.py", "--help"]
+with contextlib.redirect_stdout(io.StringIO()):
+    try:
+        runpy.run_path("src/cli.py", run_name="__main__")
+    except SystemExit as e:
+        code = e.code
+help_seconds = time.perf_counter() - start
+sys.path.insert(0, "src")
+import gemini.gemini_modules
+print(json.dumps({"code": code, "modules": sorted(sys.modules), "help_seconds": help_seconds,
+                  "total_seconds": time.perf_counter() - start}))
+"""
+
+
+def run_child():
+    result = subprocess.run([sys.executable, "-c", CHILD_CODE], cwd=ROOT_DIR, capture_output=True, text=True,
+                            timeout=60)
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_cli_help_runs():
+    result = subprocess.run([sys.executable, "src/cli.py", "--help"], cwd=ROOT_DIR, capture_output=True, text=True,
+                            timeout=60)
+    assert result.returncode == 0, result.stderr
+    assert "evaluate" in result.stdout
+
+
+def test_help_and_pipeline_import_do_not_load_heavy_modules():
+    child = run_child()
+    assert child["code"] in (0, None)
+    loaded = [module for module in HEAVY_MODULES if module in child["modules"]]
+    assert loaded == []
+
+
+def test_import_time_budget():
+    child = run_child()
+    assert child["total_seconds"] < IMPORT_BUDGET_SECONDS, child
@@ -0,0 +1,111 @@
+import pandas as pd
+import pytest
+
+from gemini.fake_model import FakeAPIError, FakeModel
+from gemini.gemini_modules import process_shard, redrive_dead_letters
+from gemini.rate_limiter import RateLimiter
+from gemini.retry import (
+    CLIENT, MALFORMED, OTHER, QUOTA, SERVER, TIMEOUT, CircuitBreaker, DeadLetterQueue, MalformedResponseError,
+    RetryExhaustedError, RetryPolicy, call_with_retry, classify_error,
+)
+
+# リトライの待ち時間を0にした方針（クォータ超過は最大6回、サーバーエラーは3回、不正なJSONは2回試行する）
+NO_WAIT_POLICY = RetryPolicy(max_attempts=3, base_delay=0, jitter=False)
+
+
+@pytest.mark.parametrize("error, expected", [
+    (FakeAPIError(429), QUOTA),
+    (FakeAPIError(503), SERVER),
+    (TimeoutError("timed out"), TIMEOUT),
+    (FakeAPIError(504), TIMEOUT),
+    (MalformedResponseError("invalid_json"), MALFORMED),
+    (FakeAPIError(400), CLIENT),
+    (ValueError("unknown"), OTHER),
+    (RetryExhaustedError(QUOTA, FakeAPIError(429)), QUOTA),
+])
+def test_classify_error(error, expected):
+    assert classify_error(error) == expected
+
+
+@pytest.mark.parametrize("model_options, error_class", [
+    ({"quota_error_rate": 1.0}, QUOTA),
+    ({"server_error_rate": 1.0}, SERVER),
+    ({"timeout_rate": 1.0}, TIMEOUT),
+    ({"malformed_rate": 1.0}, MALFORMED),
+])
+def test_attempts_depend_on_error_class(model_options, error_class):
+    model = FakeModel(**model_options)
+    with pytest.raises(RetryExhaustedError) as raised:
+        call_with_retry(lambda: model.generate_content("Abstract: a\n\n1. Rule"), policy=NO_WAIT_POLICY)
+
+    assert raised.value.error_class == error_class
+    assert model.calls == NO_WAIT_POLICY.attempts_for(error_class)
+
+
+def test_client_errors_are_not_retried():
+    calls = []
+
+    def request():
+        calls.append(1)
+        raise FakeAPIError(400)
+
+    with pytest.raises(RetryExhaustedError):
+        call_with_retry(request, policy=NO_WAIT_POLICY)
+    assert len(calls) == 1
+
+
+def test_transient_errors_recover():
+    # 同じプロンプトの試行ごとに障害の有無が変わるため、一部のリクエストはリトライで成功する
+    model = FakeModel(quota_error_rate=0.5, seed=0)
+    responses = [call_with_retry(lambda i=i: model.generate_content(f"Abstract: {i}\n\n1. Rule"), policy=NO_WAIT_POLICY)
+                 for i in range(20)]
+
+    assert all(response.text for response in responses)
+    assert model.retries > 0
+    assert model.calls == 20 + model.retries
+
+
+def test_breaker_trips_on_api_errors():
+    breaker = CircuitBreaker(window=4, threshold=0.5, cooldown=0, min_calls=4)
+    for _ in range(4):
+        breaker.record(False, QUOTA)
+    assert breaker.trips == 1
+
+    # リクエスト自体の誤りはAPIの障害ではないため数えない
+    for _ in range(4):
+        breaker.record(False, CLIENT)
+    assert breaker.trips == 1
+
+
+def test_breaker_trips_during_retries():
+    breaker = CircuitBreaker(window=4, threshold=0.5, cooldown=0, min_calls=4)
+    model = FakeModel(server_error_rate=1.0)
+    for i in range(2):
+        with pytest.raises(RetryExhaustedError):
+            call_with_retry(lambda i=i: model.generate_content(f"Abstract: {i}\n\n1. Rule"), policy=NO_WAIT_POLICY,
+                            breaker=breaker)
+
+    assert model.calls == 6
+    assert breaker.trips == 1
+
+
+def test_dead_letter_redrive(tmp_path, rules, shard_file):
+    output_dir = tmp_path / "output" / "Physics"
+    output_dir.mkdir(parents=True)
+    output_file = str(output_dir / "Physics_high1000_1.csv")
+    dead_letter = DeadLetterQueue(str(tmp_path / "dead_letter.jsonl"))
+    options = {"limiter": RateLimiter(rpm=1_000_000), "policy": NO_WAIT_POLICY}
+
+    process_shard(FakeModel(server_error_rate=1.0), rules, shard_file, output_file, dead_letter=dead_letter, **options)
+    records = dead_letter.load()
+    assert len(records) == 7
+    assert {record["error_class"] for record in records} == {SERVER}
+    # すべて失敗したシャードにはルール列がない
+    assert "rule1" not in pd.read_csv(output_file).columns
+
+    healthy = FakeModel()
+    redrive_dead_letters(healthy, rules, dead_letter, **options)
+    assert dead_letter.load() == []
+    assert healthy.calls == 7
+    results = pd.read_csv(output_file)
+    assert results.loc[results["Abstract"].notna(), "rule1"].notna().all()
@@ -0,0 +1,125 @@
+import pandas as pd
+
+from gemini.fake_model import FakeModel
+from gemini.gemini_modules import create_user_message, process_shard
+from gemini.rate_limiter import RateLimiter
+from gemini.response_parser import extract_rules
+from gemini.retry import RetryPolicy
+from gemini.validation import REASK_INSTRUCTION, ResponseValidator, count_prompt_rules
+
+NO_WAIT_POLICY = RetryPolicy(max_attempts=3, base_delay=0, jitter=False)
+
+
+class RecordingModel:
+    """
+    送信したプロンプトを記録するラッパー。
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.prompts = []
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def generate_content(self, contents, **kwargs):
+        self.prompts.append(str(contents))
+        return self.model.generate_content(contents, **kwargs)
+
+
+class CountingLimiter(RateLimiter):
+    """
+    枠を予約した回数を数えるレートリミッター。
+    """
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.reservations = 0
+
+    def reserve(self, tokens=0):
+        self.reservations += 1
+        return super().reserve(tokens)
+
+
+def test_missing_rule_triggers_reask(rules):
+    validator = ResponseValidator(rules, max_reasks=2)
+    fake = FakeModel(missing_rule_rate=1.0)
+    model = RecordingModel(fake)
+    response = validator.wrap(model).generate_content(create_user_message("We study a topic.", rules))
+
+    # 再質問しても回答が欠けている場合は、最後のレスポンスをそのまま返す
+    assert len(extract_rules(response.text)[0]) == validator.n_rules - 1
+    assert fake.calls == 3
+    assert all(REASK_INSTRUCTION.split("{")[0] in prompt for prompt in model.prompts[1:])
+    assert f"instead of {validator.n_rules}" in model.prompts[1]
+    stats = validator.stats()["default"]
+    assert (stats["responses"], stats["reasks"], stats["invalid"], stats["recovered"]) == (1, 2, 1, 0)
+
+
+def test_reask_recovers_invalid_responses(rules):
+    validator = ResponseValidator(rules, max_reasks=1)
+    model = validator.wrap(FakeModel(missing_rule_rate=0.5, seed=0))
+    for i in range(20):
+        model.generate_content(create_user_message(f"We study topic {i}.", rules))
+
+    stats = validator.stats()["default"]
+    assert stats["responses"] == 20
+    assert stats["reasks"] > 0
+    assert stats["recovered"] > 0
+    assert stats["validity_rate"] > stats["first_pass_rate"]
+
+
+def test_valid_and_repaired_responses_are_not_reasked(rules):
+    validator = ResponseValidator(rules)
+    fake = FakeModel(fenced_rate=0.5, seed=0)
+    model = validator.wrap(fake)
+    for i in range(10):
+        response = model.generate_content(create_user_message(f"We study topic {i}.", rules))
+        assert len(extract_rules(response.text)[0]) == validator.n_rules
+
+    stats = validator.stats()["default"]
+    assert stats["reasks"] == 0
+    assert stats["repaired"] > 0
+    assert fake.calls == 10
+
+
+def test_numbered_lines_in_abstract_are_not_counted(rules):
+    validator = ResponseValidator(rules)
+    abstract = "1. We propose a new method.\n2. We evaluate it on three datasets."
+    prompt = create_user_message(abstract, rules)
+    assert count_prompt_rules(prompt, validator.ruleset) == validator.n_rules
+
+    fake = FakeModel()
+    validator.wrap(fake).generate_content(prompt)
+    assert fake.calls == 1
+    assert validator.stats()["default"]["reasks"] == 0
+
+
+def test_reask_takes_a_limiter_slot(rules):
+    validator = ResponseValidator(rules, max_reasks=2)
+    limiter = CountingLimiter(rpm=1_000_000)
+    validator.wrap(FakeModel(missing_rule_rate=1.0), limiter).generate_content(create_user_message("a", rules))
+
+    # 最初の問い合わせの枠は呼び出し側が取るため、再質問の分だけ予約する
+    assert limiter.reservations == 2
+
+
+def test_validator_in_pipeline(tmp_path, rules, shard_file):
+    output_dir = tmp_path / "output"
+    output_dir.mkdir()
+    output_file = str(output_dir / "Physics_high1000_1.csv")
+    validator = ResponseValidator(rules, max_reasks=1)
+    limiter = CountingLimiter(rpm=1_000_000)
+    fake = FakeModel(missing_rule_rate=0.5, seed=0)
+
+    process_shard(fake, rules, shard_file, output_file, limiter=limiter, policy=NO_WAIT_POLICY, validator=validator)
+    stats = validator.stats()["Physics_high1000_1.csv"]
+    assert stats["responses"] == 7
+    assert stats["reasks"] > 0
+    assert limiter.reservations == fake.calls
+
+    # 再質問後も不正なレスポンスは、末尾の評価指標が欠けた部分的な結果として保存される
+    results = pd.read_csv(output_file)
+    last_rule = f"rule{validator.n_rules}"
+    assert results["rule1"].notna().sum() == 7
+    assert results[last_rule].notna().sum() == stats["valid"] + stats["repaired"] + stats["recovered"]